@@ -3,6 +3,8 @@
 #
 # See allnoconfig_simpler.py for a much simpler version. This more roundabout
 # version demonstrates some tree walking and value processing.
+# Kconfig.allnoconfig() implements the same logic, but avoids revisiting
+# unaffected symbols.
 #
 # Usage:
 #
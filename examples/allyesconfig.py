@@ -3,7 +3,8 @@
 #
 # This example is implemented a bit differently from allnoconfig.py to
 # demonstrate some other possibilities. A variant similar to
-# allnoconfig_simpler.py could be constructed too.
+# allnoconfig_simpler.py could be constructed too. Kconfig.allyesconfig()
+# implements the same logic, but avoids revisiting unaffected symbols.
 #
 # In theory, we need to handle choices in two different modes:
 #
@@ -1,6 +1,13 @@
 # Prints all symbols, choices, menus, and comments that reference a symbol with
 # a particular name in any of their properties or property conditions.
-# Demonstrates expression fetching and walking.
+# Demonstrates Symbol.referenced_by, which avoids having to walk the entire
+# menu tree and every expression for each lookup.
+#
+# Symbol.referenced_by only covers non-constant symbols, and includes
+# references from 'depends on'. Compared to earlier versions of this script,
+# which walked the menu tree, quoted references like "X86" are no longer
+# found, and menu nodes that only reference the symbol in 'depends on' (e.g.
+# promptless symbols without defaults) are now listed too.
 #
 # Usage:
 #
@@ -11,7 +18,7 @@
 #
 #   Found 452 locations that reference 'X86':
 #   
-#   ========== Location 1 (init/Kconfig:1122) ==========
+#   ========== Location 1 (init/Kconfig:1122, default) ==========
 #   
 #   config SGETMASK_SYSCALL
 #           bool
@@ -40,7 +47,7 @@
 #   
 #   menu "General setup"
 #   
-#   ========== Location 2 (arch/Kconfig:28) ==========
+#   ========== Location 2 (arch/Kconfig:28, prompt, default, depends on) ==========
 #   
 #   config OPROFILE_EVENT_MULTIPLEX
 #           bool
@@ -59,111 +66,27 @@
 #   config OPROFILE
 #   ... (tons more lines)
 
-from kconfiglib import Kconfig, Symbol, Choice, MENU, COMMENT, NOT
+from kconfiglib import Kconfig
 import sys
 
-def expr_contains_sym(expr, sym_name):
-    """
-    Returns True if a symbol (or choice, though that's unlikely) with name
-    'sym_name' appears in the expression 'expr', and False otherwise.
-
-    Note that "foo" is represented as a constant symbol, like in the C
-    implementation.
-    """
-    # Choice symbols have a Choice instance propagated to the conditions of
-    # their properties, so we need this test rather than
-    # isinstance(expr, Symbol)
-    if not isinstance(expr, tuple):
-        return expr.name == sym_name
-
-    if expr[0] == NOT:
-        return expr_contains_sym(expr[1], sym_name)
-
-    # AND, OR, or relation
-    return expr_contains_sym(expr[1], sym_name) or \
-           expr_contains_sym(expr[2], sym_name)
-
-def sc_references_sym(sc, sym_name):
+def nodes_referencing_sym(kconf, sym_name):
     """
-    Returns True if a symbol with name 'sym_name' appears in any of the
-    properties or property conditions of the Symbol or Choice 'sc', and False
-    otherwise.
+    Returns a list of (node, kinds) tuples for the menu nodes in 'kconf' that
+    reference a symbol with name 'sym_name', in menu order. 'kinds' is a list
+    of the places where the symbol is referenced, e.g. ["prompt", "default"].
+    See Symbol.referenced_by.
     """
-    # Search defaults
-    for default, cond in sc.defaults:
-        if expr_contains_sym(default, sym_name) or \
-           expr_contains_sym(cond, sym_name):
-            return True
-
-    if isinstance(sc, Symbol):
-        # Search selects
-        for select, cond in sc.selects:
-            if select.name == sym_name or \
-               expr_contains_sym(cond, sym_name):
-                return True
-
-        # Search implies
-        for imply, cond in sc.implies:
-            if imply.name == sym_name or \
-               expr_contains_sym(cond, sym_name):
-                return True
+    if sym_name not in kconf.syms:
+        return []
 
-        # Search ranges
-        for low, high, cond in sc.ranges:
-            if low.name == sym_name or \
-               high.name == sym_name or \
-               expr_contains_sym(cond, sym_name):
-                return True
-
-    return False
-
-def node_references_sym(node, sym_name):
-    """
-    Returns True if a symbol with name 'sym_name' appears in the prompt
-    condition of the MenuNode 'node' or in any of the properties of a
-    symbol/choice stored in the menu node, and False otherwise.
-
-    For MENU menu nodes, also searches the 'visible if' condition.
-
-    Note that prompts are always stored in menu nodes. This is why a symbol can
-    be defined in multiple locations and have a different prompt in each
-    location. For MENU and COMMENT menu nodes, the prompt holds the menu title
-    or comment text. This organization matches the C implementation.
-    """
-    if node.prompt:
-        # Search the prompt condition
-        if expr_contains_sym(node.prompt[1], sym_name):
-            return True
-
-    if isinstance(node.item, (Symbol, Choice)):
-        # Search symbol or choice
-        return sc_references_sym(node.item, sym_name)
-
-    if node.item == MENU:
-        # Search the 'visible if' condition
-        return expr_contains_sym(node.visibility, sym_name)
-
-    # Comments are already handled by searching the prompt condition, because
-    # 'depends on' gets propagated to it. This is why we don't need to look at
-    # the direct dependencies for MENU either.
-
-def nodes_referencing_sym(node, sym_name):
-    """
-    Returns a list of all menu nodes in the menu tree rooted at 'node' that
-    reference a symbol with name 'sym_name' in any of their properties. Also
-    checks the properties of any symbols or choices contained in the menu
-    nodes.
-    """
     res = []
+    node_kinds = {}
 
-    while node:
-        if node_references_sym(node, sym_name):
-            res.append(node)
-
-        if node.list:
-            res.extend(nodes_referencing_sym(node.list, sym_name))
-
-        node = node.next
+    for node, kind in kconf.syms[sym_name].referenced_by:
+        if node not in node_kinds:
+            node_kinds[node] = []
+            res.append((node, node_kinds[node]))
+        node_kinds[node].append(kind)
 
     return res
 
@@ -177,7 +100,7 @@ if __name__ == "__main__":
     sym_name = sys.argv[2]
 
     kconf = Kconfig(sys.argv[1])
-    nodes = nodes_referencing_sym(kconf.top_node, sym_name)
+    nodes = nodes_referencing_sym(kconf, sym_name)
 
     if not nodes:
         print("No reference to '{}' found".format(sym_name))
@@ -185,8 +108,9 @@ if __name__ == "__main__":
 
     print("Found {} locations that reference '{}':\n".format(len(nodes), sym_name))
 
-    for i, node in enumerate(nodes, 1):
-        print("========== Location {} ({}:{}) ==========\n".format(i, node.filename, node.linenr))
+    for i, (node, kinds) in enumerate(nodes, 1):
+        print("========== Location {} ({}:{}, {}) ==========\n"
+              .format(i, node.filename, node.linenr, ", ".join(kinds)))
         print(node)
 
         parent_i = 0
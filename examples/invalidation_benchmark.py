@@ -0,0 +1,148 @@
+# Compares the two ways of invalidating all cached symbol values on
+# workloads that set many values:
+#
+#  - Generations (the current scheme): Kconfig._invalidate_all() starts a new
+#    generation in constant time, and cached values from earlier generations
+#    are thrown away when they're next accessed. Every value access checks the
+#    generation.
+#
+#  - Clearing: the cached values of all defined symbols and choices are
+#    cleared up front, like Kconfig._invalidate_all() used to do.
+#
+# The clearing scheme is emulated by temporarily replacing
+# Kconfig._invalidate_all(), so it still pays for the generation check. Times
+# for it are a bit pessimistic because of that.
+#
+# The workloads are toggling MODULES, unset_values(), load_config() with
+# replace=True (the default), and per-symbol set_value(). Each one is run
+# both with a single value read afterwards and with all values evaluated
+# afterwards. Invalidating everything is cheaper with generations, but
+# evaluating everything pays for the generation checks.
+#
+# Usage:
+#
+#   $ make [ARCH=<arch>] scriptconfig SCRIPT=Kconfiglib/examples/invalidation_benchmark.py
+#
+# Output format, with times in seconds:
+#
+#   <workload>  <generations>  <clearing>  <clearing/generations>
+
+from contextlib import contextmanager
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from kconfiglib import Kconfig
+
+@contextmanager
+def clearing_invalidation():
+    """
+    Returns a context manager that makes Kconfig._invalidate_all() clear the
+    cached values of all symbols and choices right away, restoring the
+    current implementation afterwards.
+    """
+    def invalidate_all(kconf):
+        kconf._generation += 1
+        kconf._expr_memo_gen += 1
+
+        for sym in kconf.defined_syms:
+            sym._new_gen()
+
+        for choice in kconf._choices:
+            choice._new_gen()
+
+    old_invalidate_all = Kconfig._invalidate_all
+    Kconfig._invalidate_all = invalidate_all
+    try:
+        yield
+    finally:
+        Kconfig._invalidate_all = old_invalidate_all
+
+
+def evaluate_all(kconf):
+    # Reads the value of each defined symbol. Unlike Kconfig.evaluate_all(),
+    # this goes through the same properties as most scripts.
+    for sym in kconf.defined_syms:
+        sym.str_value
+
+def toggle_modules(kconf, read):
+    for val in 0, 2:
+        kconf.modules.set_value(val)
+        read(kconf)
+
+def unset_values(kconf, read):
+    # unset_values() only invalidates anything if some symbol has a user value
+    for sym in picked_syms:
+        if sym.assignable:
+            sym.set_value(sym.assignable[-1])
+            break
+    kconf.unset_values()
+    read(kconf)
+
+def load_configs(kconf, read):
+    for filename in config_filenames:
+        kconf.load_config(filename)
+        read(kconf)
+
+def set_values(kconf, read):
+    for sym in picked_syms:
+        if sym.assignable:
+            sym.set_value(sym.assignable[-1])
+    read(kconf)
+    kconf.unset_values()
+
+def read_one(kconf):
+    kconf.defined_syms[0].str_value
+
+def run(kconf, workload, read, n):
+    # Returns the time it takes to run 'workload' 'n' times
+    evaluate_all(kconf)
+    start = time.time()
+    for _ in range(n):
+        workload(kconf, read)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    kconf = Kconfig(sys.argv[1], warn=False)
+
+    random.seed(0)
+    picked_syms = random.sample(kconf.defined_syms,
+                                min(2000, len(kconf.defined_syms)))
+
+    # Two configurations to alternate between with load_config()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config_filenames = []
+        for name in "allno", "allyes":
+            getattr(kconf, name + "config")()
+            config_filenames.append(os.path.join(tmpdir, name))
+            kconf.write_config(config_filenames[-1])
+        kconf.unset_values()
+
+        workloads = (
+            ("toggle MODULES, read one value x500", toggle_modules, read_one,
+             500),
+            ("toggle MODULES, evaluate all x5", toggle_modules, evaluate_all,
+             5),
+            ("unset_values(), read one value x500", unset_values, read_one,
+             500),
+            ("load_config() two configs, evaluate all x5", load_configs,
+             evaluate_all, 5),
+            ("set_value() 2000 symbols, evaluate all x5", set_values,
+             evaluate_all, 5),
+        )
+
+        for desc, workload, read, n in workloads:
+            gen_time = run(kconf, workload, read, n)
+            with clearing_invalidation():
+                clear_time = run(kconf, workload, read, n)
+
+            print("{:45} {:7.3f} {:7.3f} {:6.2f}"
+                  .format(desc, gen_time, clear_time, clear_time/gen_time))
+
+    finally:
+        shutil.rmtree(tmpdir)
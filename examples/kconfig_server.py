@@ -0,0 +1,510 @@
+# Keeps parsed Kconfig trees in memory and serves requests for them over a Unix
+# domain socket, so that tools that run often (e.g. from a build system) don't
+# have to pay the parsing cost on each invocation.
+#
+# Trees are kept per working directory, base Kconfig file, and value of the
+# environment variables the tree depends on ($srctree, $CONFIG_, and those
+# referenced with 'option env', like $ARCH and $SRCARCH in the kernel). A tree
+# is parsed again automatically if any of the Kconfig files it was parsed from
+# has been modified.
+#
+# The KconfigClient class at the end mirrors the parts of the Kconfig API that
+# are supported: load_config(), write_config(), write_autoconf(), sync_deps(),
+# eval_string(), unset_values(), the all*config() methods, the warning
+# settings, some Kconfig attributes, and Kconfig.syms, with symbol attributes
+# and set_value()/unset_value(). Each new client starts out with all values
+# unset, just like a newly created Kconfig instance.
+#
+# The server handles one client at a time, and each client gets a consistent
+# view of the tree. Clients should be short-lived, like a tool invocation.
+#
+# Usage:
+#
+#   Start the server from the top-level kernel directory (any directory
+#   works, as clients send along their working directory):
+#
+#     $ python Kconfiglib/examples/kconfig_server.py /tmp/kconfig.sock &
+#
+#   Then, in a script (with the examples/ directory in the import path, or
+#   with this file copied next to the script):
+#
+#     from kconfig_server import KconfigClient
+#
+#     kconf = KconfigClient("/tmp/kconfig.sock", "Kconfig")
+#     kconf.load_config(".config")
+#     kconf.syms["MODULES"].set_value(2)
+#     print(kconf.eval_string("MODULES && PCI"))
+#     kconf.write_config(".config", only_if_changed=True)
+#
+# The protocol is one JSON object per line in each direction. Requests look
+# like {"op": "load_config", "args": [".config"], "kwargs": {}}, and responses
+# like {"result": ..., "stderr": "..."} or {"error": [<exception type>,
+# <message>], "stderr": "..."}. 'stderr' holds any warnings generated while
+# handling the request, which the client prints.
+
+import json
+import os
+import socket
+import sys
+
+try:
+    # Python 3
+    import socketserver
+    from io import StringIO
+except ImportError:
+    # Python 2
+    import SocketServer as socketserver
+    from StringIO import StringIO
+
+import kconfiglib
+
+# Kconfig methods that can be called directly by clients
+_KCONFIG_METHODS = frozenset((
+    "load_config",
+    "write_config",
+    "write_autoconf",
+    "sync_deps",
+    "eval_string",
+    "unset_values",
+    "allyesconfig",
+    "allnoconfig",
+    "alldefconfig",
+    "enable_warnings",
+    "disable_warnings",
+    "enable_undef_warnings",
+    "disable_undef_warnings",
+    "enable_redun_warnings",
+    "disable_redun_warnings",
+))
+
+# Kconfig attributes that can be fetched by clients
+_KCONFIG_ATTRS = frozenset((
+    "config_prefix",
+    "defconfig_filename",
+    "kconfig_filenames",
+    "mainmenu_text",
+    "srctree",
+))
+
+# Symbol attributes that can be fetched by clients
+_SYM_ATTRS = frozenset((
+    "assignable",
+    "config_string",
+    "env_var",
+    "is_allnoconfig_y",
+    "is_constant",
+    "name",
+    "str_value",
+    "tri_value",
+    "user_value",
+    "visibility",
+))
+
+# Environment variables that all trees depend on. See Kconfig.__init__().
+_BASE_ENV_VARS = ("srctree", "CONFIG_")
+
+
+def _loads(line):
+    # Decodes a JSON line received over the socket. On Python 2, strings are
+    # turned into str rather than unicode, as that's what Kconfiglib expects
+    # (e.g. in Symbol.set_value()).
+    obj = json.loads(line.decode("utf-8"))
+    return obj if sys.version_info[0] >= 3 else _to_str(obj)
+
+def _to_str(obj):
+    # _loads() helper for Python 2
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    if isinstance(obj, list):
+        return [_to_str(elm) for elm in obj]
+    if isinstance(obj, dict):
+        return dict((_to_str(key), _to_str(val)) for key, val in obj.items())
+    return obj
+
+
+#
+# Server
+#
+
+
+class _Tree(object):
+    """
+    A parsed Kconfig tree, together with the information needed to tell if it
+    can be reused for a client.
+    """
+    def __init__(self, cwd, filename):
+        self.cwd = cwd
+        self.filename = filename
+
+        # Warnings are collected and replayed to each client that uses the
+        # tree, just like they would be printed for a newly created Kconfig
+        # instance
+        stderr = StringIO()
+        old_stderr = sys.stderr
+        sys.stderr = stderr
+        try:
+            self.kconf = kconfiglib.Kconfig(filename)
+        finally:
+            sys.stderr = old_stderr
+        self.parse_warnings = stderr.getvalue()
+
+        self.env = _env_values(self.kconf)
+        self.file_stats = [(fname, kconfiglib._file_stat(fname))
+                           for fname in self.kconf.kconfig_filenames]
+
+    def is_usable(self, cwd, filename):
+        """
+        Returns True if this tree is the one a client with the working
+        directory 'cwd' would get when parsing 'filename'. The client's
+        environment must be installed when this is called.
+        """
+        return cwd == self.cwd and filename == self.filename and \
+               _env_values(self.kconf) == self.env
+
+    def is_stale(self):
+        """
+        Returns True if a Kconfig file has been modified since parsing.
+        """
+        return any(kconfiglib._file_stat(fname) != stat
+                   for fname, stat in self.file_stats)
+
+
+def _env_values(kconf):
+    # Returns the values of the environment variables that 'kconf' depends on
+    return dict((var, os.environ.get(var))
+                for var in _BASE_ENV_VARS + tuple(kconf.env_vars))
+
+
+class KconfigServer(socketserver.UnixStreamServer):
+    """
+    Serves requests for parsed Kconfig trees over a Unix domain socket. Up to
+    'max_trees' trees are kept in memory. The least recently used tree is
+    dropped if it's exceeded.
+    """
+    def __init__(self, socket_path, max_trees=4):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        # Only allow the current user to connect
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path,
+                                                   _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+        self.max_trees = max_trees
+        # Most recently used tree last
+        self.trees = []
+
+    def get_tree(self, cwd, filename):
+        """
+        Returns a tree for 'filename', reusing a parsed tree if possible.
+        Must be called with the client's working directory and environment
+        installed.
+        """
+        for tree in self.trees:
+            if tree.is_usable(cwd, filename):
+                self.trees.remove(tree)
+                if tree.is_stale():
+                    tree = _Tree(cwd, filename)
+                break
+        else:
+            tree = _Tree(cwd, filename)
+            if len(self.trees) >= self.max_trees:
+                del self.trees[0]
+
+        self.trees.append(tree)
+        return tree
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one client connection. The first request must be "open", which
+    selects the tree used for the rest of the connection.
+    """
+    def handle(self):
+        self.cwd = self.env = self.kconf = None
+
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                # Client disconnected
+                return
+
+            stderr = StringIO()
+            old_stderr = sys.stderr
+            old_cwd = os.getcwd()
+            old_env = dict(os.environ)
+
+            sys.stderr = stderr
+            try:
+                req = _loads(line)
+                if self.cwd is not None:
+                    _install_env(self.cwd, self.env)
+                resp = {"result": self.handle_request(
+                            req["op"], req.get("args", ()),
+                            req.get("kwargs", {}))}
+            except Exception as e:
+                resp = {"error": (_exception_type(e), str(e))}
+            finally:
+                sys.stderr = old_stderr
+                _install_env(old_cwd, old_env)
+
+            resp["stderr"] = stderr.getvalue()
+            self.wfile.write(json.dumps(resp).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+    def handle_request(self, op, args, kwargs):
+        # Handles a single request and returns the (JSON-serializable) result
+
+        if op == "open":
+            return self.open(*args, **kwargs)
+
+        if self.kconf is None:
+            raise ValueError('the first request must be "open"')
+
+        if op in _KCONFIG_METHODS:
+            return getattr(self.kconf, op)(*args, **kwargs)
+
+        if op == "get":
+            attr, = args
+            if attr not in _KCONFIG_ATTRS:
+                raise ValueError("unknown Kconfig attribute '{}'"
+                                 .format(attr))
+            return getattr(self.kconf, attr)
+
+        if op == "sym_names":
+            return sorted(self.kconf.syms)
+
+        if op in ("sym_get", "sym_str", "sym_set_value", "sym_unset_value"):
+            sym = self.kconf.syms[args[0]]
+
+            if op == "sym_get":
+                attr = args[1]
+                if attr not in _SYM_ATTRS:
+                    raise ValueError("unknown symbol attribute '{}'"
+                                     .format(attr))
+                val = getattr(sym, attr)
+                if attr == "assignable":
+                    # Tuple of ints
+                    val = list(val)
+                return val
+
+            if op == "sym_str":
+                return str(sym)
+
+            if op == "sym_set_value":
+                return sym.set_value(args[1])
+
+            sym.unset_value()
+            return None
+
+        raise ValueError("unknown request '{}'".format(op))
+
+    def open(self, filename, cwd, env, warn=True):
+        # Selects a tree for the client and resets it to the state of a newly
+        # created Kconfig instance
+
+        self.cwd, self.env = cwd, env
+        _install_env(cwd, env)
+
+        tree = self.server.get_tree(cwd, filename)
+        self.kconf = tree.kconf
+
+        self.kconf.unset_values()
+        self.kconf.disable_undef_warnings()
+        self.kconf.enable_redun_warnings()
+        if warn:
+            self.kconf.enable_warnings()
+            sys.stderr.write(tree.parse_warnings)
+        else:
+            self.kconf.disable_warnings()
+
+        return None
+
+
+def _exception_type(e):
+    # Returns the name of the closest exception type to 'e' that the client
+    # knows about. This makes e.g. FileNotFoundError on Python 3 turn into
+    # IOError.
+    for cls in e.__class__.__mro__:
+        if cls.__name__ in _EXCEPTIONS:
+            return cls.__name__
+    return e.__class__.__name__
+
+def _install_env(cwd, env):
+    # Changes the working directory and the environment of the server process
+    # to 'cwd' and 'env'. The server is single-threaded, so this is safe.
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+
+
+#
+# Client
+#
+
+
+class KconfigServerError(Exception):
+    """
+    Raised for errors on the server that don't map to an exception type the
+    client knows about.
+    """
+
+
+# Exceptions that get re-raised with the same type on the client
+_EXCEPTIONS = {
+    "KconfigSyntaxError": kconfiglib.KconfigSyntaxError,
+    # IOError and OSError are the same on Python 3. Kconfiglib raises IOError.
+    "IOError": IOError,
+    "OSError": IOError,
+    "KeyError": KeyError,
+    "TypeError": TypeError,
+    "ValueError": ValueError,
+}
+
+
+class KconfigClient(object):
+    """
+    Client for KconfigServer. Mirrors the Kconfig API where supported, and is
+    created like a Kconfig instance, but with the path to the server socket as
+    the first argument. The working directory and environment of the client
+    are used on the server.
+    """
+    def __init__(self, socket_path, filename="Kconfig", warn=True):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+        self._rfile = self._sock.makefile("rb")
+
+        self._call("open", filename, os.getcwd(), dict(os.environ), warn)
+
+        self.syms = _SymbolMap(self)
+
+    def close(self):
+        """
+        Closes the connection to the server, letting it serve other clients.
+        """
+        self._rfile.close()
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __getattr__(self, name):
+        # Forwards supported methods and attributes to the server. Only called
+        # for attributes not found the normal way.
+
+        if name in _KCONFIG_METHODS:
+            return lambda *args, **kwargs: self._call(name, *args, **kwargs)
+
+        if name in _KCONFIG_ATTRS:
+            return self._call("get", name)
+
+        raise AttributeError("'{}' is not supported by KconfigClient"
+                             .format(name))
+
+    def _call(self, op, *args, **kwargs):
+        # Sends a request to the server and returns the result, raising any
+        # exception from the server
+
+        self._sock.sendall(json.dumps({"op": op, "args": args,
+                                       "kwargs": kwargs}).encode("utf-8") +
+                           b"\n")
+
+        line = self._rfile.readline()
+        if not line:
+            raise KconfigServerError("the server closed the connection")
+
+        resp = _loads(line)
+
+        sys.stderr.write(resp["stderr"])
+
+        if "error" in resp:
+            exc_type, msg = resp["error"]
+            raise _EXCEPTIONS.get(exc_type, KconfigServerError)(msg)
+
+        return resp["result"]
+
+
+class _SymbolMap(object):
+    """
+    Stands in for Kconfig.syms in KconfigClient.
+    """
+    def __init__(self, client):
+        self._client = client
+        self._names = frozenset(client._call("sym_names"))
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        return _SymbolProxy(self._client, name)
+
+    def get(self, name, default=None):
+        return self[name] if name in self._names else default
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __iter__(self):
+        return iter(sorted(self._names))
+
+    def __len__(self):
+        return len(self._names)
+
+    def keys(self):
+        return sorted(self._names)
+
+    def values(self):
+        return [self[name] for name in sorted(self._names)]
+
+    def items(self):
+        return [(name, self[name]) for name in sorted(self._names)]
+
+
+class _SymbolProxy(object):
+    """
+    Stands in for a Symbol in KconfigClient. Attributes are fetched from the
+    server on each access, since they can change when values are assigned.
+    """
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+
+    def __getattr__(self, attr):
+        if attr in _SYM_ATTRS:
+            val = self._client._call("sym_get", self.name, attr)
+            return tuple(val) if attr == "assignable" else val
+
+        raise AttributeError("'{}' is not supported by KconfigClient"
+                             .format(attr))
+
+    def set_value(self, value):
+        return self._client._call("sym_set_value", self.name, value)
+
+    def unset_value(self):
+        self._client._call("sym_unset_value", self.name)
+
+    def __str__(self):
+        return self._client._call("sym_str", self.name)
+
+    def __repr__(self):
+        return "<symbol {} (via KconfigClient)>".format(self.name)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit("usage: {} <socket path> [<max trees>]".format(sys.argv[0]))
+
+    server = KconfigServer(sys.argv[1],
+                           *[int(arg) for arg in sys.argv[2:]])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(sys.argv[1])
@@ -5,7 +5,8 @@
 # reference undefined symbols for some of them, but if no architecture defines
 # the symbol, it usually indicates a problem or potential cleanup.
 #
-# This script could be sped up a lot if needed. See the comment near the
+# The architectures are parsed in parallel with kconfiglib.parse_many(). This
+# script could be sped up a lot more if needed. See the comment near the
 # nodes_referencing_sym() call.
 #
 # Run with the following command in the kernel root:
@@ -15,16 +16,8 @@
 # Example output:
 #
 #   Registering defined and undefined symbols for all arches
-#     Processing mips
-#     Processing ia64
-#     Processing metag
-#     ...
 #
 #   Finding references to each undefined symbol
-#     Processing mips
-#     Processing ia64
-#     Processing metag
-#     ...
 #
 #   The following globally undefined symbols were found, listed here
 #   together with the locations of the items that reference them.
@@ -35,19 +28,15 @@
 #     SUNXI_CCU_DIV: drivers/clk/sunxi-ng/Kconfig:14
 #     AC97: sound/ac97/Kconfig:6
 #     ...
-from kconfiglib import Kconfig
+from kconfiglib import parse_many
 
 # Reuse a function from the find_symbol.py example
 from find_symbol import nodes_referencing_sym
 
+import functools
 import os
 import subprocess
 
-# Referenced inside the Kconfig files
-os.environ["KERNELVERSION"] = str(
-    subprocess.check_output(("make", "kernelversion")).decode("utf-8").rstrip()
-)
-
 def all_arch_srcarch_pairs():
     """
     Generates all valid (ARCH, SRCARCH) tuples for the kernel, corresponding to
@@ -75,29 +64,24 @@ def all_arch_srcarch_pairs():
 
     yield ("um", "um")
 
-def all_arch_srcarch_kconfigs():
+def all_arch_srcarch_configs():
     """
-    Generates Kconfig instances for all the architectures in the kernel
+    Returns a list of (filename, env) tuples for parse_many(), for all the
+    architectures in the kernel
     """
-    for arch, srcarch in all_arch_srcarch_pairs():
-        print("  Processing " + arch)
-
-        os.environ["ARCH"] = arch
-        os.environ["SRCARCH"] = srcarch
-
-        # um (User Mode Linux) uses a different base Kconfig file
-        yield Kconfig("Kconfig" if arch != "um" else "arch/x86/um/Kconfig",
-                      warn=False)
-
-
-print("Registering defined and undefined symbols for all arches")
+    # um (User Mode Linux) uses a different base Kconfig file
+    return [("Kconfig" if arch != "um" else "arch/x86/um/Kconfig",
+             {"ARCH": arch, "SRCARCH": srcarch})
+            for arch, srcarch in all_arch_srcarch_pairs()]
 
-# Sets holding the names of all defined and undefined symbols, for all
-# architectures
-defined = set()
-undefined = set()
+def defined_and_undefined(kconf):
+    """
+    Returns a tuple with two sets, holding the names of the defined and
+    undefined symbols in 'kconf'. Runs in a parse_many() worker process.
+    """
+    defined = set()
+    undefined = set()
 
-for kconf in all_arch_srcarch_kconfigs():
     for name, sym in kconf.syms.items():
         if sym.nodes:
             # If the symbol has a menu node, it is defined
@@ -120,26 +104,69 @@ for kconf in all_arch_srcarch_kconfigs():
             # Interesting undefined symbol
             undefined.add(name)
 
+    return (defined, undefined)
+
+def references(names, kconf):
+    """
+    Returns a dictionary that maps each symbol name in 'names' to a set with
+    the locations of the items (symbols, choices, menus, ifs) in 'kconf' that
+    reference it. Runs in a parse_many() worker process.
+    """
+    refs = {}
 
-print("\nFinding references to each undefined symbol")
+    for name in names:
+        # Symbol.referenced_by is built once for the entire configuration
+        # tree, so each lookup is cheap
+        refs[name] = set("{}:{}".format(node.filename, node.linenr)
+                         for node, _ in nodes_referencing_sym(kconf, name))
 
-# Maps each globally undefined symbol to the locations of the items (symbols,
-# choices, menus, ifs) that reference it
-undef_sym_refs = [(name, set()) for name in undefined - defined]
+    return refs
 
-for kconf in all_arch_srcarch_kconfigs():
-    for name, refs in undef_sym_refs:
-        # This means that we search the entire configuration tree for each
-        # undefined symbol, which is terribly inefficient. We could speed
-        # things up by tweaking nodes_referencing_sym() to compare each symbol
-        # to multiple symbols while walking the configuration tree.
-        for node in nodes_referencing_sym(kconf.top_node, name):
-            refs.add("{}:{}".format(node.filename, node.linenr))
 
+# The functions above need to be importable by parse_many() worker processes
+# on systems without fork()
+if __name__ == "__main__":
+    # Referenced inside the Kconfig files
+    os.environ["KERNELVERSION"] = str(
+        subprocess.check_output(("make", "kernelversion")).decode("utf-8")
+                  .rstrip()
+    )
 
-print("\nThe following globally undefined symbols were found, listed here\n"
-      "together with the locations of the items that reference them.\n"
-      "References might come from enclosing menus and ifs.\n")
+    configs = all_arch_srcarch_configs()
 
-for name, refs in undef_sym_refs:
-    print("  {}: {}".format(name, ", ".join(refs)))
+    print("Registering defined and undefined symbols for all arches")
+
+    # Sets holding the names of all defined and undefined symbols, for all
+    # architectures
+    defined = set()
+    undefined = set()
+
+    for arch_defined, arch_undefined in \
+        parse_many(configs, summarize=defined_and_undefined, warn=False):
+
+        defined |= arch_defined
+        undefined |= arch_undefined
+
+
+    print("\nFinding references to each undefined symbol")
+
+    # Maps each globally undefined symbol to the locations of the items
+    # (symbols, choices, menus, ifs) that reference it
+    undef_sym_refs = [(name, set()) for name in undefined - defined]
+
+    for arch_refs in parse_many(
+        configs,
+        summarize=functools.partial(references,
+                                    [name for name, _ in undef_sym_refs]),
+        warn=False):
+
+        for name, refs in undef_sym_refs:
+            refs |= arch_refs[name]
+
+
+    print("\nThe following globally undefined symbols were found, listed "
+          "here\ntogether with the locations of the items that reference "
+          "them.\nReferences might come from enclosing menus and ifs.\n")
+
+    for name, refs in undef_sym_refs:
+        print("  {}: {}".format(name, ", ".join(refs)))
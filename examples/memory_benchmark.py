@@ -0,0 +1,95 @@
+# Loads the configurations for several architectures into the same process
+# and prints how much memory they use, together with how much is saved by
+# symbol names, prompts, help texts, and Kconfig filenames being interned
+# (shared between the Kconfig instances) rather than stored once per
+# architecture.
+#
+# The architectures are parsed in parallel with kconfiglib.parse_many(), and
+# the Kconfig instances are unpickled in this process. Needs Python 3.4+, for
+# tracemalloc.
+#
+# Run with the following command in the kernel root, optionally with a list of
+# SRCARCH values (all architectures by default):
+#
+#   $ python3 Kconfiglib/examples/memory_benchmark.py [<srcarch> ...]
+#
+# Output format:
+#
+#   Loaded <n> configurations (<arch> ...)
+#   Total memory: <total> MiB (<total/n> MiB per configuration)
+#   Interned strings shared between configurations: <saved> MiB saved
+from kconfiglib import Symbol, Choice, parse_many
+
+# Reuse a function from the list_undefined.py example
+from list_undefined import all_arch_srcarch_configs
+
+import os
+import subprocess
+import sys
+import tracemalloc
+
+def strings(kconf):
+    """
+    Returns a list with the strings that are interned in 'kconf'.
+    """
+    res = [sym.name for sym in kconf.syms.values()]
+
+    def add_strings(node):
+        while node:
+            res.append(node.filename)
+
+            if node.prompt:
+                res.append(node.prompt[0])
+
+            if isinstance(node.item, (Symbol, Choice)) and \
+               node.help is not None:
+                res.append(node.help)
+
+            if node.list:
+                add_strings(node.list)
+
+            node = node.next
+
+    add_strings(kconf.top_node)
+
+    return res
+
+
+if __name__ == "__main__":
+    # Referenced inside the Kconfig files
+    os.environ["KERNELVERSION"] = str(
+        subprocess.check_output(("make", "kernelversion")).decode("utf-8")
+                  .rstrip()
+    )
+
+    configs = all_arch_srcarch_configs()
+    if len(sys.argv) > 1:
+        configs = [config for config in configs
+                   if config[1]["SRCARCH"] in sys.argv[1:] and
+                      config[1]["ARCH"] == config[1]["SRCARCH"]]
+
+    tracemalloc.start()
+    kconfs = parse_many(configs, warn=False)
+    total = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("Loaded {} configurations ({})"
+          .format(len(kconfs),
+                  " ".join(env["ARCH"] for _, env in configs)))
+    print("Total memory: {:.1f} MiB ({:.1f} MiB per configuration)"
+          .format(total/2**20, total/2**20/len(kconfs)))
+
+    # Each string object appearing in a Kconfig instance after the first one
+    # to use it would otherwise be a separate copy
+    seen = set()
+    saved = 0
+    for kconf in kconfs:
+        kconf_strings = {id(s): s for s in strings(kconf)}
+        for id_, s in kconf_strings.items():
+            if id_ in seen:
+                saved += sys.getsizeof(s)
+            else:
+                seen.add(id_)
+
+    print("Interned strings shared between configurations: {:.1f} MiB saved"
+          .format(saved/2**20))
@@ -0,0 +1,22 @@
+# Generates a random configuration and writes it to .config, similar to
+# 'make randconfig'. The seed can be passed via SCRIPT_ARG, and the same seed
+# always gives the same configuration.
+#
+# Usage:
+#
+#   $ make [ARCH=<arch>] scriptconfig SCRIPT=Kconfiglib/examples/randconfig.py [SCRIPT_ARG=<seed>]
+
+import kconfiglib
+import random
+import sys
+
+kconf = kconfiglib.Kconfig(sys.argv[1])
+
+if len(sys.argv) > 2:
+    seed = int(sys.argv[2])
+else:
+    seed = random.randrange(2**32)
+
+kconf.randconfig(seed)
+kconf.write_config(".config")
+print("random configuration with seed {} written to .config".format(seed))
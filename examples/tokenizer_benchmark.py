@@ -0,0 +1,61 @@
+# Compares the speed of the two tokenizers, the default one and the
+# single-regex scanner selected with Kconfig(scanner_tokenizer=True), by
+# parsing the configuration with each of them. Also checks that they give the
+# same menu tree.
+#
+# Usage:
+#
+#   $ make [ARCH=<arch>] scriptconfig SCRIPT=Kconfiglib/examples/tokenizer_benchmark.py
+#
+# Output format, with the best time out of five parses for each tokenizer:
+#
+#   default  <time> s
+#   scanner  <time> s (<scanner/default>)
+
+from kconfiglib import Kconfig
+import sys
+import time
+
+def parse(scanner_tokenizer):
+    """
+    Parses the configuration with the tokenizer selected by
+    'scanner_tokenizer'. Returns a (kconf, time) tuple, where 'time' is the
+    time it took in seconds.
+    """
+    start = time.time()
+    kconf = Kconfig(sys.argv[1], warn=False,
+                    scanner_tokenizer=scanner_tokenizer)
+    return kconf, time.time() - start
+
+def tree_str(kconf):
+    # Returns a string with all menu nodes (with locations) in 'kconf', for
+    # comparing the results of the two tokenizers
+    res = []
+
+    def add_nodes(node):
+        while node:
+            res.append("{}:{}\n{}".format(node.filename, node.linenr, node))
+            add_nodes(node.list)
+            node = node.next
+
+    add_nodes(kconf.top_node)
+
+    return "\n".join(res)
+
+
+if __name__ == "__main__":
+    default_kconf = parse(False)[0]
+    scanner_kconf = parse(True)[0]
+    if tree_str(scanner_kconf) != tree_str(default_kconf):
+        sys.exit("the tokenizers gave different menu trees")
+
+    # Interleave the runs and keep the best time for each, to reduce noise
+    best = {}
+    for _ in range(5):
+        for scanner_tokenizer in False, True:
+            t = parse(scanner_tokenizer)[1]
+            best[scanner_tokenizer] = min(t, best.get(scanner_tokenizer, t))
+
+    print("default  {:.2f} s".format(best[False]))
+    print("scanner  {:.2f} s ({:.2f})"
+          .format(best[True], best[True]/best[False]))
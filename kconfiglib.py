@@ -341,10 +341,34 @@ Send bug reports, suggestions, and questions to ulfalizer a.t Google's email
 service, or open a ticket on the GitHub page.
 """
 import errno
+import gc
+import heapq
+import io
 import os
 import platform
+import random
 import re
 import sys
+import tempfile
+
+from contextlib import contextmanager
+from itertools import chain
+
+try:
+    import cPickle as pickle
+except ImportError:
+    # Python 3
+    import pickle
+
+try:
+    from sys import intern
+except ImportError:
+    # Python 2, where intern() is a builtin that only accepts str. unicode
+    # strings (e.g. filenames decoded from JSON) are returned as is.
+    _builtin_intern = intern
+
+    def intern(s):
+        return _builtin_intern(s) if s.__class__ is str else s
 
 # File layout:
 #
@@ -367,6 +391,13 @@ class Kconfig(object):
     any number of Kconfig objects (including for different architectures) is
     safe. Kconfiglib doesn't keep any global state.
 
+    Kconfig objects can be pickled, including the current symbol values. This
+    can be used to send a parsed configuration to another process, or to save
+    it to disk. Unpickling is several times faster than parsing. Individual
+    symbols, choices, and menu nodes can't be pickled on their own, as they
+    point into the whole configuration. copy.deepcopy() gives an independent
+    copy of the configuration.
+
     The following attributes are available. They should be treated as
     read-only, and some are implemented through @property magic.
 
@@ -459,19 +490,42 @@ class Kconfig(object):
 
       Like for srctree, only the value of $CONFIG_ when the configuration is
       loaded matters.
+
+    kconfig_filenames:
+      A list with the paths of all Kconfig files read while parsing the
+      configuration, in the order they were opened. Files found via $srctree
+      include the $srctree prefix.
+
+    env_vars:
+      A set with the names of all environment variables referenced with
+      'option env="FOO"' in the Kconfig files. Together with
+      kconfig_filenames, this is everything outside the Kconfig files proper
+      that the parsed configuration depends on (besides $srctree).
     """
     __slots__ = (
+        "_assignment_re_finditer",
         "_choices",
+        "_deferred_invalidation",
+        "_eval_order",
+        "_expr_memo",
+        "_expr_memo_gen",
+        "_exprs",
+        "_file_stats",
+        "_generation",
+        "_help_file",
         "_print_undef_assign",
         "_print_redun_assign",
         "_print_warnings",
-        "_set_re_match",
-        "_unset_re_match",
+        "_ref_index",
+        "_vec_plan",
         "_warn_no_prompt",
+        "_warning_log",
         "config_prefix",
         "const_syms",
         "defconfig_list",
         "defined_syms",
+        "env_vars",
+        "kconfig_filenames",
         "m",
         "modules",
         "n",
@@ -483,12 +537,15 @@ class Kconfig(object):
 
         # Parsing-related
         "_parsing_kconfigs",
-        "_file",
         "_filename",
         "_linenr",
         "_filestack",
+        "_lazy_help",
+        "_scanner_tokenizer",
+        "_lines",
         "_line",
-        "_saved_line",
+        "_line_tokens",
+        "_pretokenized",
         "_tokens",
         "_tokens_i",
         "_has_tokens",
@@ -498,7 +555,8 @@ class Kconfig(object):
     # Public interface
     #
 
-    def __init__(self, filename="Kconfig", warn=True):
+    def __init__(self, filename="Kconfig", warn=True, cache_file=None,
+                 parse_processes=1, lazy_help=False, scanner_tokenizer=False):
         """
         Creates a new Kconfig object by parsing Kconfig files. Raises
         KconfigSyntaxError on syntax errors. Note that Kconfig files are not
@@ -522,29 +580,74 @@ class Kconfig(object):
           stderr. This can be changed later with
           Kconfig.enable/disable_warnings(). It is provided as a constructor
           argument since warnings might be generated during parsing.
-        """
-        self.srctree = os.environ.get("srctree")
 
-        self.config_prefix = os.environ.get("CONFIG_")
-        if self.config_prefix is None:
-            self.config_prefix = "CONFIG_"
-
-        # Regular expressions for parsing .config files, with the match()
-        # method assigned directly as a small optimization (microscopic in this
-        # case, but it's consistent with the other regexes)
-
-        self._set_re_match = \
-            re.compile(r"{}([^=]+)=(.*)".format(self.config_prefix),
-                       _RE_ASCII).match
-
-        self._unset_re_match = \
-            re.compile(r"# {}([^ ]+) is not set".format(self.config_prefix),
-                       _RE_ASCII).match
-
-
-        self._print_warnings = warn
-        self._print_undef_assign = False
-        self._print_redun_assign = True
+        cache_file (default: None):
+          If not None, the parsed configuration is saved to the file
+          'cache_file', and later Kconfig instances created with the same
+          'cache_file' load it from there instead of parsing the Kconfig files
+          again. Loading the cache is several times faster than parsing.
+
+          The cache is ignored (and rewritten) if any of the Kconfig files (see
+          Kconfig.kconfig_filenames) has a different modification time or
+          size, if an environment variable referenced via 'option env' has a
+          different value, or if 'filename', $srctree, 'lazy_help', the
+          working directory, the release from uname, or the Python version
+          differs. Any other problem with the cache file also just causes the
+          Kconfig files to be parsed.
+
+          Warnings generated during parsing are saved in the cache and printed
+          again when it is loaded. Failing to write the cache file generates a
+          warning.
+
+        parse_processes (default: 1):
+          If greater than 1, the Kconfig files are read and tokenized ahead of
+          time in a pool of that many worker processes, and the parsing proper
+          is done from the pre-tokenized lines. If None, the number of CPUs is
+          used, and nothing is done in parallel if there is just one. The
+          resulting configuration is identical to the one from the default
+          serial parsing.
+
+          Worker processes start from the top-level Kconfig file and follow
+          'source' and 'rsource' statements whose paths do not reference any
+          symbols ($FOO). Files sourced via paths with symbol references are
+          tokenized while parsing, as usual. Help texts are skipped, so e.g.
+          a 'source' line in a help text is not followed.
+
+          This only helps with large configurations on machines with several
+          CPUs. Starting the worker processes and sending back the tokens has
+          an overhead, and tokenization is only part of the total parsing
+          time. On a single CPU, it is slower than serial parsing.
+
+        lazy_help (default: False):
+          If True, help texts are not stored while parsing. Only their
+          locations are, and MenuNode.help reads the help text from the
+          Kconfig file the first time it is accessed. This speeds up parsing
+          a bit and saves memory when most help texts are never looked at
+          (e.g. when just generating configuration files).
+
+          The Kconfig files must not be modified before the help texts have
+          been read. A warning is generated if a Kconfig file has changed
+          when a help text is read from it.
+
+        scanner_tokenizer (default: False):
+          If True, the Kconfig files are tokenized with an alternative
+          tokenizer that lexes each line with a single combined regex, instead
+          of the default character-by-character tokenizer. Both give the same
+          tokens, so the resulting configuration is the same. This is mostly
+          useful for comparing the speed of the two tokenizers (see
+          examples/tokenizer_benchmark.py).
+        """
+        self._init_settings(os.environ.get("srctree"),
+                            os.environ.get("CONFIG_"),
+                            warn)
+
+        # Part of the cache key, as cached help texts are stored differently
+        # depending on it
+        self._lazy_help = lazy_help
+
+        if cache_file is not None and self._load_cache(filename, cache_file):
+            self._warn_no_prompt = True
+            return
 
         self.syms = {}
         self.const_syms = {}
@@ -553,6 +656,16 @@ class Kconfig(object):
         # Used for quickly invalidating all choices
         self._choices = []
 
+        self.kconfig_filenames = []
+        self.env_vars = set()
+        # (path, (mtime, size)) for each Kconfig file read, for checking if
+        # a cache file is up to date. See _open_kconfig().
+        self._file_stats = []
+
+        if cache_file is not None:
+            # Save parsing warnings in the cache too
+            self._warning_log = []
+
         for nmy in "n", "m", "y":
             sym = Symbol()
             sym.kconfig = self
@@ -570,7 +683,7 @@ class Kconfig(object):
         # Make n/m/y well-formed symbols
         for nmy in "n", "m", "y":
             sym = self.const_syms[nmy]
-            sym.rev_dep = sym.weak_rev_dep = sym.direct_dep = self.n
+            sym._rev_dep = sym._weak_rev_dep = sym.direct_dep = self.n
 
         # This is used to determine whether previously unseen symbols should be
         # registered. They shouldn't be if we parse expressions after parsing,
@@ -595,27 +708,48 @@ class Kconfig(object):
         self.top_node.kconfig = self
         self.top_node.item = MENU
         self.top_node.visibility = self.y
-        self.top_node.prompt = ("Linux Kernel Configuration", self.y)
+        self.top_node.prompt = (intern("Linux Kernel Configuration"), self.y)
         self.top_node.parent = None
         self.top_node.dep = self.y
+        # Kconfig files, symbol names, prompts, and help texts are interned
+        # with intern() while parsing, so that they're shared with other
+        # Kconfig instances in the process (commonly the same configuration
+        # for different architectures)
+        filename = intern(filename)
+
         self.top_node.filename = filename
         self.top_node.linenr = 1
 
         # Parse the Kconfig files
 
-        # These implement a single line of "unget" for the parser
-        self._saved_line = None
         self._has_tokens = False
 
         # Keeps track of the location in the parent Kconfig files. Kconfig
         # files usually source other Kconfig files.
         self._filestack = []
 
-        # The current parsing location
+        # The current parsing location. _linenr doubles as the index of the
+        # next line in _lines.
         self._filename = filename
         self._linenr = 0
 
-        self._file = self._open(filename)
+        # See _next_line()
+        self._scanner_tokenizer = scanner_tokenizer
+
+        if parse_processes is None:
+            # Only imported when needed, as it's slow to import compared to
+            # the rest of Kconfiglib
+            import multiprocessing
+            parse_processes = multiprocessing.cpu_count()
+
+        # Tokenized lines from worker processes, per Kconfig file. See
+        # _pretokenize().
+        self._pretokenized = None
+        if parse_processes > 1:
+            self._pretokenized = self._pretokenize(filename, parse_processes)
+
+        self._line_tokens = None
+        self._lines = self._read_kconfig(filename)
 
         self._parse_block(None,           # end_token
                           self.top_node,  # parent
@@ -629,9 +763,27 @@ class Kconfig(object):
         # Do various post-processing of the menu tree
         _finalize_tree(self.top_node)
 
+        # Turn the (OR, (OR, ...)) chains built for selects and implies into
+        # flat n-ary ORs. See the Symbol.rev_dep documentation.
+        for sym in chain(self.syms.values(), self.const_syms.values()):
+            sym._rev_dep = _flatten_or(sym._rev_dep)
+            sym._weak_rev_dep = _flatten_or(sym._weak_rev_dep)
+
         # Build Symbol._dependents for all symbols
         self._build_dep()
 
+        # Not needed after parsing, and holds lots of keys
+        self._exprs = {}
+
+        self._expr_memo = _expr_memo(self)
+
+        # Lines of the top-level Kconfig file
+        self._lines = self._line_tokens = self._pretokenized = None
+
+        if cache_file is not None:
+            self._save_cache(filename, cache_file)
+            self._warning_log = None
+
         self._warn_no_prompt = True
 
     @property
@@ -686,126 +838,133 @@ class Kconfig(object):
 
         # This stub only exists to make sure _warn_no_prompt gets reenabled
         try:
-            self._load_config(filename, replace)
+            with self.batch():
+                self._load_config(filename, replace)
         finally:
             self._warn_no_prompt = True
 
     def _load_config(self, filename, replace):
+        # Read the entire file and find all assignments with a single regex
+        # scan, which is faster than matching line by line
         with self._open(filename) as f:
-            if replace:
-                # If we're replacing the configuration, keep track of which
-                # symbols and choices got set so that we can unset the rest
-                # later. This avoids invalidating everything and is faster.
-                # Another benefit is that invalidation must be rock solid for
-                # it to work, making it a good test.
+            contents = f.read()
+
+        if replace:
+            # If we're replacing the configuration, keep track of which
+            # symbols and choices got set so that we can unset the rest
+            # later. This avoids invalidating everything and is faster.
+            # Another benefit is that invalidation must be rock solid for
+            # it to work, making it a good test.
 
-                for sym in self.defined_syms:
-                    sym._was_set = False
+            for sym in self.defined_syms:
+                sym._was_set = False
 
-                for choice in self._choices:
-                    choice._was_set = False
+            for choice in self._choices:
+                choice._was_set = False
 
-            # Small optimizations
-            set_re_match = self._set_re_match
-            unset_re_match = self._unset_re_match
-            syms = self.syms
+        # Small optimizations
+        assignment_re_finditer = self._assignment_re_finditer
+        syms = self.syms
 
-            for linenr, line in enumerate(f, 1):
-                # The C tools ignore trailing whitespace
-                line = line.rstrip()
-
-                set_match = set_re_match(line)
-                if set_match:
-                    name, val = set_match.groups()
-                    if name not in syms:
-                        self._warn_undef_assign_load(name, val, filename,
-                                                     linenr)
-                        continue
+        # [position, line number] of the last match we calculated the line
+        # number for
+        line_info = [0, 1]
 
-                    sym = syms[name]
-                    if not sym.nodes:
-                        self._warn_undef_assign_load(name, val, filename,
-                                                     linenr)
-                        continue
+        def linenr():
+            # Returns the line number of the current match. Line numbers are
+            # only needed for warnings, so they're calculated lazily, by
+            # counting newlines from the last calculated position.
+            start = match.start()
+            line_info[1] += contents.count("\n", line_info[0], start)
+            line_info[0] = start
+            return line_info[1]
 
-                    if sym.orig_type in (BOOL, TRISTATE):
-                        # The C implementation only checks the first character
-                        # to the right of '=', for whatever reason
-                        if not ((sym.orig_type == BOOL and
-                                 val.startswith(("n", "y"))) or \
-                                (sym.orig_type == TRISTATE and
-                                 val.startswith(("n", "m", "y")))):
-                            self._warn("'{}' is not a valid value for the {} "
-                                       "symbol {}. Assignment ignored."
-                                       .format(val, TYPE_TO_STR[sym.orig_type],
-                                               _name_and_loc_str(sym)))
-                            continue
+        for match in assignment_re_finditer(contents):
+            name, val, unset_name = match.groups()
 
-                        val = val[0]
+            if name is not None:
+                # The C tools ignore trailing whitespace
+                val = val.rstrip()
 
-                        if sym.choice and val != "n":
-                            # During .config loading, we infer the mode of the
-                            # choice from the kind of values that are assigned
-                            # to the choice symbols
+                sym = syms.get(name)
+                if not (sym and sym.nodes):
+                    self._warn_undef_assign_load(name, val, filename,
+                                                 linenr())
+                    continue
 
-                            prev_mode = sym.choice.user_value
-                            if prev_mode is not None and \
-                               TRI_TO_STR[prev_mode] != val:
+                if sym.orig_type in (BOOL, TRISTATE):
+                    # The C implementation only checks the first character
+                    # to the right of '=', for whatever reason
+                    if not ((sym.orig_type == BOOL and
+                             val.startswith(("n", "y"))) or \
+                            (sym.orig_type == TRISTATE and
+                             val.startswith(("n", "m", "y")))):
+                        self._warn("'{}' is not a valid value for the {} "
+                                   "symbol {}. Assignment ignored."
+                                   .format(val, TYPE_TO_STR[sym.orig_type],
+                                           _name_and_loc_str(sym)))
+                        continue
 
-                                self._warn("both m and y assigned to symbols "
-                                           "within the same choice",
-                                           filename, linenr)
+                    val = val[0]
 
-                            # Set the choice's mode
-                            sym.choice.set_value(val)
+                    if sym.choice and val != "n":
+                        # During .config loading, we infer the mode of the
+                        # choice from the kind of values that are assigned
+                        # to the choice symbols
 
-                    elif sym.orig_type == STRING:
-                        string_match = _conf_string_re_match(val)
-                        if not string_match:
-                            self._warn("Malformed string literal in "
-                                       "assignment to {}. Assignment ignored."
-                                       .format(_name_and_loc_str(sym)),
-                                       filename, linenr)
-                            continue
+                        prev_mode = sym.choice.user_value
+                        if prev_mode is not None and \
+                           TRI_TO_STR[prev_mode] != val:
 
-                        val = unescape(string_match.group(1))
+                            self._warn("both m and y assigned to symbols "
+                                       "within the same choice",
+                                       filename, linenr())
 
-                else:
-                    unset_match = unset_re_match(line)
-                    if not unset_match:
-                        continue
+                        # Set the choice's mode
+                        sym.choice.set_value(val)
 
-                    name = unset_match.group(1)
-                    if name not in syms:
-                        self._warn_undef_assign_load(name, "n", filename,
-                                                     linenr)
+                elif sym.orig_type == STRING:
+                    string_match = _conf_string_re_match(val)
+                    if not string_match:
+                        self._warn("Malformed string literal in "
+                                   "assignment to {}. Assignment ignored."
+                                   .format(_name_and_loc_str(sym)),
+                                   filename, linenr())
                         continue
 
-                    sym = syms[name]
-                    if sym.orig_type not in (BOOL, TRISTATE):
-                        continue
+                    val = unescape(string_match.group(1))
 
-                    val = "n"
+            else:
+                sym = syms.get(unset_name)
+                if not sym:
+                    self._warn_undef_assign_load(unset_name, "n", filename,
+                                                 linenr())
+                    continue
 
-                # Done parsing the assignment. Set the value.
+                if sym.orig_type not in (BOOL, TRISTATE):
+                    continue
 
-                if sym._was_set:
-                    # Use strings for bool/tristate user values in the warning
-                    if sym.orig_type in (BOOL, TRISTATE):
-                        display_user_val = TRI_TO_STR[sym.user_value]
-                    else:
-                        display_user_val = sym.user_value
+                val = "n"
 
-                    warn_msg = '{} set more than once. Old value: "{}", new value: "{}".'.format(
-                        _name_and_loc_str(sym), display_user_val, val
-                    )
+            # Done parsing the assignment. Set the value.
 
-                    if display_user_val == val:
-                        self._warn_redun_assign(warn_msg, filename, linenr)
-                    else:
-                        self._warn(             warn_msg, filename, linenr)
+            if sym._was_set:
+                # Use strings for bool/tristate user values in the warning
+                if sym.orig_type in (BOOL, TRISTATE):
+                    display_user_val = TRI_TO_STR[sym.user_value]
+                else:
+                    display_user_val = sym.user_value
+
+                warn_msg = '{} set more than once. Old value: "{}", new value: "{}".'.format(
+                    _name_and_loc_str(sym), display_user_val, val
+                )
 
-                sym.set_value(val)
+                if display_user_val == val:
+                    self._warn_redun_assign(warn_msg, filename, linenr())
+                else:
+                    self._warn(             warn_msg, filename, linenr())
+
+            sym.set_value(val)
 
         if replace:
             # If we're replacing the configuration, unset the symbols that
@@ -820,7 +979,8 @@ class Kconfig(object):
                     choice.unset_value()
 
     def write_autoconf(self, filename,
-                       header="/* Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib) */\n"):
+                       header="/* Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib) */\n",
+                       only_if_changed=False):
         r"""
         Writes out symbol values as a C header file, matching the format used
         by include/generated/autoconf.h in the kernel.
@@ -829,6 +989,9 @@ class Kconfig(object):
         write_config(). The order in the C implementation depends on the hash
         table implementation as of writing, and so won't match.
 
+        Returns True if the file was written, and False if it was left alone
+        (only possible with only_if_changed=True).
+
         filename:
           Self-explanatory.
 
@@ -836,52 +999,21 @@ class Kconfig(object):
           Text that will be inserted verbatim at the beginning of the file. You
           would usually want it enclosed in '/* */' to make it a C comment,
           and include a final terminating newline.
-        """
-        with open(filename, "w") as f:
-            # Small optimization
-            write = f.write
-
-            write(header)
-
-            # Avoid duplicates -- see write_config()
-            for sym in self.defined_syms:
-                sym._written = False
 
-            for sym in self.defined_syms:
-                if not sym._written:
-                    # Note: _write_to_conf is determined when the value is
-                    # calculated. This is a hidden function call due to
-                    # property magic.
-                    val = sym.str_value
-                    if sym._write_to_conf:
-                        if sym.orig_type in (BOOL, TRISTATE):
-                            if val != "n":
-                                write("#define {}{}{} 1\n"
-                                      .format(self.config_prefix, sym.name,
-                                              "_MODULE" if val == "m" else ""))
-
-                        elif sym.orig_type == STRING:
-                            write('#define {}{} "{}"\n'
-                                  .format(self.config_prefix, sym.name,
-                                          escape(val)))
-
-                        elif sym.orig_type in (INT, HEX):
-                            if sym.orig_type == HEX and \
-                               not val.startswith(("0x", "0X")):
-                                val = "0x" + val
-
-                            write("#define {}{} {}\n"
-                                  .format(self.config_prefix, sym.name, val))
-
-                        else:
-                            _internal_error("Internal error while creating C "
-                                            'header: unknown type "{}".'
-                                            .format(sym.orig_type))
-
-                    sym._written = True
+        only_if_changed (default: False):
+          If True, the file is only written if its contents would change,
+          which keeps its modification time and avoids needless rebuilds in
+          build systems that depend on it. The file is then also written
+          atomically, by writing a temporary file in the same directory and
+          renaming it over 'filename', so that an interrupted write never
+          leaves a truncated file behind.
+        """
+        return _write_contents(filename, self._autoconf_contents(header),
+                               only_if_changed)
 
     def write_config(self, filename,
-                     header="# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n"):
+                     header="# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n",
+                     only_if_changed=False):
         r"""
         Writes out symbol values in the .config format. The format matches the
         C implementation, including ordering.
@@ -894,6 +1026,9 @@ class Kconfig(object):
         See the 'Intro to symbol values' section in the module docstring to
         understand which symbols get written out.
 
+        Returns True if the file was written, and False if it was left alone
+        (only possible with only_if_changed=True).
+
         filename:
           Self-explanatory.
 
@@ -901,60 +1036,150 @@ class Kconfig(object):
           Text that will be inserted verbatim at the beginning of the file. You
           would usually want each line to start with '#' to make it a comment,
           and include a final terminating newline.
+
+        only_if_changed (default: False):
+          If True, the file is only written if its contents would change, and
+          is written atomically. See write_autoconf().
         """
-        with open(filename, "w") as f:
-            # Small optimization
-            write = f.write
-
-            write(header)
-
-            # Symbol._written is set to True when a symbol config string is
-            # fetched, so that symbols defined in multiple locations only get
-            # one .config entry. We reset it prior to writing out a new
-            # .config. It only needs to be reset for defined symbols, because
-            # undefined symbols will never be written out (because they do not
-            # appear in the menu tree rooted at Kconfig.top_node).
-            #
-            # The C tools reuse _write_to_conf for this, but we cache
-            # _write_to_conf together with the value and don't invalidate
-            # cached values when writing .config files, so that won't work.
-            for sym in self.defined_syms:
-                sym._written = False
+        return _write_contents(filename, self._config_contents(header),
+                               only_if_changed)
 
-            node = self.top_node.list
-            if not node:
-                # Empty configuration
-                return
+    def write_min_config(self, filename,
+                         header="# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n",
+                         only_if_changed=False):
+        """
+        Writes out a "minimal" configuration file, omitting symbols whose
+        value matches their default value. The format matches the one
+        produced by 'make savedefconfig'.
 
-            while 1:
-                item = node.item
-                if isinstance(item, Symbol):
-                    if not item._written:
-                        config_string = item.config_string
-                        if config_string:
-                            write(config_string)
-                        item._written = True
+        The resulting configuration file is incomplete, but a complete
+        configuration can be derived from it by loading it. Minimal
+        configuration files can serve as a more manageable configuration
+        format compared to a "full" .config file, especially when
+        configurations files are merged or edited by hand.
 
-                elif expr_value(node.dep) and \
-                     ((item == MENU and expr_value(node.visibility)) or
-                       item == COMMENT):
+        The default value of each symbol is calculated from the current values
+        of the other symbols, like in the C implementation, so the file is
+        generated in a single pass over the menu tree, without having to
+        unset and re-evaluate any values.
 
-                    write("\n#\n# {}\n#\n".format(node.prompt[0]))
+        Returns True if the file was written, and False if it was left alone
+        (only possible with only_if_changed=True).
 
-                # Iterative tree walk using parent pointers
+        filename:
+          Self-explanatory.
 
-                if node.list:
-                    node = node.list
-                elif node.next:
-                    node = node.next
-                else:
-                    while node.parent:
-                        node = node.parent
-                        if node.next:
-                            node = node.next
-                            break
-                    else:
-                        return
+        header (default: "# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n"):
+          Text that will be inserted verbatim at the beginning of the file. You
+          would usually want each line to start with '#' to make it a comment,
+          and include a final terminating newline.
+
+        only_if_changed (default: False):
+          If True, the file is only written if its contents would change, and
+          is written atomically. See write_autoconf().
+        """
+        return _write_contents(filename, self._min_config_contents(header),
+                               only_if_changed)
+
+    def sync_deps(self, path):
+        """
+        Creates or updates a directory structure that can be used to avoid
+        doing a full rebuild whenever the configuration is changed, mirroring
+        include/config/ in the kernel.
+
+        This works by touching (creating if needed) an empty file for each
+        symbol whose value changed since the last call. Symbols whose value
+        stays the same are left alone, and a symbol that has been n (or had
+        no value) all along never gets a file. Source files can then be made
+        to depend on the files for the symbols they reference (this is what
+        the kernel's scripts/basic/fixdep does), so that only affected source
+        files get rebuilt.
+
+        The file for a symbol is named after the symbol, lowercased and with
+        '_' turned into a directory separator, plus ".h". The file for FOO_BAR
+        is <path>/foo/bar.h, for example.
+
+        Symbol values from the previous call are kept in <path>/auto.conf,
+        which has the same format as include/config/auto.conf in the kernel
+        (a .config file without comments or 'is not set' lines). Files are
+        only touched for symbols whose value in that file differs from the
+        current value, so calling sync_deps() twice in a row touches nothing
+        the second time. If auto.conf does not exist, files are created for
+        all symbols with a non-n value.
+
+        Returns True if any symbol changed value (and so had its file
+        touched), and False otherwise. The C header written by
+        write_autoconf() only depends on symbol values, so it can be left
+        alone when False is returned, keeping its modification time:
+
+          if kconf.sync_deps("include/config"):
+              kconf.write_autoconf("include/generated/autoconf.h")
+
+        path:
+          Path to the directory. It is created if it does not exist.
+        """
+        if not os.path.exists(path):
+            os.makedirs(path, 0o755)
+
+        auto_conf_filename = os.path.join(path, "auto.conf")
+
+        # Values from the previous call, as they appear in auto.conf
+        old_vals = {}
+        try:
+            with open(auto_conf_filename, _UNIVERSAL_NEWLINES_MODE) as f:
+                contents = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            for match in self._assignment_re_finditer(contents):
+                name, val, _ = match.groups()
+                if name is not None:
+                    old_vals[name] = val.rstrip()
+
+        # Current values, in the same format. Symbols that would be written
+        # to auto.conf as 'n' (or not at all) are left out, like in the C
+        # implementation.
+        new_vals = {}
+        auto_conf_lines = []
+
+        # Avoid duplicates -- see write_config()
+        for sym in self.defined_syms:
+            sym._written = False
+
+        for sym in self.defined_syms:
+            if not sym._written:
+                sym._written = True
+
+                # _write_to_conf is determined when the value is calculated
+                val = sym.str_value
+                if not sym._write_to_conf or \
+                   (val == "n" and sym.orig_type in (BOOL, TRISTATE)):
+                    continue
+
+                if sym.orig_type == STRING:
+                    val = '"{}"'.format(escape(val))
+
+                new_vals[sym.name] = val
+                auto_conf_lines.append("{}{}={}\n"
+                                       .format(self.config_prefix, sym.name,
+                                               val))
+
+        changed = False
+
+        # Symbols that were removed from the Kconfig files since the last call
+        # count as changed as well, if they had a value
+        for name in set(old_vals).union(new_vals):
+            if old_vals.get(name) != new_vals.get(name):
+                _touch_dep_file(path, name)
+                changed = True
+
+        # Write auto.conf last and atomically. If we get interrupted before
+        # this, the files will be touched again on the next call, which is
+        # harmless.
+        _write_atomically(auto_conf_filename, "".join(auto_conf_lines))
+
+        return changed
 
     def eval_string(self, s):
         """
@@ -982,6 +1207,9 @@ class Kconfig(object):
 
         self._filename = None
 
+        # Don't keep expressions from earlier calls around
+        self._exprs = {}
+
         self._line = "if " + s
         self._tokenize()
         # Remove the "if " to avoid giving confusing error messages
@@ -996,18 +1224,471 @@ class Kconfig(object):
         Resets the user values of all symbols, as if Kconfig.load_config() or
         Symbol.set_value() had never been called.
         """
-        self._warn_no_prompt = False
+        # Clear the user values directly and invalidate everything at once
+        # if anything changed, which is cheaper than walking the dependents of
+        # each symbol. Undefined symbols can't have user values (set_value()
+        # rejects them), so we can just iterate over defined symbols.
+        changed = False
+
+        for sym in self.defined_syms:
+            if sym.user_value is not None:
+                sym.user_value = None
+                changed = True
+
+        for choice in self._choices:
+            if choice.user_value is not None or choice.user_selection:
+                choice.user_value = choice.user_selection = None
+                changed = True
+
+        if changed:
+            self._invalidate_all()
+
+    @contextmanager
+    def batch(self):
+        """
+        Returns a context manager for setting many user values at once, for
+        use in a 'with' statement:
+
+          with kconf.batch():
+              for sym in kconf.defined_syms:
+                  sym.set_value(2)
+
+        Within the block, Symbol/Choice.set_value() and unset_value() just
+        record the new user values. The values of dependent symbols and
+        choices are invalidated in a single pass when the block ends, which
+        avoids walking the same dependents over and over for each assignment.
+        The end result is identical to setting the values without batch().
+
+        Symbol and choice values (str_value, tri_value, assignable, etc.)
+        should not be read within the block, as they might be stale.
+
+        load_config() uses batch() internally. batch() blocks can be nested,
+        and invalidation then happens when the outermost block ends.
+        """
+        if self._deferred_invalidation is not None:
+            # Nested batch() block
+            yield
+            return
+
+        self._deferred_invalidation = []
+        try:
+            yield
+        finally:
+            items = self._deferred_invalidation
+            self._deferred_invalidation = None
+            self._rec_invalidate_items(items)
+
+    def snapshot(self):
+        """
+        Returns a snapshot of the current user values of all symbols and
+        choices (including Choice.user_selection), together with their cached
+        values. Pass it to restore() to go back to the same state later, e.g.
+        after trying out some assignments:
+
+          snapshot = kconf.snapshot()
+          kconf.syms["FOO"].set_value(2)
+          print(kconf.syms["BAR"].str_value)
+          kconf.restore(snapshot)
+
+        This is cheaper and less error-prone than undoing the assignments one
+        by one, and restoring also brings back the cached values, so that
+        nothing needs to be recalculated.
+
+        Snapshots can also be restored on copies of the instance made with
+        copy.deepcopy() or pickling (and on the instance they were copied
+        from), since they have the same parsed configuration. The format of
+        the snapshot is an implementation detail.
+        """
+        # Cached values from earlier generations are out of date. See
+        # _invalidate_all().
+        gen = self._generation
+
+        syms = self.defined_syms
+        valid = [sym._cache_gen == gen for sym in syms]
+        sym_vals = [[getattr(sym, name) for sym in syms]
+                    if name in _SNAPSHOT_UNCACHED else
+                    [getattr(sym, name) if is_valid else None
+                     for sym, is_valid in zip(syms, valid)]
+                    for name in _SNAPSHOT_SYM_ATTRS]
+
+        choice_vals = []
+        for choice in self._choices:
+            # Choice symbols are saved as indices into Choice.syms, which work
+            # across copied instances
+            if choice._cache_gen == gen:
+                vis = choice._cached_vis
+                assignable = choice._cached_assignable
+                selection = choice._cached_selection
+                if selection is not None and \
+                   selection is not _NO_CACHED_SELECTION:
+                    selection = choice.syms.index(selection)
+            else:
+                vis = assignable = None
+                selection = _NO_CACHED_SELECTION
+
+            user_selection = choice.user_selection
+            if user_selection is not None:
+                user_selection = choice.syms.index(user_selection)
+
+            choice_vals.append((choice.user_value, user_selection, vis,
+                                assignable, selection))
+
+        return sym_vals, choice_vals
+
+    def restore(self, snapshot):
+        """
+        Restores the user values and cached values of all symbols and choices
+        from a snapshot returned by snapshot(), on this instance or a copy of
+        it.
+        """
+        sym_vals, choice_vals = snapshot
+        syms = self.defined_syms
+
+        # Assign the slots on all symbols at once through the slot
+        # descriptors, like in _load_tree()
+        for name, vals in zip(_SNAPSHOT_SYM_ATTRS, sym_vals):
+            list(map(getattr(Symbol, name).__set__, syms, vals))
+
+        # Memoized subexpression values might not match the restored values
+        self._expr_memo_gen += 1
+
+        # The restored cached values are valid in the current generation
+        gen = self._generation
+        for sym in syms:
+            sym._cache_gen = gen
+
+        for choice, (user_value, user_selection, vis, assignable,
+                     selection) in zip(self._choices, choice_vals):
+
+            choice.user_value = user_value
+            choice.user_selection = None if user_selection is None else \
+                                    choice.syms[user_selection]
+
+            choice._cached_vis = vis
+            choice._cached_assignable = assignable
+            choice._cached_selection = \
+                choice.syms[selection] if selection.__class__ is int else \
+                selection
+            choice._cache_gen = gen
+
+    def allyesconfig(self):
+        """
+        Sets the user values of symbols and choices to give the same
+        configuration as 'make allyesconfig', clearing any existing user
+        values first. Write the result with write_config().
+
+        Each bool/tristate symbol and choice is set to its highest assignable
+        value until nothing can be raised further. y-mode choices get their
+        default selection, and all symbols in m-mode choices are set to m.
+        """
+        def adjust(item, set_value):
+            # Set the item to its highest assignable value, unless it already
+            # has that value. assignable[-1] gives the last element.
+            if item.assignable and item.tri_value < item.assignable[-1]:
+                set_value(item, item.assignable[-1])
+
+                if isinstance(item, Choice) and item.tri_value == 1:
+                    for sym in item.syms:
+                        set_value(sym, 1)
+
+        self.unset_values()
+        self._fixpoint([sym for sym in self.defined_syms if not sym.choice] +
+                       self._choices,
+                       adjust)
+
+    def allnoconfig(self):
+        """
+        Sets the user values of symbols to give the same configuration as
+        'make allnoconfig', clearing any existing user values first. Write the
+        result with write_config().
+
+        Symbols with 'option allnoconfig_y' are set to y. Other bool/tristate
+        symbols are lowered to their lowest assignable value, in menu order,
+        until nothing can be lowered further (selects from later symbols can
+        make it possible to lower earlier symbols).
+        """
+        def adjust(sym, set_value):
+            if not sym.is_allnoconfig_y and sym.assignable and \
+               sym.assignable[0] < sym.tri_value:
+                set_value(sym, sym.assignable[0])
+
+        self.unset_values()
+
+        with self.batch():
+            for sym in self.defined_syms:
+                if sym.is_allnoconfig_y:
+                    sym.set_value(2)
+
+        self._fixpoint([node.item for node in _menu_nodes(self.top_node)
+                        if isinstance(node.item, Symbol)],
+                       adjust)
+
+    def alldefconfig(self):
+        """
+        Gives the same configuration as 'make alldefconfig', where all symbols
+        get their default values. Since the defaults are what's left without
+        user values, this is the same as unset_values().
+        """
+        self.unset_values()
+
+    def randconfig(self, seed=None, probability=50):
+        """
+        Sets the user values of symbols and choices to a random
+        configuration, like 'make randconfig', clearing any existing user
+        values first. Write the result with write_config().
+
+        The menu tree is walked in order, and each bool/tristate symbol and
+        choice is set to a random value from its 'assignable' values at that
+        point, so the values set are always within range given the earlier
+        assignments. Since symbols mostly depend on symbols that appear
+        before them, assigning in menu order also keeps invalidation cheap.
+        Symbols with other types keep their default values, like in the C
+        tools.
+
+        seed (default: None):
+          Seed for the random number generator. The same seed always gives
+          the same configuration for a given Kconfig tree. If None, a random
+          seed is used.
+
+        probability (default: 50):
+          Percent chance that a symbol is set to a value other than n, when
+          possible (like KCONFIG_PROBABILITY). The non-n values are equally
+          likely. Choice modes and the symbols selected in y-mode choices are
+          picked uniformly.
+        """
+        rand = random.Random(seed)
+
+        self.unset_values()
+
+        visited = set()
+        for node in _menu_nodes(self.top_node):
+            item = node.item
+            if item.__class__ not in (Symbol, Choice) or item in visited:
+                continue
+            visited.add(item)
+
+            if item.__class__ is Choice:
+                _randomize_choice(item, rand, probability)
+
+            elif not item.choice:
+                # Choice symbols are handled along with the choice
+                assignable = item.assignable
+                if len(assignable) > 1:
+                    item.set_value(
+                        _random_tri(assignable, rand, probability))
+
+    def randconfigs(self, seeds, probability=50, processes=1,
+                    header="# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n"):
+        """
+        Generates a random configuration with randconfig() for each seed in
+        'seeds', and returns a list with the contents of the .config files, in
+        the same order as 'seeds'. The user values of this instance are
+        restored afterwards.
+
+        Only the values change between configurations, so a single parsed
+        tree is reused for all of them.
+
+        seeds:
+          Iterable of seeds. See randconfig().
+
+        probability (default: 50):
+          See randconfig().
+
+        processes (default: 1):
+          The number of worker processes to generate configurations in. If
+          1, configurations are generated in the calling process. If None, the
+          number of CPUs is used. Each worker gets a pickled copy of the
+          instance (see the class documentation) instead of reparsing.
+
+        header (default: "# Generated by Kconfiglib (https://github.com/ulfalizer/Kconfiglib)\n"):
+          See write_config().
+        """
+        seeds = list(seeds)
+
+        if processes == 1:
+            snapshot = self.snapshot()
+            try:
+                return [_randconfig_contents(self, seed, probability, header)
+                        for seed in seeds]
+            finally:
+                self.restore(snapshot)
+
+        # Only imported when needed. See parse_many().
+        import multiprocessing
+
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        # One task per process, with a consecutive run of seeds. Each task
+        # carries a pickled copy of the instance.
+        chunk_size = max(-(-len(seeds)//processes), 1)
+        tasks = [(self, seeds[i:i + chunk_size], probability, header)
+                 for i in range(0, len(seeds), chunk_size)]
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_randconfig_worker, tasks, 1)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        return [contents for chunk in results for contents in chunk]
+
+    def compile(self):
+        """
+        Compiles the expressions that symbol and choice values depend on into
+        nested Python closures, which Symbol.tri_value, Symbol.str_value,
+        Symbol/Choice.visibility, etc. then use instead of interpreting the
+        expressions with expr_value(). This is an optional optimization that
+        speeds up scripts that calculate the values of many symbols repeatedly
+        (e.g. allnoconfig.py and allyesconfig.py, or anything that calls
+        Kconfig.load_config() a lot). It does not change any values.
+
+        The closures are specialized to each symbol, e.g. by skipping
+        evaluation of 'rev_dep' for symbols that are never selected, and
+        short-circuit in the same way as expr_value(). Compilation takes
+        roughly as long as evaluating all symbols once.
+
+        The closures capture the expressions as they are when compile() is
+        called. Assigning Symbol.rev_dep or Symbol.weak_rev_dep drops the
+        closures for the symbol, making it fall back on interpreting its
+        expressions. If other expressions (e.g. Symbol.defaults or
+        Symbol/Choice.direct_dep) are modified after compile(), call compile()
+        again.
+
+        Calling compile() more than once is harmless. Compiled closures are
+        not saved in cache files.
+        """
+        # Creating lots of closures makes the cyclic garbage collector kick in
+        # over and over, like in _load_cache()
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+
+        # Shared subexpressions only get compiled once. See _compile_expr().
+        memo = {}
+
         try:
-            # set_value() already rejects undefined symbols, and they don't
-            # need to be invalidated (because their value never changes), so we
-            # can just iterate over defined symbols
             for sym in self.defined_syms:
-                sym.unset_value()
+                sym._compiled_vis = _compile_visibility(sym, memo)
+
+                if sym.orig_type in (BOOL, TRISTATE) and not sym.choice:
+                    sym._compiled_tri = _compile_tri_value(sym, memo)
 
             for choice in self._choices:
-                choice.unset_value()
+                choice._compiled_vis = _compile_visibility(choice, memo)
+
         finally:
-            self._warn_no_prompt = True
+            if gc_was_enabled:
+                gc.enable()
+
+    def evaluate_all(self):
+        """
+        Calculates the values of all symbols and choices, so that later reads
+        of e.g. Symbol.str_value, Symbol.visibility, and Choice.selection (and
+        write_config() and write_autoconf(), which use them) just return
+        cached values. The values are the same as if they had been read one
+        by one.
+
+        Reading a value calculates the values it depends on recursively,
+        which gives deep call stacks for long dependency chains. evaluate_all()
+        instead calculates values in dependency order, so that everything an
+        item depends on has already been calculated when the item is reached.
+        The order is worked out on the first call (see _dep_order()) and
+        reused after that.
+
+        Values are only cached until they're invalidated, e.g. by
+        Symbol.set_value(), so call this after assigning values.
+        """
+        if self._eval_order is None:
+            self._eval_order = _dep_order(self)
+
+        # The type of tristate symbols depends on MODULES, which isn't
+        # recorded in _dependents. See Symbol._rec_invalidate().
+        self.modules.tri_value
+
+        for item in self._eval_order:
+            if item.__class__ is Symbol:
+                # Also calculates tri_value and visibility
+                item.str_value
+            else:
+                item.selection
+
+    def tri_values_many(self, configs):
+        """
+        Calculates the tristate values of all defined symbols for many sets of
+        user values at once. Returns a NumPy array of type int8 with one row
+        per configuration in 'configs', and one column per symbol in
+        Kconfig.defined_syms. Each row is the same as Symbol.tri_value for all
+        symbols after calling unset_values() and then Symbol.set_value() for
+        each assignment in the configuration (except that no warnings are
+        printed for values that are invalid for the type of the symbol).
+
+        Requires NumPy. The dependency logic of bool and tristate symbols is
+        lowered into operations on arrays with one element per configuration
+        (min for AND, max for OR, 2 - x for NOT, etc.), and each symbol is
+        then calculated for all configurations in a single pass over the
+        symbols. This is much faster than setting and evaluating values
+        configuration by configuration when there are many configurations.
+
+        Choices, choice symbols, relations (FOO = "bar", etc.), and symbols
+        that depend on them are not vectorized. Their values are calculated
+        by assigning the values of each configuration in turn, which is
+        slower. The values of other symbols never depend on them. The user
+        values of the Kconfig instance are restored afterwards.
+
+        The tristate value of string, int, and hex symbols is always 0 (n).
+
+        configs:
+          Sequence of dictionaries that map Symbol instances to user values,
+          in any format accepted by Symbol.set_value().
+        """
+        # Only imported when needed. NumPy is an optional dependency.
+        import numpy
+
+        if self._vec_plan is None:
+            self._vec_plan = _vec_plan(self)
+
+        vec_syms, fallback_syms = self._vec_plan
+
+        # Maps each symbol to its columns. Symbols defined in multiple
+        # locations appear multiple times in defined_syms. Values are
+        # calculated for the first column and copied to the others at the
+        # end.
+        cols = {}
+        for i, sym in enumerate(self.defined_syms):
+            cols.setdefault(sym, []).append(i)
+        col = dict((sym, indices[0]) for sym, indices in cols.items())
+
+        res = numpy.zeros((len(configs), len(self.defined_syms)), numpy.int8)
+
+        # User values of the vectorized symbols, with -1 for no user value
+        user_vals = numpy.full(res.shape, -1, numpy.int8)
+        for i, config in enumerate(configs):
+            for sym, val in config.items():
+                # Symbols with 'option env' ignore user values
+                if sym in vec_syms and sym.env_var is None:
+                    val = STR_TO_TRI.get(val, val)
+                    if val in (0, 2) or (val == 1 and
+                                         sym.orig_type == TRISTATE):
+                        user_vals[i, col[sym]] = val
+
+        vals = _vec_eval(vec_syms, user_vals, col, numpy)
+        for sym, val in vals.items():
+            if sym in vec_syms:
+                res[:, col[sym]] = val
+
+        if fallback_syms:
+            self._tri_values_fallback(configs, fallback_syms, col, res)
+
+        for indices in cols.values():
+            for i in indices[1:]:
+                res[:, i] = res[:, indices[0]]
+
+        return res
 
     def enable_warnings(self):
         """
@@ -1066,6 +1747,21 @@ class Kconfig(object):
                 ("enabled" if self._print_redun_assign else "disabled")
         )))
 
+    def __getstate__(self):
+        """
+        Returns the state of the Kconfig object for pickling, as a string of
+        bytes. See _dump_kconfig().
+        """
+        f = io.BytesIO()
+        _dump_kconfig(self, f)
+        return f.getvalue()
+
+    def __setstate__(self, state):
+        """
+        Restores the Kconfig object from a state returned by __getstate__().
+        """
+        _load_kconfig(self, io.BytesIO(state))
+
     #
     # Private methods
     #
@@ -1104,13 +1800,126 @@ class Kconfig(object):
                         "unset" if self.srctree is None else
                         '"{}"'.format(self.srctree)))
 
+    def _read_kconfig(self, filename):
+        """
+        Like _open(), for Kconfig files read while parsing, but reads the
+        entire file in one go and returns a list with its lines (including
+        newlines). Records the file in Kconfig.kconfig_filenames, and its
+        modification time and size in Kconfig._file_stats.
+
+        Indexing into a list of lines is a good deal faster than calling
+        readline() for each line, and means no files are kept open while
+        sourced files are parsed.
+
+        Also sets Kconfig._line_tokens to the tokenized lines of the file from
+        _pretokenize(), if available, or to None.
+        """
+        with self._open(filename) as f:
+            if f.name != filename:
+                # Found via $srctree. A file appearing at 'filename' would take
+                # precedence, so that needs to invalidate the cache as well.
+                self._file_stats.append((filename, None))
+
+            st = os.fstat(f.fileno())
+            stat = (st.st_mtime, st.st_size)
+            self.kconfig_filenames.append(intern(f.name))
+            self._file_stats.append((f.name, stat))
+
+            self._line_tokens = None
+            if self._pretokenized is not None:
+                pretokenized = self._pretokenized.get(filename)
+                # Make sure the worker process saw the same file
+                if pretokenized is not None and pretokenized[0] == stat:
+                    self._line_tokens = pretokenized[1]
+
+            return f.readlines()
+
+    def _pretokenize(self, filename, processes):
+        """
+        Reads and tokenizes the Kconfig file 'filename', and all Kconfig files
+        statically sourced from it, in a pool of 'processes' worker processes.
+        Returns a dictionary that maps filenames to ((mtime, size),
+        line_tokens) tuples, where line_tokens holds the tokens of the line
+        that starts at each index (None for lines that need to be tokenized
+        while parsing, and for help texts). Symbols appear as
+        (name, is_constant) tuples in the tokens, and are looked up in
+        _next_line(), in the same order as in serial parsing. Lines with
+        symbols in them are lists, and other lines tuples.
+
+        Files are tokenized one level of 'source' nesting at a time.
+        """
+        # Only imported when needed, as it's slow to import compared to the
+        # rest of Kconfiglib
+        import multiprocessing
+
+        pretokenized = {}
+        seen = set((filename,))
+        filenames = [filename]
+
+        pool = multiprocessing.Pool(processes, _pretokenize_init,
+                                    (self.srctree, self._scanner_tokenizer))
+        try:
+            while filenames:
+                next_filenames = []
+
+                # chunksize=1 to spread out large files
+                for filename, res in zip(
+                        filenames,
+                        pool.map(_pretokenize_worker, filenames, 1)):
+
+                    if res is None:
+                        # Could not be opened. Reported when parsing gets
+                        # to it (if it does).
+                        continue
+
+                    stat, line_tokens, sourced = res
+                    pretokenized[filename] = (stat, line_tokens)
+
+                    for sourced_filename in sourced:
+                        if sourced_filename not in seen:
+                            seen.add(sourced_filename)
+                            next_filenames.append(sourced_filename)
+
+                filenames = next_filenames
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+
+        return pretokenized
+
+    def _load_help(self, filename, start, end, indent):
+        """
+        Reads the help text that spans lines start to end (exclusive, indices
+        into the file's lines) with indentation 'indent' from the Kconfig file
+        'filename', for MenuNode.help with lazy_help=True.
+
+        The lines of the last file read from are kept around, as help texts
+        tend to be read in menu order, e.g. when searching them.
+        """
+        if self._help_file is None or self._help_file[0] != filename:
+            with self._open(filename) as f:
+                st = os.fstat(f.fileno())
+                lines = f.readlines()
+
+            if (f.name, (st.st_mtime, st.st_size)) not in self._file_stats:
+                self._warn("{} has changed since it was parsed. Help texts "
+                           "read from it might be wrong.".format(f.name))
+
+            self._help_file = (filename, lines)
+
+        return _help_text(self._help_file[1][start:end], indent)
+
     def _enter_file(self, filename):
         """
         Jumps to the beginning of a sourced Kconfig file, saving the previous
-        position and file object.
+        position and lines.
         """
         # Check for recursive 'source'
-        for _, name, _ in self._filestack:
+        for _, _, name, _ in self._filestack:
             if name == filename:
                 # KconfigParseError might have been a better name, but too late
                 raise KconfigSyntaxError(
@@ -1119,12 +1928,15 @@ class Kconfig(object):
                     "Backtrace:\n{}"
                     .format(self._filename, self._linenr, filename,
                             "\n".join("{}:{}".format(name, linenr)
-                                      for _, name, linenr
+                                      for _, _, name, linenr
                                       in reversed(self._filestack))))
 
-        self._filestack.append((self._file, self._filename, self._linenr))
+        filename = intern(filename)
+
+        self._filestack.append((self._lines, self._line_tokens,
+                                self._filename, self._linenr))
         try:
-            self._file = self._open(filename)
+            self._lines = self._read_kconfig(filename)
         except IOError as e:
             # Extend the error message a bit in this case
             raise IOError(
@@ -1142,57 +1954,253 @@ class Kconfig(object):
         """
         Returns from a Kconfig file to the file that sourced it.
         """
-        self._file.close()
-        self._file, self._filename, self._linenr = self._filestack.pop()
+        self._lines, self._line_tokens, self._filename, self._linenr = \
+            self._filestack.pop()
 
     def _next_line(self):
         """
         Fetches and tokenizes the next line from the current Kconfig file.
         Returns False at EOF and True otherwise.
         """
-        # _saved_line provides a single line of "unget", currently only used
-        # for help texts.
-        #
-        # This also works as expected if _saved_line is "", indicating EOF:
-        # "" is falsy, and readline() returns "" over and over at EOF.
-        if self._saved_line:
-            self._line = self._saved_line
-            self._saved_line = None
-        else:
-            self._line = self._file.readline()
-            if not self._line:
-                return False
-            self._linenr += 1
+        lines = self._lines
+        linenr = self._linenr
 
-        # Handle line joining
-        while self._line.endswith("\\\n"):
-            self._line = self._line[:-2] + self._file.readline()
-            self._linenr += 1
+        try:
+            line = lines[linenr]
+        except IndexError:
+            # EOF. Only happens once per file, so cheaper than checking the
+            # length.
+            return False
 
-        self._tokenize()
+        linenr += 1
+
+        # Handle line joining. Lines are only concatenated when there's a
+        # continuation, which is rare.
+        if line.endswith("\\\n"):
+            parts = []
+            while line.endswith("\\\n") and linenr < len(lines):
+                parts.append(line[:-2])
+                line = lines[linenr]
+                linenr += 1
+
+            if line.endswith("\\\n"):
+                # Continuation on the last line of the file
+                line = line[:-2]
+
+            parts.append(line)
+            line = "".join(parts)
+
+        self._line = line
+
+        if self._line_tokens is not None:
+            # Pre-tokenized by _pretokenize(). The index is the index of the
+            # first line, before joining.
+            tokens = self._line_tokens[self._linenr]
+            self._linenr = linenr
+
+            if tokens is not None:
+                if tokens.__class__ is list:
+                    # Has symbols in it
+                    lookup_sym = self._lookup_sym
+                    lookup_const_sym = self._lookup_const_sym
+
+                    tokens = [
+                        (lookup_const_sym if token[1] else lookup_sym)(
+                            token[0])
+                        if token.__class__ is tuple else token
+                        for token in tokens]
+
+                self._tokens = tokens
+                self._tokens_i = -1
+                return True
+        else:
+            self._linenr = linenr
+
+        if self._scanner_tokenizer:
+            self._tokenize_scanner()
+        else:
+            self._tokenize()
         return True
 
 
     #
-    # Tokenization
+    # File writing
     #
 
-    def _lookup_sym(self, name):
+    def _autoconf_contents(self, header):
         """
-        Fetches the symbol 'name' from the symbol table, creating and
-        registering it if it does not exist. If '_parsing_kconfigs' is False,
-        it means we're in eval_string(), and new symbols won't be registered.
+        Returns the contents of the C header written by write_autoconf(), as
+        a string.
         """
-        if name in self.syms:
-            return self.syms[name]
+        chunks = [header]
+        # Small optimization
+        add = chunks.append
 
-        sym = Symbol()
-        sym.kconfig = self
-        sym.name = name
-        sym.is_constant = False
-        sym.rev_dep = sym.weak_rev_dep = sym.direct_dep = self.n
+        # Avoid duplicates -- see _config_contents()
+        for sym in self.defined_syms:
+            sym._written = False
 
-        if self._parsing_kconfigs:
+        for sym in self.defined_syms:
+            if not sym._written:
+                # Note: _write_to_conf is determined when the value is
+                # calculated. This is a hidden function call due to property
+                # magic.
+                val = sym.str_value
+                if sym._write_to_conf:
+                    if sym.orig_type in (BOOL, TRISTATE):
+                        if val != "n":
+                            add("#define {}{}{} 1\n"
+                                .format(self.config_prefix, sym.name,
+                                        "_MODULE" if val == "m" else ""))
+
+                    elif sym.orig_type == STRING:
+                        add('#define {}{} "{}"\n'
+                            .format(self.config_prefix, sym.name,
+                                    escape(val)))
+
+                    elif sym.orig_type in (INT, HEX):
+                        if sym.orig_type == HEX and \
+                           not val.startswith(("0x", "0X")):
+                            val = "0x" + val
+
+                        add("#define {}{} {}\n"
+                            .format(self.config_prefix, sym.name, val))
+
+                    else:
+                        _internal_error("Internal error while creating C "
+                                        'header: unknown type "{}".'
+                                        .format(sym.orig_type))
+
+                sym._written = True
+
+        return "".join(chunks)
+
+    def _config_contents(self, header):
+        """
+        Returns the contents of the .config file written by write_config(),
+        as a string.
+        """
+        chunks = [header]
+        # Small optimization
+        add = chunks.append
+
+        # Symbol._written is set to True when a symbol config string is
+        # fetched, so that symbols defined in multiple locations only get one
+        # .config entry. We reset it prior to writing out a new .config. It
+        # only needs to be reset for defined symbols, because undefined
+        # symbols will never be written out (because they do not appear in
+        # the menu tree rooted at Kconfig.top_node).
+        #
+        # The C tools reuse _write_to_conf for this, but we cache
+        # _write_to_conf together with the value and don't invalidate cached
+        # values when writing .config files, so that won't work.
+        for sym in self.defined_syms:
+            sym._written = False
+
+        node = self.top_node.list
+        if not node:
+            # Empty configuration
+            return header
+
+        while 1:
+            item = node.item
+            if isinstance(item, Symbol):
+                if not item._written:
+                    config_string = item.config_string
+                    if config_string:
+                        add(config_string)
+                    item._written = True
+
+            elif expr_value(node.dep) and \
+                 ((item == MENU and expr_value(node.visibility)) or
+                   item == COMMENT):
+
+                add("\n#\n# {}\n#\n".format(node.prompt[0]))
+
+            # Iterative tree walk using parent pointers
+
+            if node.list:
+                node = node.list
+            elif node.next:
+                node = node.next
+            else:
+                while node.parent:
+                    node = node.parent
+                    if node.next:
+                        node = node.next
+                        break
+                else:
+                    return "".join(chunks)
+
+    def _min_config_contents(self, header):
+        """
+        Returns the contents of the file written by write_min_config(), as a
+        string.
+        """
+        chunks = [header]
+        add = chunks.append
+
+        # Only the first definition location of a symbol is considered, like
+        # in _config_contents(), which also matches the C tools
+        for sym in self.defined_syms:
+            sym._written = False
+
+        for node in _menu_nodes(self.top_node):
+            sym = node.item
+            if sym.__class__ is not Symbol or sym._written:
+                continue
+
+            sym._written = True
+
+            config_string = sym.config_string
+            if not config_string:
+                continue
+
+            # Skip symbols that can't be changed by the user, which includes
+            # symbols selected to their maximum visibility
+            if sym.visibility <= expr_value(sym._rev_dep):
+                continue
+
+            # Skip symbols whose value matches their default
+            if sym.str_value == sym._str_default():
+                continue
+
+            # Skip choice symbols that would be selected by default anyway.
+            # This can't be done for optional choices (the choice mode could
+            # be set to n) and non-bool symbols (the symbol could be set to
+            # m), which matches the C tools.
+            if sym.choice and \
+               not sym.choice.is_optional and \
+               sym.choice._get_selection_from_defaults() is sym and \
+               sym.orig_type == BOOL and \
+               sym.tri_value == 2:
+                continue
+
+            add(config_string)
+
+        return "".join(chunks)
+
+
+    #
+    # Tokenization
+    #
+
+    def _lookup_sym(self, name):
+        """
+        Fetches the symbol 'name' from the symbol table, creating and
+        registering it if it does not exist. If '_parsing_kconfigs' is False,
+        it means we're in eval_string(), and new symbols won't be registered.
+        """
+        if name in self.syms:
+            return self.syms[name]
+
+        sym = Symbol()
+        sym.kconfig = self
+        sym.name = name = intern(name)
+        sym.is_constant = False
+        sym._rev_dep = sym._weak_rev_dep = sym.direct_dep = self.n
+
+        if self._parsing_kconfigs:
             self.syms[name] = sym
         else:
             self._warn("no symbol {} in configuration".format(name))
@@ -1208,9 +2216,9 @@ class Kconfig(object):
 
         sym = Symbol()
         sym.kconfig = self
-        sym.name = name
+        sym.name = name = intern(name)
         sym.is_constant = True
-        sym.rev_dep = sym.weak_rev_dep = sym.direct_dep = self.n
+        sym._rev_dep = sym._weak_rev_dep = sym.direct_dep = self.n
 
         if self._parsing_kconfigs:
             self.const_syms[name] = sym
@@ -1423,6 +2431,97 @@ class Kconfig(object):
         # simpler/faster
         self._tokens.append(None)
 
+    def _tokenize_scanner(self):
+        """
+        Alternative implementation of _tokenize() that produces the same
+        tokens, but lexes everything past the first token with a single
+        combined regex (_scanner_re_findall), in one call per line, and
+        dispatches on which group matched, instead of branching on individual
+        characters.
+
+        Kept for A/B comparisons against _tokenize(). Used for parsing if
+        Kconfig() is called with scanner_tokenizer=True.
+        """
+        s = self._line
+
+        # Token index (minus one). Set for later -- not further updated here.
+        self._tokens_i = -1
+
+        # The first token is parsed specially, like in _tokenize()
+        initial_token_match = _initial_token_re_match(s)
+        if not initial_token_match:
+            self._tokens = (None,)
+            return
+
+        # 'token' refers to the previous token while parsing a token, like in
+        # _tokenize()
+        token = _get_keyword(initial_token_match.group(1))
+
+        if token == _T_HELP:
+            self._tokens = (token, None)
+            return
+
+        if token is None:
+            self._parse_error("expected keyword as first token")
+
+        i = initial_token_match.end()
+        if i == len(s):
+            # Single-token line. The regex eats the newline.
+            self._tokens = (token, None)
+            return
+
+        tokens = [token]
+        # Small optimization
+        add_token = tokens.append
+
+        # At most one of the groups is non-empty for each match
+        for name, string, op, comment, quote in _scanner_re_findall(s, i):
+
+            if name:
+                keyword = _get_keyword(name)
+                if keyword is not None:
+                    token = keyword
+
+                elif token not in _STRING_LEX:
+                    token = self.const_syms[name] \
+                            if name in ("n", "m", "y") else \
+                            self._lookup_sym(name)
+
+                else:
+                    # Missing quotes. See _tokenize().
+                    token = name
+
+            elif op:
+                token = _OPERATOR_TOKENS[op]
+
+            elif string:
+                # Strip the quotes
+                val = string[1:-1]
+                if "\\" in val:
+                    val = _unescape_re_sub(r"\1", val)
+
+                # 'option env="FOO"' does not refer to a constant symbol named
+                # "FOO". See _tokenize().
+                token = val \
+                        if token in _STRING_LEX or tokens[0] == _T_OPTION else \
+                        self._lookup_const_sym(val)
+
+            elif comment:
+                break
+
+            elif quote:
+                self._parse_error("unterminated string")
+
+            else:
+                # Invalid characters (including lone '&' and '|') are ignored
+                # (backwards-compatible)
+                continue
+
+            add_token(token)
+
+        add_token(None)
+        self._tokens = tokens
+
     def _next_token(self):
         self._tokens_i += 1
         return self._tokens[self._tokens_i]
@@ -1515,7 +2614,12 @@ class Kconfig(object):
         if e1 is self.n or e2 is self.n:
             return self.n
 
-        return (AND, e1, e2)
+        # Inlined _make_expr(), as this is called a lot
+        key = (AND, id(e1), id(e2))
+        expr = self._exprs.get(key)
+        if expr is None:
+            expr = self._exprs[key] = (AND, e1, e2)
+        return expr
 
     def _make_or(self, e1, e2):
         """
@@ -1530,7 +2634,37 @@ class Kconfig(object):
         if e1 is self.y or e2 is self.y:
             return self.y
 
-        return (OR, e1, e2)
+        # Inlined _make_expr(), as this is called a lot
+        key = (OR, id(e1), id(e2))
+        expr = self._exprs.get(key)
+        if expr is None:
+            expr = self._exprs[key] = (OR, e1, e2)
+        return expr
+
+    def _make_expr(self, op, e1, e2=None):
+        """
+        Returns the expression (op, e1, e2), or (op, e1) for NOT. If an
+        identical expression has already been created during parsing, it is
+        returned instead of a new tuple.
+
+        Expressions get built from the bottom up, so 'e1' and 'e2' have
+        already been through here, and comparing them by identity is enough.
+        This makes the check cheap even for deep expressions.
+
+        Dependencies from menus and ifs get propagated to every property of
+        every symbol inside them, and the same conditions show up in many
+        places, so this saves a lot of memory. It also makes shared
+        subexpressions recognizable by identity, which Kconfig.compile() and
+        the memoization in _expr_value() take advantage of.
+        """
+        key = (op, id(e1), id(e2))
+        expr = self._exprs.get(key)
+        if expr is None:
+            # The objects in 'key' are kept alive by 'expr', so their ids
+            # can't get reused
+            expr = self._exprs[key] = \
+                (op, e1) if e2 is None else (op, e1, e2)
+        return expr
 
     def _parse_block(self, end_token, parent, visible_if_deps, prev_node):
         """
@@ -1580,7 +2714,7 @@ class Kconfig(object):
                 node = MenuNode()
                 node.kconfig = self
                 node.item = sym
-                node.help = node.list = None
+                node._help = node.list = None
                 node.parent = parent
                 node.filename = self._filename
                 node.linenr = self._linenr
@@ -1657,7 +2791,7 @@ class Kconfig(object):
 
                 prompt = self._expect_str_and_eol()
                 self._parse_properties(node, visible_if_deps)
-                node.prompt = (prompt, node.dep)
+                node.prompt = (intern(prompt), node.dep)
 
                 self._parse_block(_T_ENDMENU,
                                   node,         # parent
@@ -1679,7 +2813,7 @@ class Kconfig(object):
 
                 prompt = self._expect_str_and_eol()
                 self._parse_properties(node, visible_if_deps)
-                node.prompt = (prompt, node.dep)
+                node.prompt = (intern(prompt), node.dep)
 
                 prev_node.next = prev_node = node
 
@@ -1694,7 +2828,7 @@ class Kconfig(object):
                     if not choice:
                         choice = Choice()
                         self._choices.append(choice)
-                        choice.name = name
+                        choice.name = name = intern(name)
                         self.named_choices[name] = choice
 
                 choice.kconfig = self
@@ -1702,7 +2836,7 @@ class Kconfig(object):
                 node = MenuNode()
                 node.kconfig = self
                 node.item = choice
-                node.help = None
+                node._help = None
                 node.parent = parent
                 node.filename = self._filename
                 node.linenr = self._linenr
@@ -1719,7 +2853,8 @@ class Kconfig(object):
                 prev_node.next = prev_node = node
 
             elif t0 == _T_MAINMENU:
-                self.top_node.prompt = (self._expect_str_and_eol(), self.y)
+                self.top_node.prompt = (intern(self._expect_str_and_eol()),
+                                        self.y)
                 self.top_node.filename = self._filename
                 self.top_node.linenr = self._linenr
 
@@ -1804,59 +2939,28 @@ class Kconfig(object):
                 node.dep = self._make_and(node.dep, self._parse_expr(True))
 
             elif t0 == _T_HELP:
-                # Find first non-blank (not all-space) line and get its
-                # indentation
-
-                if node.help is not None:
+                if node._help is not None:
                     self._warn("{} defined with more than one help text -- "
                                "only the last one will be used"
                                .format(_name_and_loc_str(node.item)))
 
-                # Small optimization. This code is pretty hot.
-                readline = self._file.readline
-
-                while 1:
-                    line = readline()
-                    self._linenr += 1
-                    if not line or not line.isspace():
-                        break
-
-                if not line:
-                    self._warn("{} has 'help' but empty help text"
-                               .format(_name_and_loc_str(node.item)))
+                start, end, indent = _help_lines(self._lines, self._linenr)
 
-                    node.help = ""
-                    break
+                # The line that ended the help text is left for _next_line()
+                self._linenr = end
 
-                indent = _indentation(line)
-                if indent == 0:
-                    # If the first non-empty lines has zero indent, there is no
-                    # help text
+                if start == end:
                     self._warn("{} has 'help' but empty help text"
                                .format(_name_and_loc_str(node.item)))
 
-                    node.help = ""
-                    self._saved_line = line  # "Unget" the line
+                    node._help = ""
                     break
 
-                help_lines = [_dedent_rstrip(line, indent)]
-                # Small optimization
-                add_help_line = help_lines.append
-
-                # The help text goes on till the first non-empty line with less
-                # indent
-
-                while 1:
-                    line = readline()
-                    self._linenr += 1
-                    if not (line and (line.isspace() or \
-                                      _indentation(line) >= indent)):
-                        break
-
-                    add_help_line(_dedent_rstrip(line, indent))
-
-                node.help = "\n".join(help_lines).rstrip() + "\n"
-                self._saved_line = line  # "Unget" the line
+                if self._lazy_help:
+                    # Read by MenuNode.help when needed. See _load_help().
+                    node._help = (start, end, indent)
+                else:
+                    node._help = _help_text(self._lines[start:end], indent)
 
             elif t0 == _T_SELECT:
                 if not isinstance(node.item, Symbol):
@@ -1910,6 +3014,7 @@ class Kconfig(object):
 
                     env_var = self._expect_str_and_eol()
                     node.item.env_var = env_var
+                    self.env_vars.add(env_var)
 
                     if env_var not in os.environ:
                         self._warn("'option env=\"{0}\"' on symbol {1} has "
@@ -2002,7 +3107,7 @@ class Kconfig(object):
 
             # Set the prompt, with dependencies propagated
             if prompt:
-                node.prompt = (prompt[0],
+                node.prompt = (intern(prompt[0]),
                                self._make_and(self._make_and(prompt[1],
                                                              node.dep),
                                               visible_if_deps))
@@ -2027,8 +3132,8 @@ class Kconfig(object):
 
                 # Modify the dependencies of the selected symbol
                 # Warning: See _warn_select_unsatisfied_deps()
-                target.rev_dep = \
-                    self._make_or(target.rev_dep,
+                target._rev_dep = \
+                    self._make_or(target._rev_dep,
                                   self._make_and(node.item,
                                                  self._make_and(cond,
                                                                 node.dep)))
@@ -2040,8 +3145,8 @@ class Kconfig(object):
                     (target, self._make_and(cond, node.dep)))
 
                 # Modify the dependencies of the implied symbol
-                target.weak_rev_dep = \
-                    self._make_or(target.weak_rev_dep,
+                target._weak_rev_dep = \
+                    self._make_or(target._weak_rev_dep,
                                   self._make_and(node.item,
                                                  self._make_and(cond,
                                                                 node.dep)))
@@ -2086,7 +3191,7 @@ class Kconfig(object):
         # This turns A || B || C || D into (OR, A, (OR, B, (OR, C, D))).
         return and_expr \
                if not self._check_token(_T_OR) else \
-               (OR, and_expr, self._parse_expr(transform_m))
+               self._make_expr(OR, and_expr, self._parse_expr(transform_m))
 
     def _parse_and_expr(self, transform_m):
         factor = self._parse_factor(transform_m)
@@ -2096,7 +3201,8 @@ class Kconfig(object):
         # A && B && C && D into (AND, A, (AND, B, (AND, C, D))).
         return factor \
                if not self._check_token(_T_AND) else \
-               (AND, factor, self._parse_and_expr(transform_m))
+               self._make_expr(AND, factor,
+                               self._parse_and_expr(transform_m))
 
     def _parse_factor(self, transform_m):
         token = self._next_token()
@@ -2111,16 +3217,16 @@ class Kconfig(object):
                 # For conditional expressions ('depends on <expr>',
                 # '... if <expr>', etc.), m is rewritten to m && MODULES.
                 if transform_m and token is self.m:
-                    return (AND, self.m, self.modules)
+                    return self._make_expr(AND, self.m, self.modules)
 
                 return token
 
             # Relation
-            return (_TOKEN_TO_REL[self._next_token()], token,
-                    self._expect_sym())
+            return self._make_expr(_TOKEN_TO_REL[self._next_token()], token,
+                                   self._expect_sym())
 
         if token == _T_NOT:
-            return (NOT, self._parse_factor(transform_m))
+            return self._make_expr(NOT, self._parse_factor(transform_m))
 
         if token == _T_OPEN_PAREN:
             expr_parse = self._parse_expr(transform_m)
@@ -2144,6 +3250,8 @@ class Kconfig(object):
 
         The calculated sets might be larger than necessary as we don't do any
         complex analysis of the expressions.
+
+        The sets are turned into tuples at the end. See the comment there.
         """
         # Only calculate _dependents for defined symbols. Constant and
         # undefined symbols could theoretically be selected/implied, but it
@@ -2162,8 +3270,8 @@ class Kconfig(object):
                 _make_depend_on(sym, cond)
 
             # The reverse and weak reverse dependencies
-            _make_depend_on(sym, sym.rev_dep)
-            _make_depend_on(sym, sym.weak_rev_dep)
+            _make_depend_on(sym, sym._rev_dep)
+            _make_depend_on(sym, sym._weak_rev_dep)
 
             # The ranges along with their conditions
             for low, high, cond in sym.ranges:
@@ -2200,21 +3308,370 @@ class Kconfig(object):
             for sym in choice.syms:
                 sym._dependents.add(choice)
 
+        # _dependents is only iterated over from here on. A tuple takes up a
+        # fraction of the memory of a set (even an empty set is 216 bytes on
+        # 64-bit CPython 3, while the empty tuple is shared), and most symbols
+        # have few or no dependents. This cuts down on memory usage
+        # noticeably for large configurations, and makes invalidation
+        # slightly faster.
+        for item in chain(self.syms.values(), self.const_syms.values(),
+                          self._choices):
+            item._dependents = tuple(item._dependents)
+
     def _invalidate_all(self):
-        # Undefined symbols never change value and don't need to be
-        # invalidated, so we can just iterate over defined symbols.
-        # Invalidating constant symbols would break things horribly.
-        for sym in self.defined_syms:
-            sym._invalidate()
+        """
+        Invalidates all symbols and choices in constant time, by starting a
+        new generation. Cached values are only used if the _cache_gen of the
+        symbol or choice matches Kconfig._generation, and are thrown away
+        otherwise when they're next accessed (see Symbol._new_gen()).
 
-        for choice in self._choices:
-            choice._invalidate()
+        A symbol or choice from an earlier generation counts as having no
+        cached values, so the _cached_vis check in Symbol._rec_invalidate()
+        stays valid.
+        """
+        self._generation += 1
+        self._expr_memo_gen += 1
+
+    def _rec_invalidate(self, item):
+        """
+        Called when the user value of the symbol or choice 'item' changes.
+        Invalidates 'item' and all items that (possibly) depend on it, or
+        defers it to the end of the batch() block if there is one.
+        """
+        if self._deferred_invalidation is None:
+            self._expr_memo_gen += 1
+            item._rec_invalidate()
+        else:
+            self._deferred_invalidation.append(item)
+
+    def _rec_invalidate_items(self, items):
+        """
+        Merged version of Symbol/Choice._rec_invalidate() for all items in
+        'items', used at the end of batch() blocks. Each dependent item is
+        visited at most once, and we use an explicit stack instead of
+        recursion. See Symbol._rec_invalidate() for why it's safe to stop at
+        items with _cached_vis None.
+
+        Returns a list of the invalidated items (possibly with duplicates).
+        """
+        if self.modules in items or \
+           len(items) > len(self.defined_syms)//_INVALIDATE_ALL_RATIO:
+            # Invalidating MODULES has wide-ranging effects, and for large
+            # batches (e.g. from load_config()) the walk would reach most
+            # items anyway. Starting a new generation is cheaper.
+            self._invalidate_all()
+            return self.defined_syms + self._choices
+
+        self._expr_memo_gen += 1
+
+        for item in items:
+            item._invalidate()
+
+        res = items[:]
+        stack = items
+        generation = self._generation
+        while stack:
+            for item in stack.pop()._dependents:
+                if item._cached_vis is not None and \
+                   item._cache_gen == generation:
+                    if item is self.modules:
+                        self._invalidate_all()
+                        return self.defined_syms + self._choices
+
+                    item._invalidate()
+                    stack.append(item)
+                    res.append(item)
+
+        return res
+
+    def _fixpoint(self, items, adjust):
+        """
+        Helper for allyesconfig() and allnoconfig(). Equivalent to doing
+        passes over 'items' (symbols and choices, possibly with duplicates),
+        calling adjust(item, set_value) on each, until a pass changes no
+        values. 'adjust' must change values through the 'set_value' function
+        it is passed, which takes a symbol or choice and a value.
+
+        Instead of revisiting everything on each pass, we only revisit items
+        that were invalidated since they were last visited. Other items have
+        the same values and assignable values as before, so 'adjust' would do
+        nothing for them. Invalidated items get visited again later in the
+        current pass if they appear there, and in the next pass otherwise.
+        This gives the same result as plain passes.
+        """
+        # Maps each item to a list of its indices in 'items'
+        positions = {}
+        for i, item in enumerate(items):
+            if item in positions:
+                positions[item].append(i)
+            else:
+                positions[item] = [i]
+
+        # Items invalidated by the last adjust() call
+        invalidated = []
+
+        def set_value(sc, val):
+            # Like a batch() block around sc.set_value(val), but also records
+            # the invalidated items
+            self._deferred_invalidation = deferred = []
+            sc.set_value(val)
+            self._deferred_invalidation = None
+            invalidated.extend(self._rec_invalidate_items(deferred))
+
+        # Items to visit in the next pass
+        next_pass = set()
+
+        try:
+            # The first pass visits all items, so invalidated items only need
+            # to be remembered if they don't appear later in the pass
+            for i, item in enumerate(items):
+                adjust(item, set_value)
+
+                if invalidated:
+                    for item in invalidated:
+                        if item in positions and positions[item][-1] <= i:
+                            next_pass.add(item)
+                    del invalidated[:]
+
+            # Later passes only visit invalidated items, at their positions in
+            # 'items'. 'cur_pass' is a heap of indices to visit in the current
+            # pass, and 'queued' a set with the same indices.
+            while next_pass:
+                cur_pass = [positions[item][0] for item in next_pass]
+                heapq.heapify(cur_pass)
+                queued = set(cur_pass)
+                next_pass.clear()
+
+                while cur_pass:
+                    i = heapq.heappop(cur_pass)
+                    queued.remove(i)
+
+                    adjust(items[i], set_value)
+
+                    for item in invalidated:
+                        if item not in positions:
+                            # E.g. a choice symbol for allyesconfig()
+                            continue
+
+                        for j in positions[item]:
+                            if j > i:
+                                if j not in queued:
+                                    heapq.heappush(cur_pass, j)
+                                    queued.add(j)
+                                break
+                        else:
+                            next_pass.add(item)
+
+                    del invalidated[:]
+        finally:
+            self._deferred_invalidation = None
+
+
+    def _tri_values_fallback(self, configs, syms, col, res):
+        """
+        tri_values_many() helper. Calculates the values of the symbols in
+        'syms' for each configuration in 'configs' by assigning its values,
+        and stores them in 'res'. 'col' maps symbols to columns in 'res'.
+        """
+        saved_sym_vals = [(sym, sym.user_value) for sym in self.defined_syms]
+        saved_choice_vals = [(choice, choice.user_value,
+                              choice.user_selection)
+                             for choice in self._choices]
+
+        # No warnings are printed, like for vectorized symbols
+        print_warnings = self._print_warnings
+        self._print_warnings = False
+        try:
+            for i, config in enumerate(configs):
+                self.unset_values()
+
+                with self.batch():
+                    for sym, val in config.items():
+                        sym.set_value(val)
+
+                for sym in syms:
+                    res[i, col[sym]] = sym.tri_value
+
+        finally:
+            self._print_warnings = print_warnings
+
+            # Restore the user values directly. They were valid when they were
+            # set.
+            for sym, val in saved_sym_vals:
+                sym.user_value = val
+
+            for choice, val, selection in saved_choice_vals:
+                choice.user_value = val
+                choice.user_selection = selection
+
+            self._invalidate_all()
+
+    #
+    # Parse cache
+    #
+
+    def _cache_key(self, filename):
+        """
+        Returns a tuple with everything besides the Kconfig files and 'option
+        env' variables that a cache file depends on. See Kconfig.__init__().
+        """
+        return (_CACHE_VERSION,
+                tuple(sys.version_info[:2]),
+                Symbol.__slots__, Choice.__slots__, MenuNode.__slots__,
+                os.getcwd(),
+                filename,
+                self.srctree,
+                self._lazy_help,
+                platform.uname()[2])
+
+    def _load_cache(self, filename, cache_file):
+        """
+        Loads the parsed configuration from 'cache_file'. Returns True if
+        successful, and False if the cache file is missing or out of date (or
+        unusable for any other reason), in which case the Kconfig files should
+        be parsed.
+        """
+        # Loading creates lots of container objects, which makes the cyclic
+        # garbage collector kick in over and over (more than doubling the
+        # loading time). None of them are garbage, so turn it off meanwhile.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            with open(cache_file, "rb") as f:
+                unpickler = pickle.Unpickler(f)
+
+                if unpickler.load() != self._cache_key(filename):
+                    return False
+
+                file_stats, env = unpickler.load()
+
+                for path, stat in file_stats:
+                    if _file_stat(path) != stat:
+                        return False
+
+                for var, val in env.items():
+                    if os.environ.get(var) != val:
+                        return False
+
+                warnings = unpickler.load()
+                _load_tree(self, unpickler)
+
+        # Broad on purpose. A cache file that can't be loaded, for whatever
+        # reason, just means we need to parse the Kconfig files.
+        except Exception:
+            return False
+
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        self._parsing_kconfigs = False
+
+        for msg, warn_filename, linenr in warnings:
+            self._warn(msg, warn_filename, linenr)
+
+        return True
+
+    def _save_cache(self, filename, cache_file):
+        """
+        Writes the parsed configuration to 'cache_file'. The file is written to
+        a temporary file first and then renamed, so that an interrupted write
+        (or parallel Kconfig instances) never leaves a truncated cache file
+        behind.
+        """
+        try:
+            fd, tmp_filename = tempfile.mkstemp(
+                dir=os.path.dirname(cache_file) or os.curdir)
+
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+
+                    pickler.dump(self._cache_key(filename))
+                    pickler.dump((self._file_stats,
+                                  dict((var, os.environ.get(var))
+                                       for var in self.env_vars)))
+                    pickler.dump(self._warning_log)
+                    _save_tree(self, pickler)
+
+                _replace_file(tmp_filename, cache_file)
+
+            except:
+                os.remove(tmp_filename)
+                raise
+
+        except (IOError, OSError) as e:
+            self._warn("failed to write the cache file '{}': {}"
+                       .format(cache_file, e))
 
 
     #
     # Misc.
     #
 
+    def _init_settings(self, srctree, config_prefix, warn):
+        """
+        Sets up the Kconfig attributes that don't come from the Kconfig
+        files. Shared by __init__() and _load_kconfig(), which take
+        'srctree' and 'config_prefix' from different places ($srctree and
+        $CONFIG_ vs. the pickled state).
+        """
+        self.srctree = srctree
+
+        self.config_prefix = config_prefix
+        if self.config_prefix is None:
+            self.config_prefix = "CONFIG_"
+
+        # Regular expression for finding assignments in .config files, with
+        # the finditer() method assigned directly as a small optimization
+        # (microscopic in this case, but it's consistent with the other
+        # regexes). It's run on the entire file, with one match per
+        # assignment. Groups 1 and 2 are the name and value for
+        # CONFIG_FOO=val, and group 3 the name for '# CONFIG_FOO is not set'.
+        self._assignment_re_finditer = re.compile(
+            r"^(?:{0}([^=\n]+)=(.*)|# {0}([^ \n]+) is not set)"
+            .format(self.config_prefix),
+            _RE_ASCII | re.MULTILINE).finditer
+
+        self._print_warnings = warn
+        self._print_undef_assign = False
+        self._print_redun_assign = True
+
+        self._warning_log = None
+
+        # List of items to invalidate at the end of a batch() block, or None
+        # if not in one
+        self._deferred_invalidation = None
+
+        # Expressions created while parsing, for reusing identical
+        # expressions. See _make_expr().
+        self._exprs = {}
+
+        # Cached symbol and choice values are only valid if their _cache_gen
+        # matches this. See _invalidate_all().
+        self._generation = 0
+
+        # Memoized values of shared subexpressions, and the stamp that tells
+        # if they're valid. See _expr_value().
+        self._expr_memo = {}
+        self._expr_memo_gen = 0
+
+        # Symbols and choices in dependency order, calculated on the first
+        # call to evaluate_all()
+        self._eval_order = None
+
+        # (filename, lines) for the Kconfig file help texts were last read
+        # from with lazy_help=True. See _load_help().
+        self._help_file = None
+
+        # See tri_values_many()
+        self._vec_plan = None
+
+        # Maps symbols to the locations that reference them, calculated on the
+        # first access to Symbol.referenced_by
+        self._ref_index = None
+
     def _expand_syms(self, s):
         """
         Expands $-references to symbols in 's' to symbol values, or to the
@@ -2244,6 +3701,11 @@ class Kconfig(object):
         """
         For printing general warnings.
         """
+        if self._warning_log is not None:
+            # Saved so that the warning can be printed again when the
+            # configuration is loaded from a cache file
+            self._warning_log.append((msg, filename, linenr))
+
         if self._print_warnings:
             _stderr_msg("warning: " + msg, filename, linenr)
 
@@ -2424,6 +3886,12 @@ class Symbol(object):
       For example, if A has 'select FOO' and B has 'select FOO if C', then
       FOO's rev_dep will be (OR, A, (AND, B, C)).
 
+      Internally, the selects are stored in a single flat (OR, A, B, C, ...)
+      tuple, as a long (OR, (OR, (OR, A, B), C), ...) chain would be slow and
+      deeply recursive to evaluate for heavily selected symbols. rev_dep is
+      built from it on the first access and cached. Assigning rev_dep stores
+      the flattened form.
+
     weak_rev_dep:
       Like rev_dep, for imply.
 
@@ -2436,6 +3904,24 @@ class Symbol(object):
       parent dependencies are automatically propagated to the conditions of
       properties, so normally it's redundant to check the direct dependencies.
 
+    referenced_by:
+      Tuple of (node, kind) tuples for the menu nodes that reference the
+      symbol, in menu order. 'kind' says where the reference appears, and is
+      one of "prompt" (the prompt condition), "default", "select", "imply",
+      "range", "depends on", and "visible if". A node that references the
+      symbol in several places gets one tuple per kind.
+
+      The properties of a symbol or choice are stored on the item rather than
+      on its menu nodes, so references from them show up for each menu node
+      of the item. Note that 'depends on' and parent dependencies are
+      propagated to prompt and property conditions, so a symbol referenced in
+      a 'depends on' usually also shows up with other kinds.
+
+      The first access builds an index for all symbols in a single pass over
+      the menu tree, so later lookups only take time proportional to the
+      number of references. Constant symbols (including n, m, and y) are not
+      indexed and get an empty tuple.
+
     env_var:
       If the Symbol has an 'option env="FOO"' option, this contains the name
       ("FOO") of the environment variable. None for symbols that aren't set
@@ -2463,12 +3949,19 @@ class Symbol(object):
       The Kconfig instance this symbol is from.
     """
     __slots__ = (
+        "_cache_gen",
         "_cached_assignable",
         "_cached_str_val",
         "_cached_tri_val",
         "_cached_vis",
+        "_compiled_tri",
+        "_compiled_vis",
         "_dependents",
+        "_rev_dep",
+        "_rev_dep_cache",
         "_was_set",
+        "_weak_rev_dep",
+        "_weak_rev_dep_cache",
         "_write_to_conf",
         "_written",
         "choice",
@@ -2483,10 +3976,8 @@ class Symbol(object):
         "nodes",
         "orig_type",
         "ranges",
-        "rev_dep",
         "selects",
         "user_value",
-        "weak_rev_dep",
     )
 
     #
@@ -2510,6 +4001,9 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_str_val is not None:
             return self._cached_str_val
 
@@ -2542,7 +4036,7 @@ class Symbol(object):
 
             # Check if a range is in effect
             for low_expr, high_expr, cond in self.ranges:
-                if expr_value(cond):
+                if _expr_value(cond, self.kconfig):
                     has_active_range = True
 
                     # The zeros are from the C implementation running strtoll()
@@ -2570,7 +4064,7 @@ class Symbol(object):
                 # No user value or invalid user value. Look at defaults.
 
                 for val_expr, cond in self.defaults:
-                    if expr_value(cond):
+                    if _expr_value(cond, self.kconfig):
                         self._write_to_conf = True
 
                         val = val_expr.str_value
@@ -2606,7 +4100,7 @@ class Symbol(object):
             else:
                 # Otherwise, look at defaults
                 for val_expr, cond in self.defaults:
-                    if expr_value(cond):
+                    if _expr_value(cond, self.kconfig):
                         val = val_expr.str_value
                         self._write_to_conf = True
                         break
@@ -2623,9 +4117,17 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_tri_val is not None:
             return self._cached_tri_val
 
+        if self._compiled_tri is not None:
+            # See Kconfig.compile()
+            self._cached_tri_val = self._compiled_tri()
+            return self._cached_tri_val
+
         if self.orig_type not in (BOOL, TRISTATE):
             self._cached_tri_val = 0
             return 0
@@ -2636,6 +4138,8 @@ class Symbol(object):
         vis = self.visibility
         self._write_to_conf = (vis != 0)
 
+        kconfig = self.kconfig
+
         if not self.choice:
             # Non-choice symbol
 
@@ -2648,32 +4152,33 @@ class Symbol(object):
                 # (implies)
 
                 for default, cond in self.defaults:
-                    cond_val = expr_value(cond)
+                    cond_val = _expr_value(cond, kconfig)
                     if cond_val:
-                        val = min(expr_value(default), cond_val)
+                        val = min(_expr_value(default, kconfig), cond_val)
                         self._write_to_conf = True
                         break
 
                 # Weak reverse dependencies are only considered if our
                 # direct dependencies are met
-                weak_rev_dep_val = expr_value(self.weak_rev_dep)
-                if weak_rev_dep_val and expr_value(self.direct_dep):
+                weak_rev_dep_val = _expr_value(self._weak_rev_dep, kconfig)
+                if weak_rev_dep_val and _expr_value(self.direct_dep, kconfig):
                     val = max(weak_rev_dep_val, val)
                     self._write_to_conf = True
 
             # Reverse (select-related) dependencies take precedence
-            rev_dep_val = expr_value(self.rev_dep)
+            rev_dep_val = _expr_value(self._rev_dep, kconfig)
             if rev_dep_val:
                 val = max(rev_dep_val, val)
                 self._write_to_conf = True
 
-                if not expr_value(self.direct_dep):
+                if not _expr_value(self.direct_dep, kconfig):
                     self._warn_select_unsatisfied_deps()
 
             # m is promoted to y for (1) bool symbols and (2) symbols with a
             # weak_rev_dep (from imply) of y
             if val == 1 and \
-               (self.type == BOOL or expr_value(self.weak_rev_dep) == 2):
+               (self.type == BOOL or
+                _expr_value(self._weak_rev_dep, kconfig) == 2):
                 val = 2
 
         elif vis == 2:
@@ -2689,11 +4194,64 @@ class Symbol(object):
         self._cached_tri_val = val
         return val
 
+    @property
+    def rev_dep(self):
+        """
+        See the class documentation.
+        """
+        # The cache records which flattened expression it was built from, as
+        # _rev_dep is also assigned directly during parsing
+        cache = self._rev_dep_cache
+        if cache is None or cache[0] is not self._rev_dep:
+            cache = self._rev_dep_cache = \
+                (self._rev_dep, _unflatten_or(self._rev_dep))
+        return cache[1]
+
+    @rev_dep.setter
+    def rev_dep(self, expr):
+        self._rev_dep = _flatten_or(expr)
+        self._rev_dep_cache = (self._rev_dep, expr)
+        # Compiled closures evaluate the old expression. See
+        # Kconfig.compile().
+        self._compiled_tri = self._compiled_vis = None
+
+    @property
+    def weak_rev_dep(self):
+        """
+        See the class documentation.
+        """
+        cache = self._weak_rev_dep_cache
+        if cache is None or cache[0] is not self._weak_rev_dep:
+            cache = self._weak_rev_dep_cache = \
+                (self._weak_rev_dep, _unflatten_or(self._weak_rev_dep))
+        return cache[1]
+
+    @weak_rev_dep.setter
+    def weak_rev_dep(self, expr):
+        self._weak_rev_dep = _flatten_or(expr)
+        self._weak_rev_dep_cache = (self._weak_rev_dep, expr)
+        # Compiled closures evaluate the old expression. See
+        # Kconfig.compile().
+        self._compiled_tri = self._compiled_vis = None
+
+    @property
+    def referenced_by(self):
+        """
+        See the class documentation.
+        """
+        if self.kconfig._ref_index is None:
+            self.kconfig._ref_index = _ref_index(self.kconfig)
+
+        return self.kconfig._ref_index.get(self, ())
+
     @property
     def assignable(self):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_assignable is None:
             self._cached_assignable = self._get_assignable()
 
@@ -2704,8 +4262,13 @@ class Symbol(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_vis is None:
-            self._cached_vis = _get_visibility(self)
+            self._cached_vis = _get_visibility(self) \
+                               if self._compiled_vis is None else \
+                               self._compiled_vis()
 
         return self._cached_vis
 
@@ -2824,7 +4387,7 @@ class Symbol(object):
             # dependencies come into play.
             self.choice.user_selection = self
             self.choice._was_set = True
-            self.choice._rec_invalidate()
+            self.kconfig._rec_invalidate(self.choice)
         else:
             self._was_set = True
             self._rec_invalidate_if_has_prompt()
@@ -2929,13 +4492,13 @@ class Symbol(object):
         """
         # These attributes are always set on the instance from outside and
         # don't need defaults:
+        #   _rev_dep
+        #   _weak_rev_dep
         #   _written
         #   kconfig
         #   direct_dep
         #   is_constant
         #   name
-        #   rev_dep
-        #   weak_rev_dep
 
         self.orig_type = UNKNOWN
         self.defaults = []
@@ -2951,6 +4514,15 @@ class Symbol(object):
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
         self._cached_assignable = None
 
+        # See the rev_dep and weak_rev_dep properties
+        self._rev_dep_cache = self._weak_rev_dep_cache = None
+
+        # See Kconfig._invalidate_all()
+        self._cache_gen = 0
+
+        # See Kconfig.compile()
+        self._compiled_tri = self._compiled_vis = None
+
         # _write_to_conf is calculated along with the value. If True, the
         # Symbol gets a .config entry.
 
@@ -2975,14 +4547,14 @@ class Symbol(object):
         if not vis:
             return ()
 
-        rev_dep_val = expr_value(self.rev_dep)
+        rev_dep_val = expr_value(self._rev_dep)
 
         if vis == 2:
             if self.choice:
                 return (2,)
 
             if not rev_dep_val:
-                if self.type == BOOL or expr_value(self.weak_rev_dep) == 2:
+                if self.type == BOOL or expr_value(self._weak_rev_dep) == 2:
                     return (0, 2)
                 return (0, 1, 2)
 
@@ -2991,7 +4563,7 @@ class Symbol(object):
 
             # rev_dep_val == 1
 
-            if self.type == BOOL or expr_value(self.weak_rev_dep) == 2:
+            if self.type == BOOL or expr_value(self._weak_rev_dep) == 2:
                 return (2,)
             return (1, 2)
 
@@ -3000,7 +4572,7 @@ class Symbol(object):
         # Must be a tristate here, because bool m visibility gets promoted to y
 
         if not rev_dep_val:
-            return (0, 1) if expr_value(self.weak_rev_dep) != 2 else (0, 2)
+            return (0, 1) if expr_value(self._weak_rev_dep) != 2 else (0, 2)
 
         if rev_dep_val == 2:
             return (2,)
@@ -3009,13 +4581,66 @@ class Symbol(object):
 
         return (1,)
 
-    def _invalidate(self):
+    def _str_default(self):
+        """
+        write_min_config() helper. Returns the value the symbol would get if
+        it had no user value, calculated from the current values of other
+        symbols. Corresponds to sym_get_string_default() in the C
+        implementation.
+        """
+        if self.orig_type in (BOOL, TRISTATE):
+            val = 0
+
+            # Defaults, selects, and implies do not affect choice symbols
+            if not self.choice:
+                for default, cond in self.defaults:
+                    cond_val = expr_value(cond)
+                    if cond_val:
+                        val = min(expr_value(default), cond_val)
+                        break
+
+                # Same logic as in tri_value
+                weak_rev_dep_val = expr_value(self._weak_rev_dep)
+                if weak_rev_dep_val and expr_value(self.direct_dep):
+                    val = max(weak_rev_dep_val, val)
+
+                val = max(expr_value(self._rev_dep), val)
+
+                if val == 1 and \
+                   (self.type == BOOL or weak_rev_dep_val == 2):
+                    val = 2
+
+            return TRI_TO_STR[val]
+
+        if self.orig_type in (STRING, INT, HEX):
+            # The C implementation doesn't clamp the default to the active
+            # range here, so a clamped value is always written out
+            for default, cond in self.defaults:
+                if expr_value(cond):
+                    return default.str_value
+
+        return ""
+
+    def _invalidate(self):
         """
         Marks the symbol as needing to be recalculated.
         """
         self._cached_str_val = self._cached_tri_val = self._cached_vis = \
             self._cached_assignable = None
 
+    def _new_gen(self):
+        """
+        Called when the symbol is accessed for the first time in a new
+        generation (see Kconfig._invalidate_all()). Throws away the cached
+        values, which are from an earlier generation.
+        """
+        self._cache_gen = self.kconfig._generation
+
+        # Invalidating constant symbols would break things horribly. Their
+        # values never change.
+        if not self.is_constant:
+            self._invalidate()
+
     def _rec_invalidate(self):
         """
         Invalidates the symbol and all items that (possibly) depend on it.
@@ -3026,6 +4651,7 @@ class Symbol(object):
         else:
             self._invalidate()
 
+            generation = self.kconfig._generation
             for item in self._dependents:
                 # _cached_vis doubles as a flag that tells us whether 'item'
                 # has cached values, because it's calculated as a side effect
@@ -3045,7 +4671,11 @@ class Symbol(object):
                 # This gracefully handles dependency loops too, which is nice
                 # for choices, where the choice depends on the choice symbols
                 # and vice versa.
-                if item._cached_vis is not None:
+                #
+                # Items from an earlier generation have no valid cached values
+                # either (see Kconfig._invalidate_all()).
+                if item._cached_vis is not None and \
+                   item._cache_gen == generation:
                     item._rec_invalidate()
 
     def _rec_invalidate_if_has_prompt(self):
@@ -3064,7 +4694,7 @@ class Symbol(object):
         """
         for node in self.nodes:
             if node.prompt:
-                self._rec_invalidate()
+                self.kconfig._rec_invalidate(self)
                 return
 
         if self.kconfig._warn_no_prompt:
@@ -3113,22 +4743,19 @@ class Symbol(object):
 
             return msg
 
-        expr = self.rev_dep
-        while 1:
-            # This relies on us using the following format for the select
-            # expression (which is nice in that it preserves the order of the
-            # selecting symbols):
-            #
-            #   (OR, (OR, (OR, <expr 1>, <expr 2>), <expr 3>), <expr 4>)
-            #
-            # We could do fancier expression processing later if needed.
-            if isinstance(expr, tuple) and expr[0] == OR:
-                warn_msg += check_select(expr[2])
-                # Go to the next select
-                expr = expr[1]
-            else:
-                warn_msg += check_select(expr)
-                break
+        # This relies on the selects being stored in the following flattened
+        # format (see _flatten_or()), which preserves the order of the
+        # selecting symbols:
+        #
+        #   (OR, <expr 1>, <expr 2>, <expr 3>, <expr 4>)
+        #
+        # The selects are listed last-to-first, as they always have been.
+        expr = self._rev_dep
+        if isinstance(expr, tuple) and expr[0] == OR:
+            for select in reversed(expr[1:]):
+                warn_msg += check_select(select)
+        else:
+            warn_msg += check_select(expr)
 
         self.kconfig._warn(warn_msg)
 
@@ -3266,9 +4893,11 @@ class Choice(object):
       The Kconfig instance this choice is from.
     """
     __slots__ = (
+        "_cache_gen",
         "_cached_assignable",
         "_cached_selection",
         "_cached_vis",
+        "_compiled_vis",
         "_dependents",
         "_was_set",
         "defaults",
@@ -3329,6 +4958,9 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_assignable is None:
             self._cached_assignable = self._get_assignable()
 
@@ -3339,8 +4971,13 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_vis is None:
-            self._cached_vis = _get_visibility(self)
+            self._cached_vis = _get_visibility(self) \
+                               if self._compiled_vis is None else \
+                               self._compiled_vis()
 
         return self._cached_vis
 
@@ -3349,6 +4986,9 @@ class Choice(object):
         """
         See the class documentation.
         """
+        if self._cache_gen != self.kconfig._generation:
+            self._new_gen()
+
         if self._cached_selection is _NO_CACHED_SELECTION:
             self._cached_selection = self._get_selection()
 
@@ -3392,7 +5032,7 @@ class Choice(object):
 
         self.user_value = value
         self._was_set = True
-        self._rec_invalidate()
+        self.kconfig._rec_invalidate(self)
 
         return True
 
@@ -3403,7 +5043,7 @@ class Choice(object):
         """
         if self.user_value is not None or self.user_selection:
             self.user_value = self.user_selection = None
-            self._rec_invalidate()
+            self.kconfig._rec_invalidate(self)
 
     def __repr__(self):
         """
@@ -3481,6 +5121,12 @@ class Choice(object):
         self.user_value = self.user_selection = \
         self._cached_vis = self._cached_assignable = None
 
+        # See Kconfig._invalidate_all()
+        self._cache_gen = 0
+
+        # See Kconfig.compile()
+        self._compiled_vis = None
+
         self._cached_selection = _NO_CACHED_SELECTION
 
         # is_constant is checked by _make_depend_on(). Just set it to avoid
@@ -3524,10 +5170,19 @@ class Choice(object):
         if self.user_selection and self.user_selection.visibility:
             return self.user_selection
 
-        # Otherwise, check if we have a default
+        # Otherwise, use the selection from the defaults
+        return self._get_selection_from_defaults()
+
+    def _get_selection_from_defaults(self):
+        """
+        Returns the symbol that would be selected if the choice had no user
+        selection, or None if there is no visible choice symbol. Also used by
+        write_min_config().
+        """
+        # Check if we have a default
         for sym, cond in self.defaults:
             # The default symbol must be visible too
-            if expr_value(cond) and sym.visibility:
+            if _expr_value(cond, self.kconfig) and sym.visibility:
                 return sym
 
         # Otherwise, pick the first visible symbol, if any
@@ -3542,14 +5197,23 @@ class Choice(object):
         self._cached_vis = self._cached_assignable = None
         self._cached_selection = _NO_CACHED_SELECTION
 
+    def _new_gen(self):
+        """
+        See Symbol._new_gen()
+        """
+        self._cache_gen = self.kconfig._generation
+        self._invalidate()
+
     def _rec_invalidate(self):
         """
         See Symbol._rec_invalidate()
         """
         self._invalidate()
 
+        generation = self.kconfig._generation
         for item in self._dependents:
-            if item._cached_vis is not None:
+            if item._cached_vis is not None and \
+               item._cache_gen == generation:
                 item._rec_invalidate()
 
 class MenuNode(object):
@@ -3603,6 +5267,10 @@ class MenuNode(object):
       It is possible to have a separate help text at each location if a symbol
       is defined in multiple locations.
 
+      If the configuration was parsed with lazy_help=True (see
+      Kconfig.__init__()), the help text is read from the Kconfig file the
+      first time it is accessed.
+
     dep:
       The 'depends on' dependencies for the menu node, or self.kconfig.y if
       there are no dependencies. Parent dependencies are propagated to this
@@ -3633,9 +5301,9 @@ class MenuNode(object):
       The Kconfig instance the menu node is from.
     """
     __slots__ = (
+        "_help",
         "dep",
         "filename",
-        "help",
         "is_menuconfig",
         "item",
         "kconfig",
@@ -3647,6 +5315,23 @@ class MenuNode(object):
         "visibility",
     )
 
+    @property
+    def help(self):
+        """
+        See the class documentation.
+        """
+        help = self._help
+        if help.__class__ is tuple:
+            # (start, end, indent) reference into the Kconfig file, from
+            # parsing with lazy_help=True
+            help = self._help = self.kconfig._load_help(self.filename, *help)
+
+        return help
+
+    @help.setter
+    def help(self, help):
+        self._help = help
+
     def __repr__(self):
         """
         Returns a string with information about the menu node when it is
@@ -3761,51 +5446,13 @@ def expr_value(expr):
     if not isinstance(expr, tuple):
         return expr.tri_value
 
-    if expr[0] == AND:
-        v1 = expr_value(expr[1])
-        # Short-circuit the n case as an optimization (~5% faster
-        # allnoconfig.py and allyesconfig.py, as of writing)
-        return 0 if not v1 else min(v1, expr_value(expr[2]))
+    # Any symbol in the expression leads to the Kconfig instance, which holds
+    # the memo for shared subexpressions
+    sym = expr
+    while isinstance(sym, tuple):
+        sym = sym[1]
 
-    if expr[0] == OR:
-        v1 = expr_value(expr[1])
-        # Short-circuit the y case as an optimization
-        return 2 if v1 == 2 else max(v1, expr_value(expr[2]))
-
-    if expr[0] == NOT:
-        return 2 - expr_value(expr[1])
-
-    if expr[0] in _RELATIONS:
-        # Implements <, <=, >, >= comparisons as well. These were added to
-        # kconfig in 31847b67 (kconfig: allow use of relations other than
-        # (in)equality).
-
-        oper, op1, op2 = expr
-
-        # If both operands are strings...
-        if op1.orig_type == STRING and op2.orig_type == STRING:
-            # ...then compare them lexicographically
-            comp = _strcmp(op1.str_value, op2.str_value)
-        else:
-            # Otherwise, try to compare them as numbers
-            try:
-                comp = _sym_to_num(op1) - _sym_to_num(op2)
-            except ValueError:
-                # Fall back on a lexicographic comparison if the operands don't
-                # parse as numbers
-                comp = _strcmp(op1.str_value, op2.str_value)
-
-        if   oper == EQUAL:         res = comp == 0
-        elif oper == UNEQUAL:       res = comp != 0
-        elif oper == LESS:          res = comp < 0
-        elif oper == LESS_EQUAL:    res = comp <= 0
-        elif oper == GREATER:       res = comp > 0
-        elif oper == GREATER_EQUAL: res = comp >= 0
-
-        return 2*res
-
-    _internal_error("Internal error while evaluating expression: "
-                    "unknown operation {}.".format(expr[0]))
+    return _expr_value(expr, sym.kconfig)
 
 def expr_str(expr):
     """
@@ -3837,7 +5484,9 @@ def expr_str(expr):
                                  _format_and_op(expr[2]))
 
     if expr[0] == OR:
-        return "{} || {}".format(expr_str(expr[1]), expr_str(expr[2]))
+        # Also handles the flattened n-ary ORs used internally for selects and
+        # implies
+        return " || ".join(map(expr_str, expr[1:]))
 
     # Relation
     return "{} {} {}".format(expr_str(expr[1]),
@@ -3863,10 +5512,183 @@ def unescape(s):
     """
     return _unescape_re_sub(r"\1", s)
 
+def parse_many(configs, processes=None, summarize=None, warn=True):
+    """
+    Parses several configurations in parallel in a pool of worker processes,
+    and returns a list with the results, in the same order as 'configs'.
+    Handy when parsing the kernel Kconfig files for many architectures.
+
+    Each configuration is parsed with its own environment in the worker
+    process. os.environ in the calling process is not modified.
+
+    configs:
+      Iterable of (filename, env) tuples. 'filename' is passed to Kconfig(),
+      and 'env' is a dictionary with environment variables to set while
+      parsing, on top of the ones in os.environ. A value of None removes the
+      variable. $srctree and $CONFIG_ are set this way as well. Example:
+
+        [("Kconfig", {"ARCH": "x86_64", "SRCARCH": "x86"}),
+         ("Kconfig", {"ARCH": "arm", "SRCARCH": "arm"})]
+
+    processes (default: None):
+      The number of worker processes. If None, the number of CPUs is used.
+
+    summarize (default: None):
+      If None, Kconfig instances are returned. They are pickled in the worker
+      processes and unpickled in the calling process (see the Kconfig class
+      documentation), which is several times faster than parsing.
+
+      Otherwise, 'summarize' is called with each Kconfig instance in the
+      worker process, and its return value is returned instead of the
+      instance. This avoids transferring the entire configuration when only
+      some information is needed. Both 'summarize' and its return value must
+      be picklable, which means 'summarize' needs to be a module-level
+      function (or e.g. a functools.partial() of one).
+
+    warn (default: True):
+      Passed to Kconfig(). Warnings are printed by the worker processes.
+    """
+    # Only imported when needed, as it's slow to import compared to the rest
+    # of Kconfiglib
+    import multiprocessing
+
+    tasks = [(filename, dict(os.environ), env, summarize, warn)
+             for filename, env in configs]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        # chunksize=1 to spread out configurations that are slow to parse
+        results = pool.map(_parse_many_worker, tasks, 1)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    return results
+
 #
 # Internal functions
 #
 
+def _expr_value(expr, kconfig):
+    """
+    Implementation of expr_value(), for the expression 'expr' from 'kconfig'.
+    Called directly with the Kconfig instance when it's known, to skip the
+    lookup in expr_value().
+
+    Subexpressions that appear in more than one place in the configuration
+    (e.g. 'depends on' conditions from menus, which get propagated to the
+    properties of all symbols in the menu) are shared objects (see
+    Kconfig._make_expr()), and their values are memoized in
+    Kconfig._expr_memo. A memoized value is valid while its stamp matches
+    Kconfig._expr_memo_gen, which changes whenever symbol values are
+    invalidated.
+    """
+    if not isinstance(expr, tuple):
+        return expr.tri_value
+
+    memo_entry = kconfig._expr_memo.get(id(expr))
+    if memo_entry is not None and memo_entry[1] == kconfig._expr_memo_gen:
+        return memo_entry[2]
+
+    if expr[0] == AND:
+        val = _expr_value(expr[1], kconfig)
+        # Short-circuit the n case as an optimization (~5% faster
+        # allnoconfig.py and allyesconfig.py, as of writing)
+        if val:
+            val = min(val, _expr_value(expr[2], kconfig))
+
+    elif expr[0] == OR:
+        val = _expr_value(expr[1], kconfig)
+        # Short-circuit the y case as an optimization. Iterate instead of
+        # recursing for flattened n-ary ORs, from Symbol._rev_dep/
+        # _weak_rev_dep.
+        for i in range(2, len(expr)):
+            if val == 2:
+                break
+            val = max(val, _expr_value(expr[i], kconfig))
+
+    elif expr[0] == NOT:
+        val = 2 - _expr_value(expr[1], kconfig)
+
+    elif expr[0] in _RELATIONS:
+        # Implements <, <=, >, >= comparisons as well. These were added to
+        # kconfig in 31847b67 (kconfig: allow use of relations other than
+        # (in)equality).
+
+        oper, op1, op2 = expr
+
+        # If both operands are strings...
+        if op1.orig_type == STRING and op2.orig_type == STRING:
+            # ...then compare them lexicographically
+            comp = _strcmp(op1.str_value, op2.str_value)
+        else:
+            # Otherwise, try to compare them as numbers
+            try:
+                comp = _sym_to_num(op1) - _sym_to_num(op2)
+            except ValueError:
+                # Fall back on a lexicographic comparison if the operands don't
+                # parse as numbers
+                comp = _strcmp(op1.str_value, op2.str_value)
+
+        if   oper == EQUAL:         res = comp == 0
+        elif oper == UNEQUAL:       res = comp != 0
+        elif oper == LESS:          res = comp < 0
+        elif oper == LESS_EQUAL:    res = comp <= 0
+        elif oper == GREATER:       res = comp > 0
+        elif oper == GREATER_EQUAL: res = comp >= 0
+
+        val = 2*res
+
+    else:
+        _internal_error("Internal error while evaluating expression: "
+                        "unknown operation {}.".format(expr[0]))
+
+    if memo_entry is not None:
+        memo_entry[1] = kconfig._expr_memo_gen
+        memo_entry[2] = val
+
+    return val
+
+def _expr_memo(kconfig):
+    """
+    Returns a new Kconfig._expr_memo for 'kconfig' (see _expr_value()). It
+    maps the id() of each expression that appears more than once in the
+    properties of symbols and choices to an [expr, stamp, value] list, with
+    no valid value yet. Holding on to 'expr' keeps the id() from being
+    reused.
+    """
+    exprs = []
+    for sym in kconfig.defined_syms:
+        exprs.extend(_vec_exprs(sym))
+        for _, _, cond in sym.ranges:
+            exprs.append(cond)
+
+    for choice in kconfig._choices:
+        for node in choice.nodes:
+            if node.prompt:
+                exprs.append(node.prompt[1])
+        for _, cond in choice.defaults:
+            exprs.append(cond)
+
+    # Maps expression id()s to [expr, number of references] lists. Shared
+    # expressions are only descended into once.
+    refs = {}
+    while exprs:
+        expr = exprs.pop()
+        if isinstance(expr, tuple):
+            ref = refs.get(id(expr))
+            if ref is None:
+                refs[id(expr)] = [expr, 1]
+                exprs.extend(expr[1:])
+            else:
+                ref[1] += 1
+
+    return {id_: [expr, -1, 0] for id_, (expr, n) in refs.items() if n > 1}
+
 def _get_visibility(sc):
     """
     Symbols and Choices have a "visibility" that acts as an upper bound on the
@@ -3878,7 +5700,7 @@ def _get_visibility(sc):
 
     for node in sc.nodes:
         if node.prompt:
-            vis = max(vis, expr_value(node.prompt[1]))
+            vis = max(vis, _expr_value(node.prompt[1], sc.kconfig))
 
     if isinstance(sc, Symbol) and sc.choice:
         if sc.choice.orig_type == TRISTATE and sc.orig_type != TRISTATE and \
@@ -3906,10 +5728,15 @@ def _make_depend_on(sym, expr):
         if not expr.is_constant:
             expr._dependents.add(sym)
 
-    elif expr[0] in (AND, OR):
+    elif expr[0] == AND:
         _make_depend_on(sym, expr[1])
         _make_depend_on(sym, expr[2])
 
+    elif expr[0] == OR:
+        # Can be a flattened n-ary OR
+        for i in range(1, len(expr)):
+            _make_depend_on(sym, expr[i])
+
     elif expr[0] == NOT:
         _make_depend_on(sym, expr[1])
 
@@ -3932,6 +5759,36 @@ def _format_and_op(expr):
         return "({})".format(expr_str(expr))
     return expr_str(expr)
 
+def _flatten_or(expr):
+    """
+    Turns the left-deep (OR, (OR, (OR, A, B), C), D) chain that
+    _parse_properties() builds for selects and implies into a flat
+    (OR, A, B, C, D) tuple, without recursing. The order is preserved.
+    """
+    operands = []
+    while isinstance(expr, tuple) and expr[0] == OR:
+        operands.append(expr[2])
+        expr = expr[1]
+
+    if not operands:
+        return expr
+
+    operands.append(expr)
+    operands.reverse()
+    return (OR,) + tuple(operands)
+
+def _unflatten_or(expr):
+    """
+    Inverse of _flatten_or(). Builds the public two-operand format.
+    """
+    if not (isinstance(expr, tuple) and expr[0] == OR):
+        return expr
+
+    res = expr[1]
+    for i in range(2, len(expr)):
+        res = (OR, res, expr[i])
+    return res
+
 def _indentation(line):
     """
     Returns the length of the line's leading whitespace, treating tab stops as
@@ -3953,6 +5810,59 @@ def _dedent_rstrip(line, indent):
     """
     return line.expandtabs()[indent:].rstrip()
 
+def _help_lines(lines, linenr):
+    """
+    Finds the help text that follows a 'help' line. 'lines' are the lines of
+    the Kconfig file, and 'linenr' the index of the line after the 'help'
+    line.
+
+    Returns a (start, end, indent) tuple, where lines[start:end] are the lines
+    of the help text and 'indent' is its indentation. 'end' is the index of
+    the line that ended the help text, and equals 'start' if the help text is
+    empty.
+    """
+    n_lines = len(lines)
+
+    # Find first non-blank (not all-space) line and get its indentation
+
+    while linenr < n_lines and lines[linenr].isspace():
+        linenr += 1
+
+    if linenr == n_lines:
+        return (linenr, linenr, 0)
+
+    line = lines[linenr]
+    indent = _indentation(line)
+    if indent == 0:
+        # If the first non-empty lines has zero indent, there is no help text
+        return (linenr, linenr, 0)
+
+    start = linenr
+    linenr += 1
+
+    # The help text goes on till the first non-empty line with less indent.
+    # Lines that start with the same whitespace as the first line are part of
+    # it, which saves an _indentation() call for most lines.
+
+    prefix = line[:len(line) - len(line.lstrip())]
+    while linenr < n_lines:
+        line = lines[linenr]
+        if not (line.startswith(prefix) or line.isspace() or
+                _indentation(line) >= indent):
+            break
+
+        linenr += 1
+
+    return (start, linenr, indent)
+
+def _help_text(lines, indent):
+    """
+    Returns the help text for the help text lines 'lines' (the first one
+    non-blank), de-indented by 'indent' spaces.
+    """
+    return intern("\n".join([_dedent_rstrip(line, indent)
+                             for line in lines]).rstrip() + "\n")
+
 def _is_base_n(s, n):
     try:
         int(s, n)
@@ -4396,6 +6306,1109 @@ def _check_choice_sanity(choice):
                                      "prompt outside the choice"
                                      .format(_name_and_loc_str(sym)))
 
+
+# Expression compilation. See Kconfig.compile().
+
+def _compile_expr(expr, memo):
+    """
+    Compiles the expression 'expr' into a function that takes no arguments and
+    returns expr_value(expr).
+
+    'memo' maps the id()s of already compiled expressions to their
+    _compile_expr_rec() results. Identical subexpressions are shared (see
+    Kconfig._make_expr()), so this makes each of them compile into a single
+    function. It's shared between all calls in Kconfig.compile().
+    """
+    return _compile_expr_rec(expr, memo)[0]
+
+def _compile_expr_rec(expr, memo):
+    """
+    _compile_expr() helper. Returns a (function, value) tuple, where 'value'
+    is the value of 'expr' if it's constant, and None otherwise.
+
+    Operands are evaluated under the same conditions as in expr_value(), even
+    when some other operand is constant. Evaluating symbols has side effects
+    (caching and warnings), so this keeps things identical.
+    """
+    if not isinstance(expr, tuple):
+        if expr.is_constant:
+            # The value of constant symbols never changes
+            val = expr.tri_value
+            return (lambda: val), val
+
+        if isinstance(expr, Choice):
+            return (lambda: expr.tri_value), None
+
+        sym = expr
+        kconfig = sym.kconfig
+
+        def sym_value():
+            # Avoids the Symbol.tri_value property call when the value is
+            # cached, which is the common case. The cached value is stale if
+            # it's from an earlier generation (see Kconfig._invalidate_all()).
+            val = sym._cached_tri_val
+            if val is None or sym._cache_gen != kconfig._generation:
+                return sym.tri_value
+            return val
+
+        return sym_value, None
+
+    res = memo.get(id(expr))
+    if res is None:
+        res = memo[id(expr)] = _compile_op(expr, memo)
+    return res
+
+def _compile_op(expr, memo):
+    """
+    _compile_expr_rec() helper for expressions that aren't plain symbols or
+    choices.
+    """
+    if expr[0] == OR and len(expr) > 3:
+        # Flattened n-ary OR, from Symbol._rev_dep/_weak_rev_dep. Loop instead
+        # of nesting closures, which could get very deep.
+        fns = [_compile_expr_rec(operand, memo)[0] for operand in expr[1:]]
+
+        def or_n():
+            val = 0
+            for fn in fns:
+                v = fn()
+                if v > val:
+                    if v == 2:
+                        return 2
+                    val = v
+            return val
+
+        return or_n, None
+
+    if expr[0] in (AND, OR):
+        f1, c1 = _compile_expr_rec(expr[1], memo)
+        f2, c2 = _compile_expr_rec(expr[2], memo)
+
+        if expr[0] == AND:
+            return _compile_and(expr[1], f1, c1, expr[2], f2, c2)
+        return _compile_or(expr[1], f1, c1, expr[2], f2, c2)
+
+    if expr[0] == NOT:
+        f, c = _compile_expr_rec(expr[1], memo)
+        if c is not None:
+            return (lambda: 2 - c), 2 - c
+
+        return (lambda: 2 - f()), None
+
+    if expr[0] in _RELATIONS:
+        if expr[1].is_constant and expr[2].is_constant:
+            val = expr_value(expr)
+            return (lambda: val), val
+
+        # Relations are rare. Just use the interpreter.
+        return (lambda: expr_value(expr)), None
+
+    _internal_error("Internal error while compiling expression: "
+                    "unknown operation {}.".format(expr[0]))
+
+def _compile_and(e1, f1, c1, e2, f2, c2):
+    """
+    _compile_expr_rec() helper for AND. 'e1' and 'e2' are the operands, 'f1'
+    and 'f2' their compiled functions, and 'c1' and 'c2' their constant values
+    (or None).
+    """
+    if c1 is not None:
+        if c1 == 0:
+            return (lambda: 0), 0
+        if c1 == 2:
+            return f2, c2
+        # c1 == 1
+        if c2 is not None:
+            return (lambda: min(1, c2)), min(1, c2)
+        return (lambda: 1 if f2() else 0), None
+
+    if c2 == 2:
+        return f1, None
+
+    if c2 == 1:
+        return (lambda: 1 if f1() else 0), None
+
+    if isinstance(e1, Symbol):
+        kconfig = e1.kconfig
+
+        if isinstance(e2, Symbol) and not e2.is_constant:
+            # Very common case, e.g. 'depends on A && B'. Inline the symbol
+            # value lookups.
+            def and_syms():
+                v1 = e1._cached_tri_val
+                if v1 is None or e1._cache_gen != kconfig._generation:
+                    v1 = e1.tri_value
+                if not v1:
+                    return 0
+
+                v2 = e2._cached_tri_val
+                if v2 is None or e2._cache_gen != kconfig._generation:
+                    v2 = e2.tri_value
+                return v1 if v1 < v2 else v2
+
+            return and_syms, None
+
+        def and_sym():
+            v1 = e1._cached_tri_val
+            if v1 is None or e1._cache_gen != kconfig._generation:
+                v1 = e1.tri_value
+            if not v1:
+                return 0
+
+            v2 = f2()
+            return v1 if v1 < v2 else v2
+
+        return and_sym, None
+
+    def and_():
+        v1 = f1()
+        if not v1:
+            return 0
+
+        v2 = f2()
+        return v1 if v1 < v2 else v2
+
+    return and_, None
+
+def _compile_or(e1, f1, c1, e2, f2, c2):
+    """
+    _compile_expr_rec() helper for OR. See _compile_and().
+    """
+    if c1 is not None:
+        if c1 == 2:
+            return (lambda: 2), 2
+        if c1 == 0:
+            return f2, c2
+        # c1 == 1
+        if c2 is not None:
+            return (lambda: max(1, c2)), max(1, c2)
+        return (lambda: 2 if f2() == 2 else 1), None
+
+    if c2 == 0:
+        return f1, None
+
+    if isinstance(e1, Symbol):
+        kconfig = e1.kconfig
+
+        if isinstance(e2, Symbol) and not e2.is_constant:
+            def or_syms():
+                v1 = e1._cached_tri_val
+                if v1 is None or e1._cache_gen != kconfig._generation:
+                    v1 = e1.tri_value
+                if v1 == 2:
+                    return 2
+
+                v2 = e2._cached_tri_val
+                if v2 is None or e2._cache_gen != kconfig._generation:
+                    v2 = e2.tri_value
+                return v1 if v1 > v2 else v2
+
+            return or_syms, None
+
+        def or_sym():
+            v1 = e1._cached_tri_val
+            if v1 is None or e1._cache_gen != kconfig._generation:
+                v1 = e1.tri_value
+            if v1 == 2:
+                return 2
+
+            v2 = f2()
+            return v1 if v1 > v2 else v2
+
+        return or_sym, None
+
+    def or_():
+        v1 = f1()
+        if v1 == 2:
+            return 2
+
+        v2 = f2()
+        return v1 if v1 > v2 else v2
+
+    return or_, None
+
+def _compile_tri_value(sym, memo):
+    """
+    Returns a function that calculates the tristate value of the non-choice
+    bool/tristate symbol 'sym', with the same logic as Symbol.tri_value. See
+    _compile_expr() for 'memo'.
+    """
+    defaults = [(_compile_expr(default, memo), _compile_expr(cond, memo))
+                for default, cond in sym.defaults]
+
+    # None for the (common) case of no selects/implies
+    rev_dep = None if sym._rev_dep is sym.kconfig.n else \
+              _compile_expr(sym._rev_dep, memo)
+    weak_rev_dep = None if sym._weak_rev_dep is sym.kconfig.n else \
+                   _compile_expr(sym._weak_rev_dep, memo)
+    direct_dep = _compile_expr(sym.direct_dep, memo)
+
+    is_bool = (sym.orig_type == BOOL)
+
+    def tri_value():
+        vis = sym.visibility
+        write_to_conf = (vis != 0)
+        val = 0
+
+        if vis and sym.user_value is not None:
+            val = min(sym.user_value, vis)
+
+        else:
+            for default, cond in defaults:
+                cond_val = cond()
+                if cond_val:
+                    val = min(default(), cond_val)
+                    write_to_conf = True
+                    break
+
+            if weak_rev_dep:
+                weak_rev_dep_val = weak_rev_dep()
+                if weak_rev_dep_val and direct_dep():
+                    val = max(weak_rev_dep_val, val)
+                    write_to_conf = True
+
+        if rev_dep:
+            rev_dep_val = rev_dep()
+            if rev_dep_val:
+                val = max(rev_dep_val, val)
+                write_to_conf = True
+
+                if not direct_dep():
+                    sym._warn_select_unsatisfied_deps()
+
+        if val == 1 and \
+           (is_bool or sym.type == BOOL or
+            (weak_rev_dep and weak_rev_dep() == 2)):
+            val = 2
+
+        sym._write_to_conf = write_to_conf
+        return val
+
+    return tri_value
+
+def _compile_visibility(sc, memo):
+    """
+    Returns a function that calculates the visibility of the symbol or choice
+    'sc', with the same logic as _get_visibility(). See _compile_expr() for
+    'memo'.
+    """
+    prompt_conds = [_compile_expr(node.prompt[1], memo)
+                    for node in sc.nodes if node.prompt]
+
+    if not prompt_conds:
+        # The checks below can only lower a visibility of 0 further
+        return lambda: 0
+
+    choice = sc.choice if isinstance(sc, Symbol) else None
+
+    def visibility():
+        vis = 0
+        for cond in prompt_conds:
+            cond_val = cond()
+            if cond_val > vis:
+                vis = cond_val
+
+        if choice:
+            if choice.orig_type == TRISTATE and \
+               sc.orig_type != TRISTATE and choice.tri_value != 2:
+                return 0
+
+            if sc.orig_type == TRISTATE and vis == 1 and \
+               choice.tri_value == 2:
+                return 0
+
+        if vis == 1 and sc.type != TRISTATE:
+            return 2
+
+        return vis
+
+    return visibility
+
+
+# Serialization
+
+def _save_tree(kconfig, pickler):
+    """
+    Pickles the parsed configuration of 'kconfig' (its symbols, choices, menu
+    nodes, and the Kconfig attributes in _TREE_ATTRS) to 'pickler'. Load it
+    with _load_tree().
+
+    Symbols, choices, and menu nodes are not pickled recursively. References
+    to them are replaced by integer indices via pickle's persistent ID
+    mechanism, and their slot values are pickled separately afterwards, one
+    list per slot. This avoids hitting the recursion limit on long
+    MenuNode.next chains and large _dependents sets, and lets _load_tree()
+    restore the objects without looping over them in Python.
+
+    The same pickler is used throughout, so expressions shared between
+    properties stay shared.
+    """
+    syms = []
+    seen = set()
+    for sym in chain(kconfig.syms.values(), kconfig.const_syms.values()):
+        # UNAME_RELEASE is in both dictionaries
+        if id(sym) not in seen:
+            seen.add(id(sym))
+            syms.append(sym)
+
+    nodes = list(_menu_nodes(kconfig.top_node))
+
+    objs = [kconfig, _NO_CACHED_SELECTION, _NO_SLOT] + \
+           syms + kconfig._choices + nodes
+
+    obj_to_pid = dict((id(obj), pid) for pid, obj in enumerate(objs))
+
+    def persistent_id(obj):
+        pid = obj_to_pid.get(id(obj))
+        if pid is None and obj.__class__ in _PICKLED_CLASSES:
+            _internal_error("Internal error while pickling: {} is not part of "
+                            "the configuration.".format(repr(obj)))
+        return pid
+
+    pickler.persistent_id = persistent_id
+
+    pickler.dump((len(syms), len(kconfig._choices), len(nodes)))
+    pickler.dump([getattr(kconfig, name) for name in _TREE_ATTRS])
+
+    for cls, cls_objs in (Symbol, syms), \
+                         (Choice, kconfig._choices), \
+                         (MenuNode, nodes):
+        pickler.dump([[getattr(obj, name, _NO_SLOT) for obj in cls_objs]
+                      if name not in _UNPICKLED_SLOTS else
+                      [None]*len(cls_objs)
+                      for name in cls.__slots__])
+
+def _load_tree(kconfig, unpickler):
+    """
+    Loads a parsed configuration pickled with _save_tree() from 'unpickler'
+    into 'kconfig'.
+    """
+    n_syms, n_choices, n_nodes = unpickler.load()
+
+    # Create all objects up front, so that persistent IDs can be looked up
+    # directly in 'objs'
+    syms = [Symbol.__new__(Symbol) for _ in range(n_syms)]
+    choices = [Choice.__new__(Choice) for _ in range(n_choices)]
+    nodes = [MenuNode.__new__(MenuNode) for _ in range(n_nodes)]
+
+    objs = [kconfig, _NO_CACHED_SELECTION, _NO_SLOT] + syms + choices + nodes
+    unpickler.persistent_load = objs.__getitem__
+
+    tree_vals = unpickler.load()
+
+    for cls, cls_objs in (Symbol, syms), (Choice, choices), (MenuNode, nodes):
+        for name, vals in zip(cls.__slots__, unpickler.load()):
+            # Unpickled strings are fresh copies. Intern them like when
+            # parsing, to share them with other Kconfig instances.
+            if name in _INTERNED_STR_SLOTS:
+                vals = [intern(val) if val.__class__ is str else val
+                        for val in vals]
+            elif name == "prompt":
+                vals = [(intern(val[0]), val[1]) if val.__class__ is tuple
+                        else val
+                        for val in vals]
+
+            # Assign the slot on all objects at once through the slot
+            # descriptor. Much faster than a setattr() loop.
+            list(map(getattr(cls, name).__set__, cls_objs, vals))
+
+            if _NO_SLOT in vals:
+                for obj, val in zip(cls_objs, vals):
+                    if val is _NO_SLOT:
+                        delattr(obj, name)
+
+    for name, val in zip(_TREE_ATTRS, tree_vals):
+        setattr(kconfig, name, val)
+
+    # Key the dictionaries on the interned names too, so that the unpickled
+    # copies can be freed
+    for name in "const_syms", "named_choices", "syms":
+        d = getattr(kconfig, name)
+        setattr(kconfig, name, dict(zip(map(intern, d), d.values())))
+
+    kconfig.kconfig_filenames = list(map(intern, kconfig.kconfig_filenames))
+
+    # id()s change when unpickling
+    kconfig._expr_memo = _expr_memo(kconfig)
+
+def _dump_kconfig(kconfig, f):
+    """
+    Pickles 'kconfig' to the binary file object 'f', together with its
+    current symbol values and settings, so that _load_kconfig() can recreate
+    it (e.g. in a different process). Used by Kconfig.__getstate__(). Cross
+    references between objects become integer indices. See _save_tree().
+    """
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+
+    pickler.dump((kconfig.srctree,
+                  kconfig.config_prefix,
+                  kconfig._print_warnings,
+                  kconfig._print_undef_assign,
+                  kconfig._print_redun_assign))
+    _save_tree(kconfig, pickler)
+
+def _load_kconfig(kconfig, f):
+    """
+    Loads a Kconfig instance pickled with _dump_kconfig() from the binary file
+    object 'f' into the (uninitialized) Kconfig instance 'kconfig'.
+    """
+    unpickler = pickle.Unpickler(f)
+
+    srctree, config_prefix, print_warnings, print_undef_assign, \
+        print_redun_assign = unpickler.load()
+
+    kconfig._init_settings(srctree, config_prefix, print_warnings)
+    kconfig._print_undef_assign = print_undef_assign
+    kconfig._print_redun_assign = print_redun_assign
+
+    # See Kconfig._load_cache()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _load_tree(kconfig, unpickler)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    kconfig._parsing_kconfigs = False
+    kconfig._warn_no_prompt = True
+
+def _random_tri(assignable, rand, probability):
+    """
+    Kconfig.randconfig() helper. Returns a random value from 'assignable',
+    picking a non-n value with the given probability (in percent) if there is
+    one.
+    """
+    if assignable[0] == 0:
+        if rand.random()*100 >= probability:
+            return 0
+        return rand.choice(assignable[1:])
+
+    return rand.choice(assignable)
+
+def _randomize_choice(choice, rand, probability):
+    """
+    Kconfig.randconfig() helper. Sets a random mode for 'choice'. In y mode,
+    a random visible choice symbol is selected. In m mode, each visible choice
+    symbol is set to m with the given probability.
+    """
+    if not choice.assignable:
+        return
+
+    choice.set_value(rand.choice(choice.assignable))
+
+    mode = choice.tri_value
+    if mode == 2:
+        visible = [sym for sym in choice.syms if sym.visibility]
+        if visible:
+            rand.choice(visible).set_value(2)
+
+    elif mode == 1:
+        for sym in choice.syms:
+            if sym.visibility and rand.random()*100 < probability:
+                sym.set_value(1)
+
+def _randconfig_contents(kconfig, seed, probability, header):
+    """
+    Runs randconfig() on 'kconfig' and returns the contents of the resulting
+    .config file.
+    """
+    kconfig.randconfig(seed, probability)
+    return kconfig._config_contents(header)
+
+def _randconfig_worker(task):
+    """
+    Generates the configurations for a run of seeds in a randconfigs() worker
+    process. The Kconfig instance arrives pickled with the task.
+    """
+    kconfig, seeds, probability, header = task
+    return [_randconfig_contents(kconfig, seed, probability, header)
+            for seed in seeds]
+
+def _parse_many_worker(task):
+    """
+    Parses a configuration in a worker process for parse_many(). Returns
+    either the Kconfig instance (which gets pickled by multiprocessing) or
+    the summary.
+    """
+    filename, environ, env, summarize, warn = task
+
+    # Start from the environment of the calling process, since worker
+    # processes are reused
+    os.environ.clear()
+    os.environ.update(environ)
+    for var, val in env.items():
+        if val is None:
+            os.environ.pop(var, None)
+        else:
+            os.environ[var] = val
+
+    kconfig = Kconfig(filename, warn=warn)
+
+    if summarize is not None:
+        return summarize(kconfig)
+
+    return kconfig
+
+class _PreTokenizer(Kconfig):
+    """
+    Tokenizes Kconfig files in Kconfig._pretokenize() worker processes. Uses
+    the same tokenizer as the parent process, but turns symbol references
+    into (name, is_constant) tuples, which are looked up in the parent
+    process.
+    """
+    __slots__ = ()
+
+    def __init__(self, srctree, scanner_tokenizer):
+        self.srctree = srctree
+        self._scanner_tokenizer = scanner_tokenizer
+        self.const_syms = {nmy: (nmy, True) for nmy in ("n", "m", "y")}
+        self._filename = None
+        self._lines = None
+        self._line_tokens = None
+
+    def _lookup_sym(self, name):
+        return (name, False)
+
+    def _lookup_const_sym(self, name):
+        return (name, True)
+
+    def tokenize_file(self, filename):
+        """
+        Returns a ((mtime, size), line_tokens, sourced) tuple for the Kconfig
+        file 'filename', or None if it can't be opened. See
+        Kconfig._pretokenize(). 'sourced' lists the files sourced with paths
+        that don't reference symbols.
+        """
+        try:
+            with self._open(filename) as f:
+                st = os.fstat(f.fileno())
+                self._lines = f.readlines()
+        except IOError:
+            return None
+
+        self._filename = filename
+        self._linenr = 0
+
+        line_tokens = [None]*len(self._lines)
+        sourced = []
+
+        while 1:
+            start = self._linenr
+            try:
+                if not self._next_line():
+                    break
+            except KconfigSyntaxError:
+                # Left to the parent process, which generates the error if
+                # the line is parsed
+                continue
+
+            tokens = self._tokens
+            # Lists flag lines with symbols in them to _next_line()
+            for token in tokens:
+                if token.__class__ is tuple:
+                    line_tokens[start] = tokens
+                    break
+            else:
+                line_tokens[start] = tuple(tokens)
+
+            if tokens[0] == _T_HELP:
+                # Skip the help text, which the parser reads as plain lines.
+                # Lines in it could look like e.g. 'source' statements.
+                self._linenr = _help_lines(self._lines, self._linenr)[1]
+                continue
+
+            if tokens[0] in (_T_SOURCE, _T_RSOURCE) and \
+               len(tokens) == 3 and isinstance(tokens[1], str) and \
+               not _sym_ref_re_search(tokens[1]):
+
+                if tokens[0] == _T_SOURCE:
+                    sourced.append(tokens[1])
+                else:
+                    sourced.append(os.path.join(os.path.dirname(filename),
+                                                tokens[1]))
+
+        self._lines = None
+
+        return ((st.st_mtime, st.st_size), line_tokens, sourced)
+
+# _PreTokenizer instance in Kconfig._pretokenize() worker processes
+_pretokenizer = None
+
+def _pretokenize_init(srctree, scanner_tokenizer):
+    """
+    Initializer for Kconfig._pretokenize() worker processes.
+    """
+    global _pretokenizer
+    _pretokenizer = _PreTokenizer(srctree, scanner_tokenizer)
+
+def _pretokenize_worker(filename):
+    """
+    Tokenizes a Kconfig file in a Kconfig._pretokenize() worker process.
+    """
+    return _pretokenizer.tokenize_file(filename)
+
+def _vec_plan(kconfig):
+    """
+    Works out which symbols Kconfig.tri_values_many() can calculate with array
+    operations. Returns a (vec_syms, fallback_syms) tuple, where 'vec_syms' is
+    a dictionary (for its ordering) with the vectorizable bool and tristate
+    symbols in dependency order as keys, and 'fallback_syms' a list of the
+    remaining bool and tristate symbols.
+
+    A symbol is vectorizable if it's not in a choice, and its expressions only
+    use AND, OR, and NOT on constant symbols, undefined symbols, string/int/
+    hex symbols (whose tristate value is always n), and vectorizable symbols
+    that come earlier in the dependency order (which excludes dependency
+    loops).
+    """
+    vec_syms = {}
+
+    def vectorizable(expr):
+        if expr.__class__ is not tuple:
+            if expr.__class__ is Choice:
+                return False
+
+            return expr in vec_syms or expr.is_constant or not expr.nodes or \
+                   expr.orig_type not in (BOOL, TRISTATE)
+
+        if expr[0] in (AND, OR):
+            # OR can be n-ary
+            for operand in expr[1:]:
+                if not vectorizable(operand):
+                    return False
+            return True
+
+        if expr[0] == NOT:
+            return vectorizable(expr[1])
+
+        # Relation
+        return False
+
+    modules = kconfig.modules
+    if modules.nodes:
+        # The type of all tristate symbols depends on MODULES, which isn't
+        # in _dependents. It needs to come first, and if it can't be
+        # vectorized, nothing can. The latter is unlikely to ever happen in
+        # practice.
+        if modules.choice or modules.orig_type not in (BOOL, TRISTATE) or \
+           not all(vectorizable(expr) for expr in _vec_exprs(modules)):
+            return {}, [sym for sym in kconfig.syms.values()
+                        if sym.nodes and sym.orig_type in (BOOL, TRISTATE)]
+
+        vec_syms[modules] = None
+
+    for item in _dep_order(kconfig):
+        if item.__class__ is not Symbol or item.choice or \
+           item.orig_type not in (BOOL, TRISTATE) or item is modules:
+            continue
+
+        if all(vectorizable(expr) for expr in _vec_exprs(item)):
+            vec_syms[item] = None
+
+    fallback_syms = [sym for sym in kconfig.syms.values()
+                     if sym.nodes and sym.orig_type in (BOOL, TRISTATE) and
+                        sym not in vec_syms]
+
+    return vec_syms, fallback_syms
+
+def _vec_exprs(sym):
+    """
+    Returns a list of the expressions that the tristate value of the non-choice
+    symbol 'sym' depends on. See Symbol.tri_value.
+    """
+    res = [node.prompt[1] for node in sym.nodes if node.prompt]
+    for default, cond in sym.defaults:
+        res.append(default)
+        res.append(cond)
+    res.append(sym._rev_dep)
+    res.append(sym._weak_rev_dep)
+    res.append(sym.direct_dep)
+    return res
+
+def _vec_eval(vec_syms, user_vals, col, numpy):
+    """
+    Calculates the values of the symbols in 'vec_syms' (see _vec_plan()) for
+    all rows of 'user_vals' at once, with the same logic as Symbol.tri_value.
+    'user_vals' holds the user values of the symbols in the columns given by
+    'col', with -1 for no user value. 'numpy' is the numpy module.
+
+    Returns a dictionary that maps symbols to their values. Values are
+    either int8 arrays with one element per row, or plain integers for values
+    that are the same in all rows. The dictionary also includes other symbols
+    referenced in expressions.
+    """
+    minimum = numpy.minimum
+    maximum = numpy.maximum
+    where = numpy.where
+
+    vals = {}
+    # Results for shared subexpressions (see Kconfig._make_expr())
+    memo = {}
+
+    def ev(expr):
+        if expr.__class__ is not tuple:
+            val = vals.get(expr)
+            if val is None:
+                # Symbol whose value is the same in all configurations
+                val = vals[expr] = expr.tri_value
+            return val
+
+        val = memo.get(id(expr))
+        if val is not None:
+            return val
+
+        if expr[0] == AND:
+            v1 = ev(expr[1])
+            v2 = ev(expr[2])
+            if v1.__class__ is int and v2.__class__ is int:
+                val = min(v1, v2)
+            else:
+                val = minimum(v1, v2)
+
+        elif expr[0] == OR:
+            val = ev(expr[1])
+            for operand in expr[2:]:
+                v = ev(operand)
+                if val.__class__ is int and v.__class__ is int:
+                    val = max(val, v)
+                else:
+                    val = maximum(val, v)
+
+        else:
+            # NOT
+            val = 2 - ev(expr[1])
+
+        memo[id(expr)] = val
+        return val
+
+    n_rows = user_vals.shape[0]
+
+    for sym in vec_syms:
+        # Type of the symbol. Tristates become bools when MODULES is n.
+        is_bool = numpy.logical_not(numpy.logical_and(
+            sym.orig_type == TRISTATE, ev(sym.kconfig.modules) != 0))
+
+        # Visibility, like in _get_visibility()
+        vis = 0
+        for node in sym.nodes:
+            if node.prompt:
+                vis = maximum(vis, ev(node.prompt[1]))
+        # m visibility is promoted to y for non-tristates
+        vis = where((vis == 1) & is_bool, 2, vis)
+
+        # Defaults. The first default with a non-n condition wins.
+        val = 0
+        found = numpy.zeros(n_rows, bool)
+        for default, cond in sym.defaults:
+            cond_val = ev(cond)
+            use = ~found & (cond_val != 0)
+            val = where(use, minimum(ev(default), cond_val), val)
+            found = found | use
+
+        # Weak reverse dependencies (implies), if the direct dependencies
+        # are met
+        weak_rev_dep_val = ev(sym._weak_rev_dep)
+        val = where((weak_rev_dep_val != 0) & (ev(sym.direct_dep) != 0),
+                    maximum(weak_rev_dep_val, val), val)
+
+        # The user value takes precedence over the above if the symbol is
+        # visible
+        user_val = user_vals[:, col[sym]]
+        val = where((user_val != -1) & (vis != 0), minimum(user_val, vis),
+                    val)
+
+        # Reverse dependencies (selects) take precedence over everything
+        val = maximum(val, ev(sym._rev_dep))
+
+        # m is promoted to y for bool symbols and symbols implied to y
+        val = where((val == 1) & (is_bool | (weak_rev_dep_val == 2)), 2, val)
+
+        vals[sym] = val.astype(numpy.int8)
+
+    return vals
+
+def _dep_order(kconfig):
+    """
+    Returns a list of the defined symbols and choices in 'kconfig', ordered so
+    that each item comes after the items it depends on (see
+    Kconfig._build_dep()). Used by Kconfig.evaluate_all().
+
+    Choices and their symbols depend on each other, and dependency loops can
+    appear in broken Kconfig files too. Items in such loops (strongly
+    connected components) end up next to each other, in no particular order.
+
+    This is Tarjan's algorithm, with an explicit stack instead of recursion.
+    It finds strongly connected components in reverse topological order, so
+    the result is reversed at the end.
+    """
+    # Maps each visited item to its visit index
+    index = {}
+    # Lowest visit index reachable from each item
+    lowlink = {}
+    # Items that might still belong to the component being built
+    comp_stack = []
+    on_comp_stack = set()
+
+    res = []
+
+    for root in chain(kconfig.defined_syms, kconfig._choices):
+        if root in index:
+            continue
+
+        index[root] = lowlink[root] = len(index)
+        comp_stack.append(root)
+        on_comp_stack.add(root)
+        # (item, iterator over its remaining dependents)
+        stack = [(root, iter(root._dependents))]
+
+        while stack:
+            item, dependents = stack[-1]
+
+            for dep in dependents:
+                if dep not in index:
+                    index[dep] = lowlink[dep] = len(index)
+                    comp_stack.append(dep)
+                    on_comp_stack.add(dep)
+                    stack.append((dep, iter(dep._dependents)))
+                    break
+
+                if dep in on_comp_stack and index[dep] < lowlink[item]:
+                    lowlink[item] = index[dep]
+
+            else:
+                # All dependents of 'item' visited
+                stack.pop()
+
+                if stack:
+                    parent = stack[-1][0]
+                    if lowlink[item] < lowlink[parent]:
+                        lowlink[parent] = lowlink[item]
+
+                if lowlink[item] == index[item]:
+                    # 'item' is the root of a component. Pop it.
+                    while True:
+                        comp_item = comp_stack.pop()
+                        on_comp_stack.remove(comp_item)
+                        res.append(comp_item)
+                        if comp_item is item:
+                            break
+
+    res.reverse()
+    return res
+
+def _menu_nodes(node):
+    """
+    Generates 'node' and all menu nodes below it, in menu order.
+    """
+    while 1:
+        yield node
+
+        # Iterative tree walk using parent pointers, like in write_config()
+
+        if node.list:
+            node = node.list
+        elif node.next:
+            node = node.next
+        else:
+            while node.parent:
+                node = node.parent
+                if node.next:
+                    node = node.next
+                    break
+            else:
+                return
+
+def _ref_index(kconfig):
+    """
+    Returns a dictionary that maps each non-constant symbol to its
+    Symbol.referenced_by tuple, from a single walk over the menu tree.
+    """
+    index = {}
+    # Symbols referenced by the properties of each symbol and choice, as a
+    # list of (kind, symbols) tuples. Symbols and choices can have several
+    # menu nodes, so this is cached.
+    item_refs = {}
+
+    # Creating lots of small lists and tuples makes the cyclic garbage
+    # collector kick in over and over, like in Kconfig._load_cache()
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for node in _menu_nodes(kconfig.top_node):
+            refs = []
+
+            if node.prompt:
+                refs.append(("prompt", _expr_syms(node.prompt[1])))
+
+            item = node.item
+            if item.__class__ in (Symbol, Choice):
+                if item not in item_refs:
+                    item_refs[item] = _item_refs(item)
+                refs.extend(item_refs[item])
+
+            elif item == MENU:
+                refs.append(("visible if", _expr_syms(node.visibility)))
+
+            refs.append(("depends on", _expr_syms(node.dep)))
+
+            for kind, syms in refs:
+                ref = (node, kind)
+                for sym in syms:
+                    if sym in index:
+                        index[sym].append(ref)
+                    else:
+                        index[sym] = [ref]
+
+        for sym, sym_refs in index.items():
+            index[sym] = tuple(sym_refs)
+
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    return index
+
+def _item_refs(item):
+    """
+    _ref_index() helper. Returns a list of (kind, symbols) tuples for the
+    symbols referenced by the properties of the symbol or choice 'item'.
+    """
+    defaults = set()
+    for value, cond in item.defaults:
+        _expr_syms(value, defaults)
+        _expr_syms(cond, defaults)
+
+    refs = [("default", defaults)]
+
+    if item.__class__ is Symbol:
+        for kind, props in (("select", item.selects),
+                            ("imply", item.implies),
+                            ("range", item.ranges)):
+            syms = set()
+            for prop in props:
+                for expr in prop:
+                    _expr_syms(expr, syms)
+            refs.append((kind, syms))
+
+    return refs
+
+def _expr_syms(expr, syms=None):
+    """
+    Adds the non-constant symbols in 'expr' to the set 'syms', and returns it.
+    A new set is created if 'syms' is None.
+    """
+    if syms is None:
+        syms = set()
+
+    if expr.__class__ is tuple:
+        # The operands come after the operator. OR can be n-ary (see
+        # _flatten_or()).
+        for i in range(1, len(expr)):
+            _expr_syms(expr[i], syms)
+
+    elif expr.__class__ is Symbol and not expr.is_constant:
+        syms.add(expr)
+
+    return syms
+
+def _file_stat(filename):
+    """
+    Returns a (mtime, size) tuple for 'filename', or None if it can't be
+    stat()ed. Used to check if cache files are up to date.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+
+    return (st.st_mtime, st.st_size)
+
+def _touch_dep_file(path, sym_name):
+    """
+    Touches (and truncates) the sync_deps() file for the symbol 'sym_name' in
+    'path', creating it and any missing directories along the way.
+    """
+    # split() + join() instead of replacing '_' with '/', so that names
+    # starting with '_' can't produce absolute paths
+    sym_path = os.path.join(path, *sym_name.lower().split("_")) + ".h"
+
+    sym_path_dir = os.path.dirname(sym_path)
+    if not os.path.exists(sym_path_dir):
+        os.makedirs(sym_path_dir, 0o755)
+
+    # A kind of truncating touch, mirroring the C tools
+    os.close(os.open(sym_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+
+def _write_contents(filename, contents, only_if_changed):
+    """
+    Writes the string 'contents' to 'filename', for write_config() and
+    write_autoconf(). With 'only_if_changed', the file is left alone if it
+    already has the contents, and is otherwise written atomically. Returns
+    True if the file was written.
+    """
+    if not only_if_changed:
+        with open(filename, "w") as f:
+            f.write(contents)
+        return True
+
+    try:
+        with open(filename) as f:
+            if f.read() == contents:
+                return False
+    except (IOError, OSError, UnicodeDecodeError):
+        # Missing or unreadable. Try to write it.
+        pass
+
+    _write_atomically(filename, contents)
+    return True
+
+def _write_atomically(filename, contents):
+    """
+    Writes the string 'contents' to 'filename' via a temporary file in the
+    same directory, which is then renamed over 'filename'. Readers never see
+    a partially written file, and an interrupted write leaves the old file
+    intact.
+    """
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or os.curdir)
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(contents)
+
+        # mkstemp() creates the file with mode 0600. Give it the permissions
+        # of the old file, or what open() would have used for a new file.
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp_filename, mode)
+
+        _replace_file(tmp_filename, filename)
+
+    except:
+        os.remove(tmp_filename)
+        raise
+
+def _replace_file(src, dst):
+    """
+    Renames 'src' to 'dst', replacing 'dst' if it exists. os.replace() would do
+    this, but it's Python 3-only.
+    """
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # os.rename() already replaces 'dst' atomically on POSIX systems.
+        # Windows needs some help.
+        if not os.path.exists(dst):
+            raise
+
+        os.remove(dst)
+        os.rename(src, dst)
+
 #
 # Public global constants
 #
@@ -4602,6 +7615,46 @@ _initial_token_re_match = \
 # Matches an identifier/keyword, also eating trailing whitespace
 _id_keyword_re_match = re.compile(r"([A-Za-z0-9_/.-]+)\s*", _RE_ASCII).match
 
+# Matches the tokens past the first one on a line, also eating trailing
+# whitespace. Used by Kconfig._tokenize_scanner(). The group that is
+# non-empty for a match gives the token kind:
+#
+#   id:      identifier/keyword
+#   string:  "" or '' string, including the quotes and with escapes left in
+#   op:      operator or parenthesis
+#   comment: comment, up to the end of the line
+#   quote:   start of an unterminated string
+#
+# Invalid characters are matched with all groups empty, and are ignored.
+# Matching always succeeds when there's text left, so findall() covers the
+# entire line.
+_scanner_re_findall = re.compile(r"""
+    (?:
+        (?P<id>[A-Za-z0-9_/.-]+)
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op>&&|\|\||!=|<=|>=|[!=()<>])
+      | (?P<comment>\#.*)
+      | (?P<quote>["'])
+      | .
+    )
+    \s*
+""", _RE_ASCII | re.VERBOSE | re.DOTALL).findall
+
+# Operator tokens, for Kconfig._tokenize_scanner()
+_OPERATOR_TOKENS = {
+    "&&": _T_AND,
+    "||": _T_OR,
+    "!":  _T_NOT,
+    "!=": _T_UNEQUAL,
+    "=":  _T_EQUAL,
+    "(":  _T_OPEN_PAREN,
+    ")":  _T_CLOSE_PAREN,
+    "<":  _T_LESS,
+    "<=": _T_LESS_EQUAL,
+    ">":  _T_GREATER,
+    ">=": _T_GREATER_EQUAL,
+}
+
 # Regular expression for finding $-references to symbols in strings
 _sym_ref_re_search = re.compile(r"\$([A-Za-z0-9_]+)", _RE_ASCII).search
 
@@ -4625,6 +7678,11 @@ _TOKEN_TO_TYPE = {
 # will do) for it so we can test with 'is'.
 _NO_CACHED_SELECTION = object()
 
+# Batches that change the user values of more than 1/_INVALIDATE_ALL_RATIO of
+# the defined symbols invalidate everything by starting a new generation,
+# instead of walking dependents. See Kconfig._rec_invalidate_items().
+_INVALIDATE_ALL_RATIO = 8
+
 # Used in comparisons. 0 means the base is inferred from the format of the
 # string.
 _TYPE_TO_BASE = {
@@ -4634,6 +7692,68 @@ _TYPE_TO_BASE = {
     UNKNOWN:  0,
 }
 
+# Bumped when the cache file format changes in a way that isn't caught by the
+# other checks in Kconfig._cache_key()
+_CACHE_VERSION = 1
+
+# Kconfig attributes that make up the parsed configuration. Saved and restored
+# by _save_tree() and _load_tree().
+_TREE_ATTRS = (
+    "_choices",
+    "_file_stats",
+    "_generation",
+    "const_syms",
+    "defconfig_list",
+    "defined_syms",
+    "env_vars",
+    "kconfig_filenames",
+    "m",
+    "modules",
+    "n",
+    "named_choices",
+    "syms",
+    "top_node",
+    "y",
+)
+
+# Symbol attributes saved by Kconfig.snapshot(), and the ones among them that
+# aren't cached values
+_SNAPSHOT_SYM_ATTRS = (
+    "_cached_assignable",
+    "_cached_str_val",
+    "_cached_tri_val",
+    "_cached_vis",
+    "_write_to_conf",
+    "user_value",
+)
+_SNAPSHOT_UNCACHED = frozenset((
+    "_write_to_conf",
+    "user_value",
+))
+
+# Classes whose instances are pickled separately by _save_tree()
+_PICKLED_CLASSES = (Symbol, Choice, MenuNode)
+
+# Slots that are pickled as None by _save_tree(). Closures can't be pickled,
+# and the rev_dep caches are rebuilt on demand.
+_UNPICKLED_SLOTS = frozenset((
+    "_compiled_tri",
+    "_compiled_vis",
+    "_rev_dep_cache",
+    "_weak_rev_dep_cache",
+))
+
+# String slots interned by _load_tree() (besides MenuNode.prompt, which holds
+# a tuple). MenuNode._help can also hold a lazy_help location.
+_INTERNED_STR_SLOTS = frozenset((
+    "_help",
+    "filename",
+    "name",
+))
+
+# Stands in for unset slots (e.g. MenuNode.help for menus) in pickled states
+_NO_SLOT = object()
+
 _RELATIONS = frozenset((
     EQUAL,
     UNEQUAL,
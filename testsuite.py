@@ -39,17 +39,23 @@
 # service.
 
 from kconfiglib import Kconfig, Symbol, Choice, COMMENT, MENU, \
-                       BOOL, TRISTATE, HEX, STRING, \
+                       BOOL, TRISTATE, HEX, STRING, AND, OR, \
                        TRI_TO_STR, \
-                       KconfigSyntaxError, expr_value, escape, unescape
+                       KconfigSyntaxError, expr_value, expr_str, escape, \
+                       unescape, parse_many
+import copy
 import difflib
 import errno
 import os
+import pickle
 import platform
+import random
 import re
+import shutil
 import subprocess
 import sys
 import textwrap
+import threading
 import time
 
 def shell(cmd):
@@ -243,6 +249,90 @@ def run_selftests():
     verify_string_bad(r""" 'foo """)
 
 
+    print("Testing _tokenize_scanner()")
+
+    def tokens_str(tokenize, line):
+        # Returns a string with the tokens from tokenizing 'line' with
+        # 'tokenize', or the error message for syntax errors
+        c._line = line
+        try:
+            tokenize(c)
+        except KconfigSyntaxError as e:
+            return str(e)
+
+        return repr([token.name if isinstance(token, Symbol) else token
+                     for token in c._tokens])
+
+    def verify_same_tokens(line):
+        old = tokens_str(Kconfig._tokenize, line)
+        new = tokens_str(Kconfig._tokenize_scanner, line)
+        verify(old == new,
+               "_tokenize_scanner() gave {} for {}, _tokenize() gave {}"
+               .format(new, repr(line), old))
+
+    c = Kconfig("Kconfiglib/tests/empty", warn=False)
+    c._filename = "dummy"
+    c._linenr = 1
+
+    for line in ('config FOO\n',
+                 'bool "foo"\n',
+                 'bool unquoted\n',
+                 'option env="ENV"\n',
+                 'default "a" if B && (C || !D) # comment\n',
+                 'depends on A=B && A!=B && A<B && A<=B && A>B && A>=B\n',
+                 'depends on A & B | C $ D\n',
+                 'depends on n || m || y\n',
+                 'default "\\"\\\\\'" \'"\'\n',
+                 'default "unterminated\n',
+                 "default 'unterminated\\'\n",
+                 'source "foo/bar"\n',
+                 'range 0x10 -1\n',
+                 '---help---\n',
+                 '  # comment\n',
+                 '12 foo\n',
+                 'endmenu\n',
+                 'endmenu'):
+        verify_same_tokens(line)
+
+    for fname in os.listdir("Kconfiglib/tests"):
+        if fname.startswith("K"):
+            with open(os.path.join("Kconfiglib/tests", fname)) as f:
+                for line in f:
+                    verify_same_tokens(line)
+
+    # Parsing with scanner_tokenizer=True should give the same configuration
+
+    def tokenizer_parse_str(fname, scanner_tokenizer):
+        # Returns a string with the menu nodes (with locations) parsed from
+        # 'fname', or the error message if parsing fails
+        try:
+            c = Kconfig(fname, warn=False,
+                        scanner_tokenizer=scanner_tokenizer)
+        except (KconfigSyntaxError, IOError) as e:
+            return str(e)
+
+        res = []
+
+        def add_nodes(node):
+            while node:
+                res.append("{}:{}\n{}".format(node.filename, node.linenr,
+                                              node))
+                add_nodes(node.list)
+                node = node.next
+
+        add_nodes(c.top_node)
+
+        return "\n".join(res)
+
+    for fname in sorted(os.listdir("Kconfiglib/tests")):
+        if fname.startswith("K"):
+            fname = os.path.join("Kconfiglib/tests", fname)
+            verify(tokenizer_parse_str(fname, True) ==
+                   tokenizer_parse_str(fname, False),
+                   "{} parsed with scanner_tokenizer=True differs from the "
+                   "default tokenizer".format(fname))
+
+
     print("Testing escape() and unescape()")
 
     def verify_escape_unescape(s, sesc):
@@ -742,36 +832,37 @@ choice
 
     print("Testing tricky help strings")
 
-    c = Kconfig("Kconfiglib/tests/Khelp")
-
     def verify_help(node, s):
         verify_equal(node.help, s[1:])
 
-    verify_help(c.syms["TWO_HELP_STRINGS"].nodes[0], """
+    for lazy_help in False, True:
+        c = Kconfig("Kconfiglib/tests/Khelp", lazy_help=lazy_help)
+
+        verify_help(c.syms["TWO_HELP_STRINGS"].nodes[0], """
 first help string
 """)
 
-    verify_help(c.syms["TWO_HELP_STRINGS"].nodes[1], """
+        verify_help(c.syms["TWO_HELP_STRINGS"].nodes[1], """
 second help string
 """)
 
-    verify_help(c.syms["NO_BLANK_AFTER_HELP"].nodes[0], """
+        verify_help(c.syms["NO_BLANK_AFTER_HELP"].nodes[0], """
 help for
 NO_BLANK_AFTER_HELP
 """)
 
-    verify_help(c.named_choices["CHOICE_HELP"].nodes[0], """
+        verify_help(c.named_choices["CHOICE_HELP"].nodes[0], """
 help for
 CHOICE_HELP
 """)
 
-    verify_help(c.syms["HELP_TERMINATED_BY_COMMENT"].nodes[0], """
+        verify_help(c.syms["HELP_TERMINATED_BY_COMMENT"].nodes[0], """
 a
 b
 c
 """)
 
-    verify_help(c.syms["TRICKY_HELP"].nodes[0], """
+        verify_help(c.syms["TRICKY_HELP"].nodes[0], """
 a
  b
   c
@@ -786,6 +877,21 @@ g
   i
 """)
 
+    # With lazy_help=True, help texts should only be read when accessed, and
+    # should survive pickling
+    c = Kconfig("Kconfiglib/tests/Khelp", lazy_help=True)
+    node = c.syms["TRICKY_HELP"].nodes[0]
+    verify(isinstance(node._help, tuple),
+           "help text read before being accessed with lazy_help=True")
+    help_text = \
+        Kconfig("Kconfiglib/tests/Khelp").syms["TRICKY_HELP"].nodes[0].help
+    verify_equal(pickle.loads(pickle.dumps(c)).syms["TRICKY_HELP"]
+                 .nodes[0].help,
+                 help_text)
+    verify_equal(node.help, help_text)
+    verify(isinstance(node._help, str),
+           "help text not stored after being read with lazy_help=True")
+
 
     print("Testing locations and 'source', 'rsource'")
 
@@ -1391,6 +1497,56 @@ g
     c.load_config(config_test_file + "_from_user")
     verify_value("STRING", r'''\"a'\\''')
 
+    os.remove(config_test_file + "_from_def")
+    os.remove(config_test_file + "_from_user")
+
+    # Skipping unchanged files with only_if_changed=True
+
+    c = Kconfig("Kconfiglib/tests/Kescape")
+
+    for write_fn in c.write_config, c.write_autoconf:
+        if os.path.exists(config_test_file):
+            os.remove(config_test_file)
+
+        c.syms["STRING"].set_value("foo")
+        verify(write_fn(config_test_file, only_if_changed=True),
+               "{}() did not write a new file".format(write_fn.__name__))
+        with open(config_test_file) as f:
+            contents = f.read()
+
+        os.utime(config_test_file, (0, 0))
+        verify(not write_fn(config_test_file, only_if_changed=True),
+               "{}() rewrote an unchanged file".format(write_fn.__name__))
+        verify(os.stat(config_test_file).st_mtime == 0,
+               "{}() touched an unchanged file".format(write_fn.__name__))
+
+        # Without only_if_changed, the file is always written
+        verify(write_fn(config_test_file),
+               "{}() did not write the file".format(write_fn.__name__))
+        verify_file_contents(config_test_file, contents)
+        verify(os.stat(config_test_file).st_mtime != 0,
+               "{}() did not write the file".format(write_fn.__name__))
+
+        os.chmod(config_test_file, 0o640)
+        c.syms["STRING"].set_value("bar")
+        verify(write_fn(config_test_file, only_if_changed=True),
+               "{}() did not write a changed file".format(write_fn.__name__))
+        with open(config_test_file) as f:
+            verify('"bar"' in f.read(),
+                   "{}() wrote the wrong contents".format(write_fn.__name__))
+        if os.name == "posix":
+            verify(os.stat(config_test_file).st_mode & 0o777 == 0o640,
+                   "{}() did not preserve the file mode"
+                   .format(write_fn.__name__))
+
+    # No temporary files should be left behind
+    verify_equal(sorted(fname for fname in os.listdir("Kconfiglib/tests")
+                        if fname.startswith("tmp")),
+                 [])
+
+    os.remove(config_test_file)
+
+
     # Appending values from a .config
 
     c = Kconfig("Kconfiglib/tests/Kappend")
@@ -1422,6 +1578,53 @@ g
     c.load_config("Kconfiglib/tests/config_indented")
     verify_value("IGNOREME", "y")
 
+    # Line numbers in warnings, with CRLF line endings, trailing whitespace,
+    # and lines that aren't assignments
+
+    with open(config_test_file, "wb") as f:
+        f.write(b"# comment\r\n"
+                b"CONFIG_BOOL=y \t\r\n"
+                b"\r\n"
+                b"# CONFIG_UNDEFINED is not set\r\n"
+                b"CONFIG_STRING=\"foo\"\r\n"
+                b"CONFIG_BOOL=n\r\n"
+                b"CONFIG_STRING=\"foo\"\r\n"
+                b"CONFIG_STRING=bar  \r\n")
+
+    class StderrCollector:
+        def __init__(self):
+            self.lines = []
+
+        def write(self, s):
+            self.lines.extend(s.splitlines())
+
+        def flush(self):
+            # Called by multiprocessing when starting worker processes
+            pass
+
+    c.enable_undef_warnings()
+    old_stderr = sys.stderr
+    sys.stderr = collector = StderrCollector()
+    try:
+        c.load_config(config_test_file)
+    finally:
+        sys.stderr = old_stderr
+        c.disable_undef_warnings()
+
+    verify_value("BOOL", "n")
+    verify_value("STRING", "foo")
+
+    warnings = [line.split(" warning: ")[0] + " " +
+                line.split(" warning: ")[1].split()[0]
+                for line in collector.lines]
+    verify_equal(warnings,
+                 [config_test_file + ":4: attempt",
+                  config_test_file + ":6: BOOL",
+                  config_test_file + ":7: STRING",
+                  config_test_file + ":8: Malformed"])
+
+    os.remove(config_test_file)
+
 
     print("Testing Kconfig fetching and separation")
 
@@ -1532,6 +1735,50 @@ g
     assign_and_verify("IMPLIED_BOOL", 2)
 
 
+    print("Testing select flattening")
+
+    c = Kconfig("Kconfiglib/tests/Kselect")
+
+    selected = c.syms["SELECTED"]
+    sel_1, sel_2, sel_3, sel_4, sel_5, cond = \
+        [c.syms[name] for name in
+         ("SEL_1", "SEL_2", "SEL_3", "SEL_4", "SEL_5", "COND")]
+
+    # Selects are stored flattened internally, but rev_dep/weak_rev_dep
+    # still use two-operand ORs
+    verify_equal(selected._rev_dep,
+                 (OR, sel_1, (AND, sel_2, cond), sel_3, sel_4))
+    verify_equal(selected.rev_dep,
+                 (OR, (OR, (OR, sel_1, (AND, sel_2, cond)), sel_3), sel_4))
+    verify_equal(c.syms["IMPLIED"].weak_rev_dep, (OR, sel_4, sel_5))
+    verify_equal(sel_1.rev_dep, c.n)
+
+    verify_equal(expr_str(selected._rev_dep),
+                 "SEL_1 || SEL_2 && COND || SEL_3 || SEL_4")
+    verify_equal(expr_str(selected._rev_dep), expr_str(selected.rev_dep))
+    verify(selected.rev_dep is selected.rev_dep,
+           "rev_dep should be cached between accesses")
+
+    # Assigning rev_dep/weak_rev_dep stores the flattened form
+    sel_1.rev_dep = (OR, (OR, sel_2, sel_3), cond)
+    verify_equal(sel_1._rev_dep, (OR, sel_2, sel_3, cond))
+    verify_equal(sel_1.rev_dep, (OR, (OR, sel_2, sel_3), cond))
+    sel_1.weak_rev_dep = sel_2
+    verify_equal(sel_1._weak_rev_dep, sel_2)
+    verify_equal(sel_1.weak_rev_dep, sel_2)
+    sel_1.rev_dep = sel_1.weak_rev_dep = c.n
+
+    verify_value("SELECTED", "y")
+    verify_value("IMPLIED", "y")
+
+    c.syms["SEL_4"].set_value(0)
+    verify_value("SELECTED", "m")
+    verify_value("IMPLIED", "m")
+
+    c.syms["SEL_2"].set_value(0)
+    verify_value("SELECTED", "n")
+
+
     print("Testing choice semantics")
 
     # Would warn for choice value symbols defined without a type, even
@@ -1703,9 +1950,1194 @@ g
     verify_is_normal_choice_symbol("WS9")
 
 
+    print("Testing memory layout")
+
+    # Symbols, choices, and menu nodes are numerous, so they use __slots__ to
+    # save memory. A __dict__ would sneak in if some class in the hierarchy
+    # didn't define __slots__.
+    c = Kconfig("Kconfiglib/tests/Kchoice")
+
+    for item in c.syms["MODULES"], c.named_choices["BOOL"], c.top_node:
+        verify(not hasattr(item, "__dict__"),
+               "{} has a __dict__".format(type(item).__name__))
+
+    # _dependents is turned into a tuple after parsing (and shared when empty)
+    for sym in c.syms.values():
+        verify(isinstance(sym._dependents, tuple),
+               "expected _dependents of {} to be a tuple".format(sym.name))
+
+
+    print("Testing Symbol.referenced_by")
+
+    c = Kconfig("Kconfiglib/tests/Kref")
+
+    def verify_refs(name, expected):
+        refs = [(node.linenr, kind)
+                for node, kind in c.syms[name].referenced_by]
+        verify(refs == expected,
+               "wrong references to {}: expected {}, got {}"
+               .format(name, expected, refs))
+
+    # Symbol properties show up for each menu node of the symbol, which is
+    # why FOO and BAR are referenced from the second definition of A
+    verify_refs("FOO", [(1, "prompt"), (1, "default"),
+                        (5, "prompt"), (5, "select"), (5, "depends on"),
+                        (10, "range"),
+                        (18, "visible if"),
+                        (22, "prompt"), (22, "depends on"),
+                        (27, "default"),
+                        (36, "default")])
+    verify_refs("BAR", [(1, "default"),
+                        (5, "select"),
+                        (14, "imply"),
+                        (18, "prompt"), (18, "depends on"),
+                        (22, "prompt"), (22, "depends on"),
+                        (36, "default")])
+    verify_refs("A", [(5, "select")])
+    verify_refs("B", [(14, "imply")])
+    verify_refs("C", [])
+    verify_refs("D", [(27, "default")])
+    verify_refs("10", [(10, "range")])
+
+    verify(c.y.referenced_by == () and
+           c.const_syms["FOO"].referenced_by == (),
+           "constant symbols should not be indexed")
+
+    verify(c.syms["FOO"].referenced_by is c.syms["FOO"].referenced_by,
+           "referenced_by should not be rebuilt on each access")
+
+
+    print("Testing expression interning")
+
+    c = Kconfig("Kconfiglib/tests/Kintern")
+
+    a, b, c_sym = [c.syms[name] for name in ("A", "B", "C")]
+
+    # Structurally identical expressions should be the same object, both when
+    # propagated from menus and when written out separately
+    verify(a.direct_dep is b.direct_dep,
+           "menu dependency not shared between A and B")
+    verify(a.direct_dep is c_sym.direct_dep,
+           "identical 'depends on' expressions not shared")
+    verify(a.nodes[0].prompt[1] is b.nodes[0].prompt[1],
+           "prompt conditions not shared between A and B")
+    verify(a.defaults[0][1] is b.defaults[0][1],
+           "default conditions not shared between A and B")
+    verify_equal(expr_str(a.direct_dep), "DEP && !MODULES")
+
+    # Shared expressions get memoized values, which must follow changes to
+    # the symbols in them
+    dep = a.direct_dep
+    verify(id(dep) in c._expr_memo,
+           "shared menu dependency not in the expression memo")
+
+    verify_value("A", "n")
+    verify_equal(c_sym.visibility, 0)
+    c.syms["DEP"].set_value(2)
+    verify_value("A", "n")
+    c.modules.set_value(0)
+    verify_value("A", "y")
+    verify_value("B", "y")
+    verify_equal(c_sym.visibility, 2)
+    verify_equal(expr_value(dep), 2)
+    c.syms["DEP"].set_value(0)
+    verify_value("A", "n")
+    verify_equal(c_sym.visibility, 0)
+    verify_equal(expr_value(dep), 0)
+    with c.batch():
+        c.syms["DEP"].set_value(2)
+    verify_value("A", "y")
+    verify_equal(expr_value(dep), 2)
+
+    snapshot = c.snapshot()
+    c.syms["DEP"].set_value(0)
+    verify_value("B", "n")
+    c.restore(snapshot)
+    verify_value("B", "y")
+    verify_equal(expr_value(dep), 2)
+
+
+    # Test Kconfig files for checking that different ways of calculating and
+    # invalidating values give the same results
+    value_test_fnames = ["Kconfiglib/tests/" + fname for fname in (
+        "Kassignable", "Kchoice", "Keval", "Kimply", "Kmisc", "Krange",
+        "Krelation", "Kselect", "Kvisibility")]
+
+    def state_str(c):
+        # Returns a string with the values, visibilities, and assignable
+        # values of all symbols and choices in 'c'
+        res = []
+
+        for sym in c.defined_syms:
+            res.append("{} {} {} {} {}".format(
+                sym.name, sym.str_value, sym.tri_value, sym.visibility,
+                sym.assignable))
+
+        for choice in c._choices:
+            res.append("{} {} {} {} {}".format(
+                choice.name, choice.str_value, choice.tri_value,
+                choice.visibility, choice.selection and choice.selection.name))
+
+        return "\n".join(res)
+
+    def verify_same_state(c, c2, msg):
+        # Verifies that 'c' and 'c2' have the same values, visibilities, and
+        # assignable values (see state_str()). 'msg' is printed otherwise.
+        verify(state_str(c2) == state_str(c), msg)
+
+
+    print("Testing expression compilation")
+
+    def verify_compiled(fname):
+        # Verifies that Kconfig.compile() doesn't change any values, also
+        # after assigning all assignable values to all symbols, with and
+        # without modules enabled
+        c = Kconfig(fname, warn=False)
+        c_comp = Kconfig(fname, warn=False)
+        c_comp.compile()
+
+        def verify_same(what):
+            verify_same_state(c, c_comp, "compiling {} changed values {}"
+                                         .format(fname, what))
+
+        for modules_val in 2, 0:
+            for conf in c, c_comp:
+                if conf.modules.orig_type:
+                    conf.modules.set_value(modules_val)
+
+            verify_same("with MODULES={}".format(modules_val))
+
+            for sym in c.defined_syms:
+                sym_comp = c_comp.syms[sym.name]
+
+                for val in sym.assignable:
+                    sym.set_value(val)
+                    sym_comp.set_value(val)
+                    verify_same("after setting {} to {}"
+                                .format(sym.name, val))
+
+            c.unset_values()
+            c_comp.unset_values()
+            verify_same("after unsetting values")
+
+    for fname in value_test_fnames:
+        verify_compiled(fname)
+
+    # Assigning rev_dep/weak_rev_dep after compile() should be respected
+
+    c = Kconfig("Kconfiglib/tests/Kselect")
+    c.compile()
+    c.syms["SELECTED"].rev_dep = c.syms["SEL_2"]
+    c.syms["IMPLIED"].weak_rev_dep = c.n
+    verify_value("SELECTED", "m")
+    verify_value("IMPLIED", "n")
+
+
+    print("Testing batch()")
+
+    def verify_batch(fname):
+        # Verifies that setting values within Kconfig.batch() gives the same
+        # result as setting them one by one, starting from a fully evaluated
+        # configuration so that invalidation matters
+        c = Kconfig(fname, warn=False)
+        c_batch = Kconfig(fname, warn=False)
+
+        # Deterministic "random" assignments
+        rand = random.Random(fname)
+
+        for _ in range(10):
+            verify_same_state(c, c_batch,
+                              "batch() gave different values than "
+                              "set_value() for " + fname)
+
+            assignments = []
+            for sym in c.defined_syms:
+                if sym.assignable and rand.random() < 0.3:
+                    assignments.append((sym.name,
+                                        rand.choice(sym.assignable)))
+                elif sym.user_value is not None and rand.random() < 0.1:
+                    assignments.append((sym.name, None))
+
+            for name, val in assignments:
+                if val is None:
+                    c.syms[name].unset_value()
+                else:
+                    c.syms[name].set_value(val)
+
+            with c_batch.batch():
+                # Nesting should work too
+                with c_batch.batch():
+                    for name, val in assignments[:len(assignments)//2]:
+                        if val is None:
+                            c_batch.syms[name].unset_value()
+                        else:
+                            c_batch.syms[name].set_value(val)
+
+                for name, val in assignments[len(assignments)//2:]:
+                    if val is None:
+                        c_batch.syms[name].unset_value()
+                    else:
+                        c_batch.syms[name].set_value(val)
+
+        verify(c_batch._deferred_invalidation is None,
+               "still in batch mode after batch() block")
+
+    for fname in value_test_fnames:
+        verify_batch(fname)
+
+
+    print("Testing generation-based invalidation")
+
+    c = Kconfig("Kconfiglib/tests/Kintern")
+
+    dep = c.syms["DEP"]
+
+    verify_value("A", "n")
+    verify_value("C", "n")
+
+    # Toggling MODULES starts a new generation. Changes to DEP after that
+    # must still reach A, both when A has been recalculated in the new
+    # generation and when it hasn't.
+    c.modules.set_value(0)
+    verify_value("A", "n")
+    dep.set_value(2)
+    verify_value("A", "y")
+    verify_value("B", "y")
+
+    c.modules.set_value(2)
+    dep.set_value(0)
+    c.modules.set_value(0)
+    verify_value("A", "n")
+    dep.set_value(2)
+    verify_value("A", "y")
+    verify_equal(c.syms["C"].visibility, 2)
+
+    c.unset_values()
+    verify_value("A", "n")
+    verify_equal(c.syms["C"].visibility, 0)
+    verify_value("MODULES", "y")
+
+    # Loading a .config that sets most symbols also invalidates everything in
+    # one go
+    c.modules.set_value(0)
+    dep.set_value(2)
+    c.write_config("Kconfiglib/tests/config_gen")
+    c.unset_values()
+    verify_value("A", "n")
+    c.load_config("Kconfiglib/tests/config_gen")
+    verify_value("A", "y")
+    verify_value("B", "y")
+    os.remove("Kconfiglib/tests/config_gen")
+
+
+    print("Testing evaluate_all()")
+
+    def verify_evaluate_all(fname):
+        # Verifies that evaluate_all() gives the same values as reading them
+        # one by one, and that everything is cached afterwards
+        c = Kconfig(fname, warn=False)
+        c_eval = Kconfig(fname, warn=False)
+
+        for conf in c, c_eval:
+            if conf.modules.orig_type:
+                conf.modules.set_value(0)
+
+        c_eval.evaluate_all()
+
+        for sym in c_eval.defined_syms:
+            verify(sym._cached_str_val is not None,
+                   "{} not evaluated by evaluate_all() in {}"
+                   .format(sym.name, fname))
+
+        verify_same_state(c, c_eval,
+                          "evaluate_all() changed values in " + fname)
+
+        # Every defined symbol and choice should appear exactly once, after
+        # the items it depends on (except for loops, e.g. within choices)
+        order = c_eval._eval_order
+        verify_equal(len(order), len(set(order)))
+        verify_equal(set(order), set(c_eval.defined_syms + c_eval._choices))
+
+        def choice_of(item):
+            return item if isinstance(item, Choice) else item.choice
+
+        pos = dict((item, i) for i, item in enumerate(order))
+        for item in order:
+            for dep in item._dependents:
+                verify(pos[dep] > pos[item] or
+                       (choice_of(dep) and choice_of(dep) is choice_of(item)),
+                       "{} comes before {}, which it depends on, in {}"
+                       .format(dep.name, item.name, fname))
+
+    for fname in value_test_fnames:
+        verify_evaluate_all(fname)
+
+
+    print("Testing tri_values_many()")
+
+    def verify_tri_values_many(fname):
+        # Verifies that tri_values_many() gives the same values as assigning
+        # the values of each configuration and reading Symbol.tri_value
+        c = Kconfig(fname, warn=False)
+
+        bool_tri_syms = [sym for sym in c.defined_syms
+                         if sym.orig_type in (BOOL, TRISTATE)]
+        if not bool_tri_syms:
+            # E.g. Krange
+            return
+
+        # Each value for each symbol, alone and together with the next
+        # symbol, with and without modules
+        configs = []
+        for modules_val in 2, 0:
+            for i, sym in enumerate(bool_tri_syms):
+                for val in 0, 1, 2, "y":
+                    config = {c.modules: modules_val, sym: val}
+                    configs.append(config)
+                    configs.append(dict(config.items()))
+                    if i + 1 < len(bool_tri_syms):
+                        configs[-1][bool_tri_syms[i + 1]] = 2 - val \
+                            if val != "y" else "m"
+
+        # Some user values that should be kept
+        for sym, val in configs[-1].items():
+            sym.set_value(val)
+        user_vals = [(sym, sym.user_value) for sym in c.defined_syms]
+
+        res = c.tri_values_many(configs)
+
+        for sym, val in user_vals:
+            verify(sym.user_value == val,
+                   "tri_values_many() didn't restore the user value of " +
+                   sym.name)
+
+        for config, row in zip(configs, res):
+            c.unset_values()
+            for sym, val in config.items():
+                sym.set_value(val)
+
+            for sym, val in zip(c.defined_syms, row):
+                verify(sym.tri_value == val,
+                       "tri_values_many() gave {} for {} in {}, expected {}, "
+                       "with the configuration {}"
+                       .format(val, sym.name, fname, sym.tri_value,
+                               dict((sym.name, val)
+                                    for sym, val in config.items())))
+
+    try:
+        import numpy
+    except ImportError:
+        print("NumPy not available, skipping tri_values_many() tests")
+    else:
+        for fname in value_test_fnames + ["Kconfiglib/tests/Kstr"]:
+            verify_tri_values_many(fname)
+
+        # No warnings should be printed, also for choice symbols, which are
+        # calculated by assigning values
+        c = Kconfig("Kconfiglib/tests/Kchoice", warn=False)
+        c.enable_warnings()
+        choice_sym = c.named_choices["BOOL"].syms[0]
+        old_stderr = sys.stderr
+        sys.stderr = collector = StderrCollector()
+        try:
+            c.tri_values_many([{choice_sym: "foo", c.syms["TRISTATE_SYM"]: "foo"},
+                               {choice_sym: 1}])
+        finally:
+            sys.stderr = old_stderr
+        verify_equal(collector.lines, [])
+        verify(c._print_warnings,
+               "tri_values_many() didn't reenable warnings")
+
+
+    print("Testing snapshot()/restore()")
+
+    def user_vals_str(c):
+        # Returns a string with the user values of all symbols and choices in
+        # 'c'
+        return "\n".join(
+            ["{} {}".format(sym.name, sym.user_value)
+             for sym in c.defined_syms] +
+            ["{} {} {}".format(choice.name, choice.user_value,
+                               choice.user_selection and
+                               choice.user_selection.name)
+             for choice in c._choices])
+
+    def verify_snapshot(fname):
+        c = Kconfig(fname, warn=False)
+
+        # Give some symbols user values, and cache some values
+        for sym in c.defined_syms[::2]:
+            if sym.assignable:
+                sym.set_value(sym.assignable[-1])
+        state_str(c)
+
+        snapshot = c.snapshot()
+        orig_state = state_str(c)
+        orig_user_vals = user_vals_str(c)
+
+        c2 = copy.deepcopy(c)
+        verify(state_str(c2) == orig_state and
+               user_vals_str(c2) == orig_user_vals,
+               "copy of {} has different values".format(fname))
+
+        # Change everything in the copy, and check that the original is
+        # unaffected
+        for sym in c2.defined_syms:
+            for val in sym.assignable:
+                sym.set_value(val)
+        verify(state_str(c) == orig_state and
+               user_vals_str(c) == orig_user_vals,
+               "changing values in a copy of {} changed the original"
+               .format(fname))
+
+        c2.restore(snapshot)
+        verify(state_str(c2) == orig_state and
+               user_vals_str(c2) == orig_user_vals,
+               "restoring snapshot in a copy of {} failed".format(fname))
+
+        for invalidate in False, True:
+            for sym in c.defined_syms:
+                for val in sym.assignable:
+                    sym.set_value(val)
+
+            if invalidate:
+                # Snapshot restored with nothing cached
+                c.unset_values()
+                c.modules.set_value(0)
+                c.modules.unset_value()
+
+            c.restore(snapshot)
+            verify(user_vals_str(c) == orig_user_vals,
+                   "restoring snapshot in {} gave different user values"
+                   .format(fname))
+            verify(state_str(c) == orig_state,
+                   "restoring snapshot in {} gave different values"
+                   .format(fname))
+
+            # Restored cached values should be invalidated as usual
+            c.unset_values()
+            verify_same_state(Kconfig(fname, warn=False), c,
+                              "wrong values after restoring snapshot in {} "
+                              "and unsetting values".format(fname))
+            c.restore(snapshot)
+
+    for fname in value_test_fnames:
+        verify_snapshot(fname)
+
+
+    print("Testing randconfig()")
+
+    def verify_randconfig(fname):
+        c = Kconfig(fname, warn=False)
+        c2 = Kconfig(fname, warn=False)
+
+        for sym in c.defined_syms[::3]:
+            if sym.assignable:
+                sym.set_value(sym.assignable[0])
+        orig_user_vals = user_vals_str(c)
+
+        header = "# randconfig\n"
+        configs = c.randconfigs(range(20), header=header)
+
+        verify(user_vals_str(c) == orig_user_vals,
+               "randconfigs() did not restore the user values in {}"
+               .format(fname))
+
+        for seed, contents in enumerate(configs):
+            c2.randconfig(seed)
+            verify(c2._config_contents(header) == contents,
+                   "randconfig() with seed {} in {} differs from "
+                   "randconfigs()".format(seed, fname))
+
+            # A random configuration should load back to itself
+            with open("Kconfiglib/tests/config_rand", "w") as f:
+                f.write(contents)
+            c2.load_config("Kconfiglib/tests/config_rand")
+            verify(c2._config_contents(header) == contents,
+                   "configuration from randconfig() with seed {} in {} "
+                   "changed when loaded back".format(seed, fname))
+
+        verify(c.randconfigs(range(20), header=header) == configs,
+               "randconfigs() in {} is not deterministic".format(fname))
+
+        verify(c.randconfigs(range(20), processes=2, header=header) ==
+               configs,
+               "randconfigs() in {} gave different results with several "
+               "processes".format(fname))
+
+        # Seeds that don't split evenly between the processes
+        verify(c.randconfigs(range(7), processes=3, header=header) ==
+               configs[:7],
+               "randconfigs() in {} gave different results with uneven "
+               "chunks of seeds".format(fname))
+
+        os.remove("Kconfiglib/tests/config_rand")
+
+    for fname in ("Kassignable", "Kimply", "Kmisc", "Krange", "Kselect",
+                  "Kvisibility"):
+        verify_randconfig("Kconfiglib/tests/" + fname)
+
+    # Kvisibility has enough symbols that different seeds should give
+    # different configurations
+    c = Kconfig("Kconfiglib/tests/Kvisibility", warn=False)
+    verify(len(set(c.randconfigs(range(20)))) > 1,
+           "randconfigs() gave the same configuration for all seeds")
+
+    c.randconfig(0, probability=0)
+    verify(all(sym.user_value in (None, 0) or 0 not in sym.assignable
+               for sym in c.defined_syms
+               if sym.orig_type in (BOOL, TRISTATE) and not sym.choice),
+           "randconfig() with probability 0 set a symbol to m or y")
+
+    c.randconfig(0, probability=100)
+    verify(all(sym.user_value != 0
+               for sym in c.defined_syms
+               if sym.orig_type in (BOOL, TRISTATE) and not sym.choice),
+           "randconfig() with probability 100 set a symbol to n")
+
+
+    print("Testing write_min_config()")
+
+    c = Kconfig("Kconfiglib/tests/Kmin", warn=False)
+
+    def verify_min_config(contents):
+        c.write_min_config("Kconfiglib/tests/config_min", header="")
+        with open("Kconfiglib/tests/config_min") as f:
+            verify_equal(f.read(), textwrap.dedent(contents[1:]))
+
+    # The clamped default is always written out, like in the C tools
+    verify_min_config("""
+CONFIG_INT_CLAMPED=20
+""")
+
+    c.modules.set_value(2)
+    c.syms["DEF_Y"].set_value(0)
+    c.syms["DEF_N"].set_value(2)
+    c.syms["SELECTED"].set_value(0)
+    c.syms["SELECTED_M"].set_value(2)
+    c.syms["IMPLIED"].set_value(0)
+    c.syms["STR"].set_value("foo")
+    c.syms["INT"].set_value("11")
+    c.syms["INT_CLAMPED"].set_value("25")
+    c.syms["HEX"].set_value("0x1")
+    c.syms["CHOICE_2"].set_value(2)
+    c.syms["CHOICE_DEF_2"].set_value(2)
+    c.syms["OPT_CHOICE_1"].choice.set_value(2)
+
+    verify_min_config("""
+CONFIG_MODULES=y
+# CONFIG_DEF_Y is not set
+CONFIG_DEF_N=y
+CONFIG_SELECTED_M=y
+# CONFIG_IMPLIED is not set
+CONFIG_INT=11
+CONFIG_INT_CLAMPED=25
+CONFIG_HEX=0x1
+CONFIG_CHOICE_2=y
+CONFIG_OPT_CHOICE_1=y
+""")
+
+    c.syms["SELECTOR"].set_value(0)
+    c.syms["IMPLIER"].set_value(0)
+    c.syms["CHOICE_1"].set_value(2)
+
+    verify_min_config("""
+CONFIG_MODULES=y
+# CONFIG_DEF_Y is not set
+CONFIG_DEF_N=y
+# CONFIG_SELECTOR is not set
+CONFIG_SELECTED_M=y
+# CONFIG_IMPLIER is not set
+CONFIG_INT=11
+CONFIG_INT_CLAMPED=25
+CONFIG_HEX=0x1
+CONFIG_OPT_CHOICE_1=y
+""")
+
+    # Loading a minimal configuration should give back the full
+    # configuration. Kconfig files with tristate choices are skipped, because
+    # a y-mode choice with the default selection is stored as an m-mode
+    # choice, like in the C tools.
+
+    for fname in ("Keval", "Kimply", "Kmin", "Kmisc", "Krange",
+                  "Krelation", "Kselect", "Kstr"):
+        c = Kconfig("Kconfiglib/tests/" + fname, warn=False)
+        c2 = Kconfig("Kconfiglib/tests/" + fname, warn=False)
+        for seed in range(20):
+            c.randconfig(seed)
+            c.write_min_config("Kconfiglib/tests/config_min")
+            c2.load_config("Kconfiglib/tests/config_min")
+            verify(c2._config_contents("") == c._config_contents(""),
+                   "loading the minimal configuration for seed {} in {} "
+                   "did not give back the full configuration"
+                   .format(seed, fname))
+
+    os.remove("Kconfiglib/tests/config_min")
+
+
+    print("Testing allyesconfig()/allnoconfig()/alldefconfig()")
+
+    def plain_allyesconfig(c):
+        # Straightforward multi-pass version, like examples/allyesconfig.py
+        while True:
+            changed = False
+
+            for item in [sym for sym in c.defined_syms if not sym.choice] + \
+                        c._choices:
+                if item.assignable and item.tri_value < item.assignable[-1]:
+                    item.set_value(item.assignable[-1])
+                    changed = True
+
+                    if isinstance(item, Choice) and item.tri_value == 1:
+                        for sym in item.syms:
+                            sym.set_value(1)
+
+            if not changed:
+                break
+
+    def plain_allnoconfig(c):
+        # Straightforward multi-pass version, like examples/allnoconfig.py
+        for sym in c.defined_syms:
+            if sym.is_allnoconfig_y:
+                sym.set_value(2)
+
+        while True:
+            changed = False
+
+            for sym in menu_order_syms(c):
+                if not sym.is_allnoconfig_y and sym.assignable and \
+                   sym.assignable[0] < sym.tri_value:
+                    sym.set_value(sym.assignable[0])
+                    changed = True
+
+            if not changed:
+                break
+
+    def menu_order_syms(c):
+        # Returns all symbols in menu order, once for each menu node
+        res = []
+
+        def rec(node):
+            while node:
+                if isinstance(node.item, Symbol):
+                    res.append(node.item)
+                rec(node.list)
+                node = node.next
+
+        rec(c.top_node)
+        return res
+
+    def config_str(c):
+        c.write_config("Kconfiglib/tests/config_all")
+        with open("Kconfiglib/tests/config_all") as f:
+            return f.read()
+
+    for fname in ("Kassignable", "Kchoice", "Kimply", "Kmisc", "Kselect",
+                  "Kvisibility"):
+        fname = "Kconfiglib/tests/" + fname
+
+        for method, plain in (("allyesconfig", plain_allyesconfig),
+                              ("allnoconfig", plain_allnoconfig)):
+            c = Kconfig(fname, warn=False)
+            plain(c)
+            plain_res = config_str(c)
+
+            # Start from a different configuration, which should be cleared
+            c = Kconfig(fname, warn=False)
+            for sym in c.defined_syms:
+                if sym.assignable:
+                    sym.set_value(sym.assignable[len(sym.assignable)//2])
+
+            getattr(c, method)()
+            verify(config_str(c) == plain_res,
+                   "Kconfig.{}() differs from plain passes for {}"
+                   .format(method, fname))
+
+        c = Kconfig(fname, warn=False)
+        defconfig_res = config_str(c)
+        c.allyesconfig()
+        c.alldefconfig()
+        verify(config_str(c) == defconfig_res,
+               "Kconfig.alldefconfig() did not restore the defaults for {}"
+               .format(fname))
+
+    os.remove("Kconfiglib/tests/config_all")
+
+
+    print("Testing sync_deps()")
+
+    deps_dir = "Kconfiglib/tests/sync_deps_test"
+
+    def dep_file(name):
+        return os.path.join(deps_dir, *name.lower().split("_")) + ".h"
+
+    def reset_mtimes():
+        # Sets the modification time of all dependency files to 0, so that
+        # touched files can be told apart
+        for dirpath, _, fnames in os.walk(deps_dir):
+            for fname in fnames:
+                if fname.endswith(".h"):
+                    os.utime(os.path.join(dirpath, fname), (0, 0))
+
+    def verify_touched(changed, expected_changed, touched):
+        verify(changed == expected_changed,
+               "sync_deps() returned {}, expected {}"
+               .format(changed, expected_changed))
+
+        for name in "BOOL_SYM", "STRING_SYM", "INT_SYM", "N_SYM":
+            path = dep_file(name)
+            was_touched = os.path.exists(path) and \
+                          os.stat(path).st_mtime != 0
+            verify(was_touched == (name in touched),
+                   "{} should{} have been touched"
+                   .format(path, "" if name in touched else " not"))
+
+        reset_mtimes()
+
+    if os.path.exists(deps_dir):
+        shutil.rmtree(deps_dir)
+
+    c = Kconfig("Kconfiglib/tests/Ksync_deps")
+
+    # Everything with a non-n value counts as changed on the first call
+    verify_touched(c.sync_deps(deps_dir), True, ("STRING_SYM", "INT_SYM"))
+    verify_file_contents(os.path.join(deps_dir, "auto.conf"),
+                         'CONFIG_STRING_SYM="foo"\nCONFIG_INT_SYM=3\n')
+
+    verify_touched(c.sync_deps(deps_dir), False, ())
+
+    c.syms["BOOL_SYM"].set_value(2)
+    c.syms["INT_SYM"].set_value("4")
+    verify_touched(c.sync_deps(deps_dir), True, ("BOOL_SYM", "INT_SYM"))
+
+    # Values should be picked up from auto.conf by a new instance
+    c = Kconfig("Kconfiglib/tests/Ksync_deps")
+    c.syms["BOOL_SYM"].set_value(2)
+    c.syms["INT_SYM"].set_value("4")
+    verify_touched(c.sync_deps(deps_dir), False, ())
+
+    # Changing to n, and changing a string to something that needs escaping
+    c.syms["BOOL_SYM"].set_value(0)
+    c.syms["STRING_SYM"].set_value('"')
+    verify_touched(c.sync_deps(deps_dir), True, ("BOOL_SYM", "STRING_SYM"))
+    verify_file_contents(os.path.join(deps_dir, "auto.conf"),
+                         'CONFIG_STRING_SYM="\\""\nCONFIG_INT_SYM=4\n')
+    verify_touched(c.sync_deps(deps_dir), False, ())
+
+    # Symbols removed from the Kconfig files count as changed
+    c = Kconfig("Kconfiglib/tests/Kappend")
+    verify_touched(c.sync_deps(deps_dir), True, ("STRING_SYM", "INT_SYM"))
+
+    shutil.rmtree(deps_dir)
+
+
+    print("Testing parse cache")
+
+    cache_file = "Kconfiglib/tests/cache_test"
+
+    def kconfig_str(c):
+        # Returns a string with all menu nodes (with locations) and symbol
+        # values in 'c', for comparing configurations
+        res = []
+
+        def add_nodes(node):
+            while node:
+                res.append("{}:{}\n{}".format(node.filename, node.linenr,
+                                              node))
+                add_nodes(node.list)
+                node = node.next
+
+        add_nodes(c.top_node)
+
+        for name in sorted(c.syms):
+            res.append("{}={}".format(name, c.syms[name].str_value))
+
+        return "\n".join(res)
+
+    def cache_stat():
+        st = os.stat(cache_file)
+        return (st.st_ino, st.st_mtime)
+
+    def verify_cache(fname, cached):
+        # Creates a Kconfig with 'cache_file' and verifies that it matches a
+        # Kconfig created without it. 'cached' is True if the Kconfig should
+        # be loaded from an existing cache file.
+        old_stat = cache_stat() if os.path.exists(cache_file) else None
+
+        c_cache = Kconfig(fname, warn=False, cache_file=cache_file)
+        c = Kconfig(fname, warn=False)
+
+        verify(kconfig_str(c_cache) == kconfig_str(c),
+               "{} loaded with cache file differs from plain {}"
+               .format(fname, fname))
+        verify(c_cache.kconfig_filenames == c.kconfig_filenames and
+               c_cache.env_vars == c.env_vars,
+               "wrong kconfig_filenames or env_vars with cache file")
+
+        if cached:
+            verify(cache_stat() == old_stat,
+                   "expected {} to be loaded from the cache".format(fname))
+        else:
+            verify(cache_stat() != old_stat,
+                   "expected {} to be parsed and cached".format(fname))
+
+        return c_cache
+
+    if os.path.exists(cache_file):
+        os.remove(cache_file)
+
+    # Uses 'source', 'rsource', and $srctree. See the location tests above.
+    os.environ["TESTS_DIR_FROM_ENV"] = "tests"
+    os.environ["SUB_DIR_FROM_ENV"] = "sub"
+    os.environ["srctree"] = "Kconfiglib/"
+
+    c = verify_cache("tests/Klocation", False)
+    verify_equal(c.kconfig_filenames,
+                 ["Kconfiglib/tests/Klocation",
+                  "Kconfiglib/tests/Klocation_sourced",
+                  "Kconfiglib/tests/sub/Klocation_rsourced"])
+    verify_equal(c.env_vars, set(("TESTS_DIR_FROM_ENV", "SUB_DIR_FROM_ENV")))
+
+    verify_cache("tests/Klocation", True)
+
+    # Changing $srctree should invalidate the cache. Go via a path that
+    # resolves to the same files.
+    os.environ["srctree"] = "Kconfiglib/tests/../"
+    verify_cache("tests/Klocation", False)
+
+    os.environ.pop("TESTS_DIR_FROM_ENV", None)
+    os.environ.pop("SUB_DIR_FROM_ENV", None)
+    os.environ.pop("srctree", None)
+
+    # Different Kconfig file
+    os.environ["ENV_VAR"] = "foo"
+    verify_cache("Kconfiglib/tests/Kmisc", False)
+    c = verify_cache("Kconfiglib/tests/Kmisc", True)
+    verify_value("FROM_ENV", "foo")
+
+    # Changing an 'option env' variable should invalidate the cache
+    os.environ["ENV_VAR"] = "bar"
+    c = verify_cache("Kconfiglib/tests/Kmisc", False)
+    verify_value("FROM_ENV", "bar")
+    verify_cache("Kconfiglib/tests/Kmisc", True)
+
+    # Changing the modification time of a Kconfig file should invalidate the
+    # cache
+    kmisc_stat = os.stat("Kconfiglib/tests/Kmisc")
+    os.utime("Kconfiglib/tests/Kmisc",
+             (kmisc_stat.st_atime, kmisc_stat.st_mtime + 10))
+    try:
+        verify_cache("Kconfiglib/tests/Kmisc", False)
+    finally:
+        os.utime("Kconfiglib/tests/Kmisc",
+                 (kmisc_stat.st_atime, kmisc_stat.st_mtime))
+
+    # A corrupt cache file should be ignored
+    with open(cache_file, "wb") as f:
+        f.write(b"garbage")
+    verify_cache("Kconfiglib/tests/Kmisc", False)
+
+    # Help texts are stored differently with lazy_help=True, so a cache file
+    # written with it shouldn't be loaded without it (and vice versa)
+    Kconfig("Kconfiglib/tests/Khelp", warn=False, cache_file=cache_file,
+            lazy_help=True)
+    c = verify_cache("Kconfiglib/tests/Khelp", False)
+    verify(isinstance(c.syms["TRICKY_HELP"].nodes[0]._help, str),
+           "help text location loaded from cache without lazy_help=True")
+
+    os.environ.pop("ENV_VAR", None)
+    os.remove(cache_file)
+
+
+    print("Testing parallel parsing")
+
+    def parse_str(fname, parse_processes, scanner_tokenizer=False):
+        # Returns a string with the parsed configuration from 'fname' and the
+        # warnings generated while parsing it, or the error message if parsing
+        # fails
+
+        old_stderr = sys.stderr
+        sys.stderr = collector = StderrCollector()
+        try:
+            c = Kconfig(fname, parse_processes=parse_processes,
+                        scanner_tokenizer=scanner_tokenizer)
+        except (KconfigSyntaxError, IOError) as e:
+            return str(e)
+        finally:
+            sys.stderr = old_stderr
+
+        # Symbols are registered in the order they're first seen
+        return "{}\n{}\n{}\n{}\n{}".format(
+            kconfig_str(c), list(c.syms), list(c.const_syms),
+            c.kconfig_filenames, "\n".join(collector.lines))
+
+    def verify_parallel_parse(fname):
+        serial_str = parse_str(fname, 1)
+        verify(parse_str(fname, 2) == serial_str,
+               "{} parsed with parse_processes=2 differs from serial parsing"
+               .format(fname))
+        # The worker processes use the scanner tokenizer too in this case
+        verify(parse_str(fname, 2, True) == serial_str,
+               "{} parsed with parse_processes=2 and scanner_tokenizer=True "
+               "differs from serial parsing".format(fname))
+
+    # Sourced with 'source "$ENV_SYM"' in Kpreparse, which leaves the file to
+    # be tokenized while parsing
+    os.environ["ENV_VAR"] = "Kconfiglib/tests/sub/Kpreparse_sourced"
+
+    for fname in sorted(os.listdir("Kconfiglib/tests")):
+        if fname.startswith("K"):
+            verify_parallel_parse(os.path.join("Kconfiglib/tests", fname))
+
+    os.environ.pop("ENV_VAR", None)
+
+    # Help texts should be skipped in worker processes. The 'source' inside
+    # the help text in Kpreparse shouldn't show up in the list of sourced
+    # files.
+
+    from kconfiglib import _PreTokenizer
+
+    verify_equal(_PreTokenizer("", False)
+                 .tokenize_file("Kconfiglib/tests/Kpreparse")[2],
+                 ["Kconfiglib/tests/sub/Kpreparse_sourced"])
+
+    # parse_processes=None should only start worker processes if there are
+    # several CPUs
+
+    import multiprocessing
+
+    def verify_pretokenize_processes(n_cpus, expected_processes):
+        pretokenize_processes = []
+
+        def pretokenize(self, filename, processes):
+            pretokenize_processes.append(processes)
+            return {}
+
+        old_cpu_count = multiprocessing.cpu_count
+        old_pretokenize = Kconfig._pretokenize
+        multiprocessing.cpu_count = lambda: n_cpus
+        Kconfig._pretokenize = pretokenize
+        try:
+            Kconfig("Kconfiglib/tests/Kchoice", warn=False,
+                    parse_processes=None)
+        finally:
+            multiprocessing.cpu_count = old_cpu_count
+            Kconfig._pretokenize = old_pretokenize
+
+        verify_equal(pretokenize_processes, expected_processes)
+
+    verify_pretokenize_processes(1, [])
+    verify_pretokenize_processes(4, [4])
+
+    # 'source' and 'rsource' with symbol references, which are tokenized
+    # while parsing, and $srctree, which is passed to the worker processes
+    os.environ["TESTS_DIR_FROM_ENV"] = "tests"
+    os.environ["SUB_DIR_FROM_ENV"] = "sub"
+    os.environ["srctree"] = "Kconfiglib/"
+
+    verify_parallel_parse("tests/Klocation")
+
+    os.environ.pop("TESTS_DIR_FROM_ENV", None)
+    os.environ.pop("SUB_DIR_FROM_ENV", None)
+    os.environ.pop("srctree", None)
+
+
+    print("Testing pickling")
+
+    c = Kconfig("Kconfiglib/tests/Kchoice", warn=False)
+    c.disable_redun_warnings()
+    c.syms["MODULES"].set_value(2)
+    c.syms["T_1"].set_value(1)
+    c.named_choices["BOOL"].set_value(2)
+    c_str = kconfig_str(c)
+
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        c2 = pickle.loads(pickle.dumps(c, protocol))
+        verify(kconfig_str(c2) == c_str,
+               "Kconfig changed when pickled with protocol {}"
+               .format(protocol))
+        verify(not c2._print_warnings and not c2._print_redun_assign,
+               "warning settings lost when pickling")
+        verify_equal(c2.syms["T_1"].user_value, 1)
+
+    # Unpickled and copied configurations are independent of the original,
+    # and can be modified
+    for c2 in pickle.loads(pickle.dumps(c, pickle.HIGHEST_PROTOCOL)), \
+              copy.deepcopy(c):
+        verify(c2.syms["MODULES"] is not c.syms["MODULES"],
+               "copied Kconfig shares symbols with the original")
+        c2.syms["MODULES"].set_value(0)
+        verify_equal(c2.syms["MODULES"].str_value, "n")
+        verify_equal(c.syms["MODULES"].str_value, "y")
+        verify_equal(c.syms["T_1"].str_value, "m")
+        c2.load_config("Kconfiglib/tests/empty")
+        verify(kconfig_str(c) == c_str, "original Kconfig modified")
+
+
+    print("Testing string interning")
+
+    def strings(c):
+        # Returns a list with the symbol names, filenames, prompts, and help
+        # texts in 'c'. The order of Kconfig.syms isn't preserved by pickling
+        # on Python 2, so the symbol names are listed in sorted order.
+        names = sorted(c.syms)
+        res = names + [c.syms[name].name for name in names] + \
+              c.kconfig_filenames
+
+        def add_strings(node):
+            while node:
+                res.append(node.filename)
+                if node.prompt:
+                    res.append(node.prompt[0])
+                if isinstance(node.item, (Symbol, Choice)) and \
+                   node.help is not None:
+                    res.append(node.help)
+
+                add_strings(node.list)
+                node = node.next
+
+        add_strings(c.top_node)
+
+        return res
+
+    def verify_shared_strings(c1, c2):
+        # Verifies that the strings in 'c1' and 'c2' are the same objects
+        verify_equal(sorted(c1.syms), sorted(c2.syms))
+        for s1, s2 in zip(strings(c1), strings(c2)):
+            verify(s1 is s2,
+                   "expected '{}' to be shared between Kconfig instances"
+                   .format(s1))
+
+    c = Kconfig("Kconfiglib/tests/Krepr", warn=False)
+
+    verify_shared_strings(c, Kconfig("Kconfiglib/tests/Krepr", warn=False))
+    verify_shared_strings(c, Kconfig("Kconfiglib/tests/Krepr", warn=False,
+                                     lazy_help=True))
+    verify_shared_strings(c, Kconfig("Kconfiglib/tests/Krepr", warn=False,
+                                     parse_processes=2))
+    verify_shared_strings(c, pickle.loads(pickle.dumps(c)))
+
+
+    print("Testing parse_many()")
+
+    configs = [("Kconfiglib/tests/Kmisc", {"ENV_VAR": "foo"}),
+               ("Kconfiglib/tests/Kmisc", {"ENV_VAR": "bar"}),
+               ("tests/Klocation", {"TESTS_DIR_FROM_ENV": "tests",
+                                    "SUB_DIR_FROM_ENV": "sub",
+                                    "srctree": "Kconfiglib/"}),
+               ("Kconfiglib/tests/Kchoice", {"srctree": None})]
+
+    def serial_parse(fname, env):
+        # Parses 'fname' with the variables from 'env' set, restoring
+        # os.environ afterwards
+        old_environ = dict(os.environ)
+        try:
+            for var, val in env.items():
+                if val is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = val
+            return Kconfig(fname, warn=False)
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+    old_environ = dict(os.environ)
+
+    kconfs = parse_many(configs, processes=2, warn=False)
+    verify_equal(len(kconfs), len(configs))
+    for (fname, env), c in zip(configs, kconfs):
+        serial_c = serial_parse(fname, env)
+        verify(kconfig_str(c) == kconfig_str(serial_c),
+               "{} from parse_many() differs from a plain parse with {}"
+               .format(fname, env))
+        verify_equal(c.srctree, serial_c.srctree)
+        verify_equal(c.kconfig_filenames, serial_c.kconfig_filenames)
+
+    # The loaded instances should work normally
+    c = kconfs[0]
+    verify_value("FROM_ENV", "foo")
+    c.syms["STRING"].set_value("foo")
+    verify_value("STRING", "foo")
+    c = kconfs[1]
+    verify_value("FROM_ENV", "bar")
+    verify_value("STRING", "")
+
+    verify_equal(parse_many(configs, processes=2, summarize=sym_names,
+                            warn=False),
+                 [sym_names(serial_parse(fname, env))
+                  for fname, env in configs])
+
+    verify(os.environ == old_environ,
+           "parse_many() modified os.environ")
+
+
+    print("Testing kconfig_server.py")
+
+    sys.path.insert(0, "Kconfiglib/examples")
+    try:
+        from kconfig_server import KconfigServer, KconfigClient
+    finally:
+        del sys.path[0]
+
+    sock_path = "Kconfiglib/tests/kconfig_server_test.sock"
+    server_config = "Kconfiglib/tests/config_test_from_server"
+    local_config = "Kconfiglib/tests/config_test_from_local"
+
+    server = KconfigServer(sock_path)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    try:
+        c = Kconfig("Kconfiglib/tests/Kmisc", warn=False)
+
+        with KconfigClient(sock_path, "Kconfiglib/tests/Kmisc",
+                           warn=False) as client:
+            # Values should round-trip through the protocol like with a local
+            # Kconfig instance
+            for name, val in ("STRING", "foo"), ("TRISTATE", 1), \
+                             ("B", 2), ("C", 1):
+                verify_equal(client.syms[name].set_value(val),
+                             c.syms[name].set_value(val))
+                verify_equal(client.syms[name].str_value,
+                             c.syms[name].str_value)
+                verify_equal(client.syms[name].user_value,
+                             c.syms[name].user_value)
+
+            for expr in "B && !A", "C || TRISTATE", 'STRING = "foo"':
+                verify_equal(client.eval_string(expr), c.eval_string(expr))
+
+            client.write_config(server_config)
+            c.write_config(local_config)
+            with open(local_config) as f:
+                verify_file_contents(server_config, f.read())
+
+
+        with KconfigClient(sock_path, "Kconfiglib/tests/Kmisc",
+                           warn=False) as client:
+            verify_equal(client.syms["TRISTATE"].user_value, None)
+            verify_equal(client.eval_string("TRISTATE"),
+                         Kconfig("Kconfiglib/tests/Kmisc", warn=False)
+                         .eval_string("TRISTATE"))
+    finally:
+        server.shutdown()
+        server_thread.join()
+        server.server_close()
+        for fname in sock_path, server_config, local_config:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+
     print("\nAll selftests passed\n" if all_passed else
           "\nSome selftests failed\n")
 
+def sym_names(kconf):
+    """
+    Returns a sorted list with the names of all symbols in 'kconf'. Used as a
+    parse_many() summary function. Needs to be at the module level to be
+    picklable.
+    """
+    return sorted(kconf.syms)
+
 def run_compatibility_tests():
     """
     Runs tests on configurations from the kernel. Tests compability with the
@@ -1734,7 +3166,10 @@ def run_compatibility_tests():
                       (test_sanity,         False),
                       (test_all_no,         True),
                       (test_all_no_simpler, True),
-                      (test_all_yes,        True))
+                      (test_all_no_method,  True),
+                      (test_all_yes,        True),
+                      (test_all_yes_method, True),
+                      (test_min_config,     True))
 
     for test_fn, compare_configs in all_arch_tests:
         # The test description is taken from the docstring of the corresponding
@@ -1838,6 +3273,45 @@ def test_all_yes(conf, arch, srcarch):
     else:
         shell("make allyesconfig")
 
+def test_all_no_method(conf, arch, srcarch):
+    """
+    Verify that Kconfig.allnoconfig() generates the same .config as
+    'make allnoconfig', for each architecture
+    """
+    conf.allnoconfig()
+    conf.write_config("._config")
+    if speedy:
+        shell("scripts/kconfig/conf --allnoconfig Kconfig")
+    else:
+        shell("make allnoconfig")
+
+def test_all_yes_method(conf, arch, srcarch):
+    """
+    Verify that Kconfig.allyesconfig() generates the same .config as
+    'make allyesconfig', for each architecture
+    """
+    conf.allyesconfig()
+    conf.write_config("._config")
+    if speedy:
+        shell("scripts/kconfig/conf --allyesconfig Kconfig")
+    else:
+        shell("make allyesconfig")
+
+def test_min_config(conf, arch, srcarch):
+    """
+    Verify that Kconfig.write_min_config() generates the same file as
+    'make savedefconfig' for 'make allyesconfig', for each architecture
+    """
+    conf.allyesconfig()
+    conf.write_min_config("._config")
+    if speedy:
+        shell("scripts/kconfig/conf --allyesconfig Kconfig")
+        shell("scripts/kconfig/conf --savedefconfig=.config Kconfig")
+    else:
+        shell("make allyesconfig")
+        shell("make savedefconfig")
+        shell("mv defconfig .config")
+
 def test_sanity(conf, arch, srcarch):
     """
     Do sanity checks on each configuration and call all public methods on all